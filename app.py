@@ -1,15 +1,103 @@
-from flask import Flask, render_template, request, jsonify
-from google import genai
-from google.genai import types
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 import os
+import re
+import json
+import math
+import mimetypes
 import time
-from werkzeug.utils import secure_filename
+import uuid
+import zipfile
 import logging
-import requests
+import threading
+from jobs import JobManager
+from client_pool import ClientPool, build_session, hash_key
+from upload_stream import SpooledRequest, detach_upload, remove_stale_files, upload_stats
+from query_cache import build_cache, make_key
+from document_listing import DocumentListCache, DocumentLister, document_to_dict
+from dedup import UploadManifest
+from chunked_upload import ChunkedUploads
+from operation_store import OperationStore
+from metadata_index import STORES_SCOPE, MetadataIndex, matches, parse_filter, store_to_dict
+import retrieval_index
+from batch_ingest import (RUNNING as BATCH_RUNNING, BatchIngestor, BatchItem, BatchProgress, apply_metadata,
+                          items_from_zip)
+from chunking import can_split, piece_size_bytes, split_items
+import grounding
+from sessions import SessionManager
+from model_routing import ModelRouter, parse_routes, parse_tiers
+from singleflight import SingleFlight
+from query_batch import QueryBatch, batch_job_finished, create_batch_job, normalize_queries
+import metrics
+import lazy_import
+import response_encoding
+from tracing import InstrumentedClient, end_trace, span, start_trace
+from upstream_guard import GuardedClient, UpstreamGuard, UpstreamUnavailable, parse_limits
+
+# The SDK is ~70% of import time and no route needs it before its first Gemini call
+genai = lazy_import.lazy_module('google.genai')
+types = lazy_import.lazy_module('google.genai.types')
 
 app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 100)) * 1024 * 1024  # 100MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
+# Local state (SQLite manifests, indexes) lives here
+app.config['DATA_FOLDER'] = os.environ.get('DATA_FOLDER', 'data')
+# Uploads up to this size stay in memory; larger ones spill to an anonymous temp file
+app.config['UPLOAD_SPOOL_MAX_MEMORY'] = int(os.environ.get('UPLOAD_SPOOL_MAX_MEMORY', 8 * 1024 * 1024))
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 4))
+app.config['JOB_MAX_SECONDS'] = int(os.environ.get('JOB_MAX_SECONDS', 3600))
+# On shutdown, pending jobs get this long to finish; persisted ones resume on the next start
+app.config['JOB_DRAIN_SECONDS'] = float(os.environ.get('JOB_DRAIN_SECONDS', 20))
+# Files in uploads/ untouched for this long are leftovers of a crashed run
+app.config['UPLOAD_ORPHAN_SECONDS'] = int(os.environ.get('UPLOAD_ORPHAN_SECONDS', 3600))
+app.config['BATCH_PROGRESS_RETENTION'] = int(os.environ.get('BATCH_PROGRESS_RETENTION', 7 * 24 * 3600))
+# Resumable browser uploads: chunk size offered to clients and how long an idle upload is kept
+app.config['CHUNK_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'chunked')
+app.config['CHUNK_UPLOAD_SIZE'] = int(os.environ.get('CHUNK_UPLOAD_SIZE_MB', 8)) * 1024 * 1024
+app.config['CHUNK_UPLOAD_RETENTION'] = int(os.environ.get('CHUNK_UPLOAD_RETENTION', 24 * 3600))
+# 'fake' serves every request from the in-memory fake_genai backend (benchmarks, offline dev)
+app.config['GEMINI_BACKEND'] = os.environ.get('GEMINI_BACKEND', 'genai')
+# Compress JSON/text responses of at least COMPRESS_MIN_BYTES with the first of these the client accepts ('' = off)
+app.config['RESPONSE_COMPRESSION'] = os.environ.get('RESPONSE_COMPRESSION', 'br,gzip')
+app.config['COMPRESS_MIN_BYTES'] = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+# Import the deferred SDK modules in the background once the server is up ('0' = on first use)
+app.config['IMPORT_WARMUP'] = os.environ.get('IMPORT_WARMUP', '1') == '1'
+app.config['CLIENT_POOL_SIZE'] = int(os.environ.get('CLIENT_POOL_SIZE', 32))
+app.config['CLIENT_IDLE_SECONDS'] = int(os.environ.get('CLIENT_IDLE_SECONDS', 600))
+app.config['QUERY_CACHE_BACKEND'] = os.environ.get('QUERY_CACHE_BACKEND', 'memory')  # memory or redis
+app.config['QUERY_CACHE_TTL'] = int(os.environ.get('QUERY_CACHE_TTL', 300))
+app.config['QUERY_CACHE_MAX_ENTRIES'] = int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', 1024))
+app.config['REDIS_URL'] = os.environ.get('REDIS_URL')
+app.config['DOCUMENT_CACHE_TTL'] = int(os.environ.get('DOCUMENT_CACHE_TTL', 300))
+# Indexed store/document listings older than this are refreshed in the background
+app.config['METADATA_RECONCILE_SECONDS'] = int(os.environ.get('METADATA_RECONCILE_SECONDS', 60))
+# Check queries against the local BM25 index of uploaded text first: 'narrow' drops stores
+# with no matching document, 'full' also answers "no matching documents" without a call
+app.config['QUERY_PREFILTER'] = os.environ.get('QUERY_PREFILTER', 'off')
+app.config['LOCAL_INDEX_MAX_BYTES'] = int(os.environ.get('LOCAL_INDEX_MAX_MB', 8)) * 1024 * 1024
+app.config['BATCH_MAX_CONCURRENCY'] = int(os.environ.get('BATCH_MAX_CONCURRENCY', 8))
+app.config['BATCH_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'batches')
+# Text files and PDFs larger than this are split into pieces ingested in parallel (0 = only on request)
+app.config['UPLOAD_PIECE_SIZE_MB'] = float(os.environ.get('UPLOAD_PIECE_SIZE_MB', 0))
+app.config['QUERY_BATCH_MAX_QUERIES'] = int(os.environ.get('QUERY_BATCH_MAX_QUERIES', 1000))
+app.config['QUERY_BATCH_MAX_CONCURRENCY'] = int(os.environ.get('QUERY_BATCH_MAX_CONCURRENCY', 16))
+# Model tiers ("fast=gemini-2.5-flash:0,deep=gemini-2.5-pro:-1", model:thinking budget)
+# and the tier each route uses by default ("query=auto,query-batch=fast")
+app.config['MODEL_TIERS'] = parse_tiers(os.environ.get('MODEL_TIERS'))
+app.config['MODEL_ROUTE_DEFAULTS'] = parse_routes(os.environ.get('MODEL_ROUTE_DEFAULTS'))
+# Multi-turn sessions: history kept server-side, bounded per session and overall
+app.config['SESSION_MAX'] = int(os.environ.get('SESSION_MAX', 256))
+app.config['SESSION_TTL'] = int(os.environ.get('SESSION_TTL', 1800))
+app.config['SESSION_MAX_TURNS'] = int(os.environ.get('SESSION_MAX_TURNS', 20))
+# Session prefixes at least this large (tokens) go into a Gemini context cache
+app.config['SESSION_CACHE_MIN_TOKENS'] = int(os.environ.get('SESSION_CACHE_MIN_TOKENS', 2048))
+app.config['SESSION_CONTEXT_CACHE'] = os.environ.get('SESSION_CONTEXT_CACHE', 'true').lower() == 'true'
+# Client-side limits per API key, e.g. "generate=5:10,upload=2" (calls/second:burst)
+app.config['UPSTREAM_RATE_LIMITS'] = parse_limits(os.environ.get('UPSTREAM_RATE_LIMITS'))
+app.config['UPSTREAM_MAX_WAIT'] = float(os.environ.get('UPSTREAM_MAX_WAIT', 5.0))
+app.config['UPSTREAM_BREAKER_FAILURES'] = int(os.environ.get('UPSTREAM_BREAKER_FAILURES', 5))
+app.config['UPSTREAM_BREAKER_RESET'] = float(os.environ.get('UPSTREAM_BREAKER_RESET', 30.0))
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,14 +105,355 @@ logger = logging.getLogger(__name__)
 
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['BATCH_FOLDER'], exist_ok=True)
+os.makedirs(app.config['CHUNK_FOLDER'], exist_ok=True)
+os.makedirs(app.config['DATA_FOLDER'], exist_ok=True)
+
+# Stream uploaded files to Gemini from their parse buffer instead of re-staging them
+SpooledRequest.spool_max_memory = app.config['UPLOAD_SPOOL_MAX_MEMORY']
+SpooledRequest.spool_dir = app.config['UPLOAD_FOLDER']
+app.request_class = SpooledRequest
+
+# Leftovers of earlier runs: stale spool files and progress of long-finished batches
+stale_files, stale_bytes = remove_stale_files(app.config['UPLOAD_FOLDER'], app.config['UPLOAD_ORPHAN_SECONDS'])
+batch_files, batch_bytes = remove_stale_files(app.config['BATCH_FOLDER'], app.config['BATCH_PROGRESS_RETENTION'])
+part_files, part_bytes = remove_stale_files(app.config['CHUNK_FOLDER'], app.config['CHUNK_UPLOAD_RETENTION'])
+orphan_cleanup = {'files': stale_files + batch_files + part_files, 'bytes': stale_bytes + batch_bytes + part_bytes}
+
+# Background jobs for long-running upload/import operations; pending operations
+# are persisted so they can be resumed after a restart
+operation_store = OperationStore(os.path.join(app.config['DATA_FOLDER'], 'operations.sqlite3'))
+jobs = JobManager(
+    max_workers=app.config['JOB_WORKERS'],
+    max_seconds=app.config['JOB_MAX_SECONDS'],
+    store=operation_store
+)
+metrics.REGISTRY.add_collector(lambda: metrics.jobs_pending.set(jobs.pending_count()))
+
+# Shared token buckets and circuit breakers in front of every Gemini call
+upstream_guard = UpstreamGuard(
+    limits=app.config['UPSTREAM_RATE_LIMITS'],
+    max_wait=app.config['UPSTREAM_MAX_WAIT'],
+    failure_threshold=app.config['UPSTREAM_BREAKER_FAILURES'],
+    reset_seconds=app.config['UPSTREAM_BREAKER_RESET']
+)
+
+# Reused Gemini clients (one per API key) and HTTP session for REST fallbacks
+def build_client(api_key):
+    """Create a Gemini client, or the local fake when GEMINI_BACKEND=fake"""
+    if app.config['GEMINI_BACKEND'] == 'fake':
+        from fake_genai import FakeClient
+        client = FakeClient(api_key=api_key)
+    else:
+        client = genai.Client(api_key=api_key)
+    # Calls rejected by the guard never reach the instrumented upstream client
+    return GuardedClient(InstrumentedClient(client), upstream_guard, hash_key(api_key))
+
+client_pool = ClientPool(
+    build_client,
+    max_size=app.config['CLIENT_POOL_SIZE'],
+    idle_seconds=app.config['CLIENT_IDLE_SECONDS']
+)
+http_session = lazy_import.Lazy(build_session, 'requests.Session')
+
+# Cached /api/query answers, invalidated whenever one of their stores changes
+query_cache = build_cache(
+    backend=app.config['QUERY_CACHE_BACKEND'],
+    ttl=app.config['QUERY_CACHE_TTL'],
+    max_entries=app.config['QUERY_CACHE_MAX_ENTRIES'],
+    redis_url=app.config['REDIS_URL']
+)
+
+# Stores, documents and custom_metadata as last listed, kept in step with our own writes
+metadata_index = MetadataIndex(
+    os.path.join(app.config['DATA_FOLDER'], 'metadata.sqlite3'),
+    reconcile_seconds=app.config['METADATA_RECONCILE_SECONDS']
+)
+
+# Inverted index of uploaded text for the query pre-filter
+retrieval = retrieval_index.RetrievalIndex(
+    os.path.join(app.config['DATA_FOLDER'], 'retrieval.sqlite3'),
+    max_bytes=app.config['LOCAL_INDEX_MAX_BYTES']
+)
+
+# Complete per-store document listings, patched in place after uploads/imports
+document_cache = DocumentListCache(ttl=app.config['DOCUMENT_CACHE_TTL'], index=metadata_index)
+
+# (store, content hash) -> document manifest used to skip duplicate uploads
+upload_manifest = UploadManifest(os.path.join(app.config['DATA_FOLDER'], 'dedup.sqlite3'))
+
+# Chunked, resumable browser uploads; a whole file is limited like a single upload
+chunked_uploads = ChunkedUploads(
+    app.config['CHUNK_FOLDER'],
+    os.path.join(app.config['DATA_FOLDER'], 'chunked_uploads.sqlite3'),
+    chunk_size=app.config['CHUNK_UPLOAD_SIZE'],
+    max_chunk_size=min(app.config['CHUNK_UPLOAD_SIZE'] * 4, app.config['MAX_CONTENT_LENGTH']),
+    max_size=app.config['MAX_CONTENT_LENGTH'],
+    retention=app.config['CHUNK_UPLOAD_RETENTION']
+)
+
+# Picks model, thinking budget and generation settings per query
+model_router = ModelRouter(tiers=app.config['MODEL_TIERS'], routes=app.config['MODEL_ROUTE_DEFAULTS'])
+
+# Identical concurrent listings/queries (per API key) share one upstream call
+flights = SingleFlight()
+
+# Conversation sessions for /api/sessions
+sessions = SessionManager(
+    model="gemini-2.5-flash",
+    max_sessions=app.config['SESSION_MAX'],
+    ttl=app.config['SESSION_TTL'],
+    max_turns=app.config['SESSION_MAX_TURNS'],
+    cache_min_tokens=app.config['SESSION_CACHE_MIN_TOKENS'],
+    cache_enabled=app.config['SESSION_CONTEXT_CACHE']
+)
+
+# Running and recently finished batch uploads, by batch ID
+batches = {}
+batches_lock = threading.Lock()
+
+def get_api_key():
+    """Get API key from request header or environment variable"""
+    return request.headers.get('X-API-Key') or os.environ.get('GEMINI_API_KEY')
+
+def api_key_hash(api_key=None):
+    """Stable, non-reversible identifier for an API key"""
+    return hash_key(api_key or get_api_key() or '')
+
+def store_changed(*store_names):
+    """Invalidate everything derived from these stores after a write"""
+    query_cache.invalidate_stores(store_names)
+    for store_name in store_names:
+        document_cache.drop(store_name)
+
+def store_deleted(store_name):
+    """Forget all local state about a deleted store"""
+    store_changed(store_name)
+    upload_manifest.forget_store(store_name)
+    metadata_index.forget_store(store_name)
+    retrieval.forget_store(store_name)
+
+def refresh_stores(client, owner):
+    """List every store from the API into the metadata index"""
+    return metadata_index.replace_stores(owner, [store_to_dict(store) for store in client.file_search_stores.list()])
+
+def refresh_documents(client, api_key, owner, store_name):
+    """Re-list a store's documents from the API into the caches and index"""
+    lister = DocumentLister(client, api_key, http_session, document_cache, owner)
+    documents = lister.refresh(store_name)
+    # A fresh full listing is authoritative; drop manifest entries for removed documents
+    upload_manifest.reconcile(store_name, [document['name'] for document in documents])
+
+def batch_running(store_names):
+    """Whether a batch (or split upload) is still adding documents to one of these stores"""
+    store_names = set(store_names)
+    with batches_lock:
+        return any(ingestor.status == BATCH_RUNNING and ingestor.store_name in store_names
+                   for ingestor in batches.values())
+
+def metadata_filter_error(store_names, metadata_filter, owner=None):
+    """400 response when the index knows `metadata_filter` matches no document, else None"""
+    # A running batch's documents may be missing from the index until it is re-listed
+    if not metadata_filter or batch_running(store_names):
+        return None
+    owner = owner or api_key_hash()
+    reason = metadata_index.check_filter(owner, store_names, metadata_filter)
+    if reason is None:
+        return None
+    return {'success': False, 'error': reason,
+            'metadata_keys': metadata_index.metadata_keys(owner, store_names)}
+
+def prefilter_mode(data):
+    """Pre-filter mode of a query body; raises ValueError if unknown"""
+    mode = data.get('prefilter') or app.config['QUERY_PREFILTER']
+    if mode not in retrieval_index.MODES:
+        raise ValueError(f"prefilter must be one of {', '.join(retrieval_index.MODES)}")
+    return mode
+
+def apply_prefilter(mode, query_text, store_names, metadata_filter, owner=None):
+    """Check a query against the local retrieval index
+
+    Returns the decision (see `RetrievalIndex.prefilter`), or None when the
+    pre-filter is off. Only documents the metadata_filter admits are scored.
+    """
+    if mode == 'off':
+        return None
+    owner = owner or api_key_hash()
+    tree = None
+    if metadata_filter:
+        try:
+            tree = parse_filter(metadata_filter)
+        except ValueError:
+            # The filter cannot be evaluated locally; every store stays uncovered
+            return retrieval.prefilter(query_text, {store_name: None for store_name in store_names}, mode)
+    stores = {}
+    for store_name in store_names:
+        # A store a batch is still adding to may hold documents the index has not seen
+        documents = None if batch_running([store_name]) else metadata_index.documents(owner, store_name)
+        if documents is not None and tree is not None:
+            documents = [document for document in documents if matches(tree, document['custom_metadata'])]
+        stores[store_name] = documents
+    decision = retrieval.prefilter(query_text, stores, mode)
+    if metadata_filter:
+        # Only proposed to narrow a query that has no filter yet
+        decision['suggested_filter'] = None
+    if decision['dropped']:
+        logger.info(f"Pre-filter dropped {len(decision['dropped'])} of {len(store_names)} store(s)")
+    return decision
+
+def no_match_message(decision):
+    return f"No matching documents in {len(decision['store_names'])} store(s)"
+
+def document_added(store_name, client, operation):
+    """Patch cached listings with a newly indexed document instead of refetching"""
+    query_cache.invalidate_stores([store_name])
+    document_name = getattr(getattr(operation, 'response', None), 'document_name', None)
+    try:
+        if not document_name:
+            raise ValueError('operation did not report a document name')
+        document = client.file_search_stores.documents.get(name=document_name)
+        document_cache.upsert(store_name, document_to_dict(document))
+    except Exception as e:
+        logger.warning(f"Could not update cached listing for {store_name}, dropping it: {e}")
+        document_cache.drop(store_name)
+
+def resume_operations(api_key):
+    """Pick up this API key's operations that were still pending at the last shutdown"""
+    owner = hash_key(api_key)
+    if jobs.has_unresumed(owner):
+        jobs.resume(owner, client_pool.get(api_key))
 
 # Helper function to get Gemini client
 def get_client():
     """Get Gemini client from request header or environment variable"""
-    api_key = request.headers.get('X-API-Key') or os.environ.get('GEMINI_API_KEY')
+    api_key = get_api_key()
     if not api_key:
         raise ValueError("API key not provided. Please set your API key in the settings.")
-    return genai.Client(api_key=api_key)
+    resume_operations(api_key)
+    return client_pool.get(api_key)
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider that measures response serialization time
+
+    Encodes compactly with orjson when it is installed (see response_encoding);
+    only debug mode's pretty-printed output goes through the stdlib encoder.
+    """
+
+    def encode(self, obj):
+        """UTF-8 encoded JSON for `obj`"""
+        with metrics.json_serialize_duration.time(), span('json.serialize'):
+            return response_encoding.dumps(obj, default=self.default)
+
+    def dumps(self, obj, **kwargs):
+        if kwargs.get('indent'):
+            with metrics.json_serialize_duration.time(), span('json.serialize'):
+                return super().dumps(obj, **kwargs)
+        return self.encode(obj).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        if self._app.debug:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj) + b'\n', mimetype=self.mimetype)
+
+app.json = TimedJSONProvider(app)
+compression_encodings = response_encoding.available_encodings(app.config['RESPONSE_COMPRESSION'])
+
+def route_label():
+    """Route template used as a low-cardinality metric label"""
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+def record_error(e):
+    """Count an exception against the current route"""
+    metrics.route_errors.inc(route=route_label(), exception=type(e).__name__)
+
+def error_response(e, status=500):
+    record_error(e)
+    if isinstance(e, UpstreamUnavailable):
+        # Throttled or circuit open: tell the caller when to come back
+        response = jsonify({'success': False, 'error': str(e), 'retry_after': round(e.retry_after, 1)})
+        response.headers['Retry-After'] = str(math.ceil(e.retry_after))
+        return response, e.status
+    return jsonify({'success': False, 'error': str(e)}), status
+
+def retry_hint(e):
+    """`retry_after` field for error events of streamed responses"""
+    retry_after = getattr(e, 'retry_after', None)
+    return {'retry_after': round(retry_after, 1)} if retry_after is not None else {}
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.trace, g.trace_token = start_trace(request.headers.get('traceparent'))
+    metrics.http_requests_in_flight.inc(route=route_label())
+
+@app.after_request
+def finish_request_metrics(response):
+    if 'request_started' in g:
+        metrics.http_request_duration.observe(
+            time.perf_counter() - g.request_started,
+            route=route_label(), method=request.method, status=response.status_code
+        )
+        response.headers['traceparent'] = g.trace.traceparent
+        timing = g.trace.server_timing()
+        if timing:
+            response.headers['Server-Timing'] = timing
+    return response
+
+# Registered after the metrics hook so it runs first and its span shows in Server-Timing
+@app.after_request
+def compress_response(response):
+    """Compress JSON/text bodies with the best encoding the client accepts"""
+    if (not compression_encodings or response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or not response_encoding.compressible(response.mimetype)):
+        return response
+    response.vary.add('Accept-Encoding')
+    with span('response.compress'):
+        body, encoding = response_encoding.compress(
+            response.get_data(), request.headers.get('Accept-Encoding'),
+            compression_encodings, app.config['COMPRESS_MIN_BYTES'])
+    if encoding:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        tag, weak = response.get_etag()
+        if tag and not weak:
+            # Byte-for-byte different from the uncompressed body, same content
+            response.set_etag(tag, weak=True)
+    return response
+
+def conditional_json(payload, data):
+    """jsonify `payload`, or 304 Not Modified if the client already has `data`
+
+    The ETag covers only the listing itself, not flags like `cached` that
+    change between otherwise identical responses.
+    """
+    tag = response_encoding.etag(data)
+    if request.if_none_match.contains_weak(tag):
+        metrics.not_modified_responses.inc(route=route_label())
+        response = Response(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(tag, weak=True)
+    # Listings differ per API key and change at any time: revalidate on every use
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('X-API-Key')
+    return response
+
+@app.teardown_request
+def end_request_metrics(exc=None):
+    if 'request_started' in g:
+        metrics.http_requests_in_flight.dec(route=route_label())
+        if exc is not None:
+            record_error(exc)
+        end_trace(g.pop('trace_token'))
+        g.pop('request_started')
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus metrics in the text exposition format"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/')
 def index():
@@ -41,6 +470,9 @@ def create_store():
         file_search_store = client.file_search_stores.create(
             config={'display_name': display_name}
         )
+        metadata_index.put_store(api_key_hash(), store_to_dict(file_search_store))
+        # A new store is empty: its (complete) document listing is known without a call
+        metadata_index.replace_documents(api_key_hash(), file_search_store.name, [])
 
         return jsonify({
             'success': True,
@@ -49,25 +481,30 @@ def create_store():
         })
     except Exception as e:
         logger.error(f"Error creating store: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @app.route('/api/list-stores', methods=['GET'])
 def list_stores():
-    """List all file search stores"""
+    """List all file search stores
+
+    Served from the metadata index when this API key has listed its stores
+    before (`refresh=true` goes to the API); stale entries are refreshed in
+    the background.
+    """
     try:
         client = get_client()
-        stores = []
-        for store in client.file_search_stores.list():
-            stores.append({
-                'name': store.name,
-                'display_name': getattr(store, 'display_name', 'N/A'),
-                'create_time': str(getattr(store, 'create_time', 'N/A'))
-            })
+        owner = api_key_hash()
+        stores = None if request.args.get('refresh') == 'true' else metadata_index.stores(owner)
+        cached, coalesced = stores is not None, False
+        if cached:
+            metadata_index.refresh_later(owner, STORES_SCOPE, lambda: refresh_stores(client, owner))
+        else:
+            stores, coalesced = flights.do('list-stores', owner, lambda: refresh_stores(client, owner))
 
-        return jsonify({'success': True, 'stores': stores})
+        return conditional_json({'success': True, 'stores': stores, 'cached': cached, 'coalesced': coalesced}, stores)
     except Exception as e:
         logger.error(f"Error listing stores: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @app.route('/api/upload-to-store', methods=['POST'])
 def upload_to_store():
@@ -84,54 +521,134 @@ def upload_to_store():
         if file.filename == '':
             return jsonify({'success': False, 'error': 'No file selected'}), 400
 
-        # Save file temporarily
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        # Keep the parsed upload buffer; it is streamed to Gemini without re-staging
+        stream, upload_info = detach_upload(file)
+        body, status = start_store_upload(client, store_name, file_name, stream, upload_info, request.form)
+        return jsonify(body), status
+
+    except Exception as e:
+        logger.error(f"Error uploading to store: {e}")
+        return error_response(e)
+
+def start_store_upload(client, store_name, file_name, stream, upload_info, options):
+    """Dedup, split or submit an upload job for a detached upload stream
+
+    Shared by multipart and chunked uploads; `options` holds the optional
+    `force`, `piece_size_mb` and `concurrency` fields. Takes ownership of
+    `stream` and returns (response body, status code).
+    """
+    # Set once a job or batch owns the stream; until then it is closed here
+    handed_off = False
+    try:
+        try:
+            concurrency = batch_concurrency(options.get('concurrency'))
+        except ValueError as e:
+            return {'success': False, 'error': str(e)}, 400
+
+        # Identical bytes already indexed in this store: skip the upload entirely
+        force = str(options.get('force', '')).lower() == 'true'
+        existing = None if force else upload_manifest.lookup(store_name, upload_info['sha256'])
+        if existing:
+            logger.info(f"Duplicate upload of {file_name} to {store_name}: {existing['document_name']}")
+            return {
+                'success': True,
+                'duplicate': True,
+                'message': 'Identical file already exists in this store',
+                'document_name': existing['document_name'],
+                'upload': upload_info
+            }, 200
+
+        # Same bytes still indexing (possibly since before a restart): follow that job instead
+        pending_job = None if force else operation_store.find_upload(store_name, upload_info['sha256'], api_key_hash())
+        if pending_job:
+            logger.info(f"Duplicate upload of {file_name} to {store_name} while job {pending_job} is pending")
+            return {
+                'success': True,
+                'duplicate': True,
+                'pending': True,
+                'message': 'Identical file is already being indexed in this store',
+                'job_id': pending_job,
+                'upload': upload_info
+            }, 202
+
+        # Large text/PDF files are split and ingested as parallel pieces
+        piece_size = piece_size_bytes(options.get('piece_size_mb') or app.config['UPLOAD_PIECE_SIZE_MB'])
+        item = BatchItem(file_name, upload_info['size_bytes'], stream_opener(stream), upload_info['mime_type'])
+        if can_split(item, piece_size):
+            batch_id = uuid.uuid4().hex
+            pieces = list(split_items([item], piece_size))
+            start_batch(client, store_name, batch_id, pieces, concurrency, [stream])
+            handed_off = True
+            return {
+                'success': True,
+                'message': f'File split into {len(pieces)} pieces',
+                'batch_id': batch_id,
+                'pieces': len(pieces),
+                'concurrency': concurrency,
+                'upload': upload_info
+            }, 202
 
         # Upload to file search store
         # store_name should be the file search store name (e.g., fileSearchStores/xxx)
         # file_name is the custom display name for the file (used in citations)
-        config_dict = {}
+        config_dict = {'mime_type': upload_info['mime_type']}
         if file_name:
             config_dict['display_name'] = file_name
 
-        operation = client.file_search_stores.upload_to_file_search_store(
-            file_search_store_name=store_name,
-            file=filepath,
-            config=config_dict if config_dict else None
+        def start(client):
+            try:
+                retrieval.add_text(upload_info['sha256'], stream, upload_info['mime_type'])
+                return client.file_search_stores.upload_to_file_search_store(
+                    file_search_store_name=store_name,
+                    file=stream,
+                    config=config_dict
+                )
+            finally:
+                # Release the buffer once the bytes have been sent
+                stream.close()
+
+        # Operation is tracked by the background poller; return a job ID at once
+        job = jobs.submit(
+            'upload_to_store', client, start,
+            on_done=upload_job_done,
+            meta={'store_name': store_name, 'file_name': file_name, 'upload': upload_info},
+            owner=api_key_hash()
         )
+        handed_off = True
 
-        # Wait for operation to complete (with timeout)
-        max_wait = 60  # seconds
-        elapsed = 0
-        while not operation.done and elapsed < max_wait:
-            time.sleep(2)
-            operation = client.operations.get(operation)
-            elapsed += 2
+        return {
+            'success': True,
+            'message': 'File upload started',
+            'job_id': job.id,
+            'status': job.status,
+            'upload': upload_info
+        }, 202
+    finally:
+        if not handed_off:
+            stream.close()
 
-        # Clean up temporary file
-        os.remove(filepath)
+def upload_finished(store_name, client, operation, upload_info, file_name):
+    """Record a completed direct upload in the dedup manifest and caches"""
+    document_added(store_name, client, operation)
+    document_name = getattr(getattr(operation, 'response', None), 'document_name', None)
+    if document_name and upload_info.get('sha256'):
+        upload_manifest.record(store_name, upload_info['sha256'], document_name,
+                               file_name, upload_info['size_bytes'])
+        retrieval.link(store_name, document_name, upload_info['sha256'])
 
-        if operation.done:
-            return jsonify({
-                'success': True,
-                'message': 'File uploaded and imported successfully',
-                'operation': str(operation)
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': 'Operation timeout',
-                'message': 'File upload may still be processing'
-            }), 202
+def upload_job_done(job, operation):
+    """`on_done` of upload jobs, fresh or resumed after a restart"""
+    upload_finished(job.meta['store_name'], job.client, operation, job.meta['upload'], job.meta['file_name'])
 
-    except Exception as e:
-        logger.error(f"Error uploading to store: {e}")
-        # Clean up temporary file if it exists
-        if 'filepath' in locals() and os.path.exists(filepath):
-            os.remove(filepath)
-        return jsonify({'success': False, 'error': str(e)}), 500
+def import_job_done(job, operation):
+    """`on_done` of import jobs, fresh or resumed after a restart"""
+    document_added(job.meta['store_name'], job.client, operation)
+    document_name = getattr(getattr(operation, 'response', None), 'document_name', None)
+    if document_name:
+        retrieval.link_file(job.meta['store_name'], document_name, job.meta['file_name'])
+
+jobs.resumable('upload_to_store', upload_job_done)
+jobs.resumable('import_file', import_job_done)
 
 @app.route('/api/upload-file', methods=['POST'])
 def upload_file():
@@ -147,30 +664,127 @@ def upload_file():
         if file.filename == '':
             return jsonify({'success': False, 'error': 'No file selected'}), 400
 
-        # Save file temporarily
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        # Upload using Files API straight from the parsed upload buffer
+        stream, upload_info = detach_upload(file)
+        return jsonify(files_upload(client, file_name, stream, upload_info))
+    except Exception as e:
+        logger.error(f"Error uploading file: {e}")
+        return error_response(e)
 
-        # Upload using Files API
+def files_upload(client, file_name, stream, upload_info):
+    """Send a detached upload stream to the Files API and close it"""
+    try:
+        retrieval.add_text(upload_info['sha256'], stream, upload_info['mime_type'])
         uploaded_file = client.files.upload(
-            file=filepath,
-            config={'name': file_name}
+            file=stream,
+            config={'name': file_name, 'mime_type': upload_info['mime_type']}
         )
+    finally:
+        stream.close()
+    retrieval.remember_file(uploaded_file.name, upload_info['sha256'])
 
-        # Clean up temporary file
-        os.remove(filepath)
+    return {
+        'success': True,
+        'file_name': uploaded_file.name,
+        'display_name': file_name,
+        'upload': upload_info
+    }
 
-        return jsonify({
-            'success': True,
-            'file_name': uploaded_file.name,
-            'display_name': file_name
-        })
+@app.route('/api/uploads', methods=['POST'])
+def create_chunked_upload():
+    """Start a resumable chunked upload; chunks are then PUT to /api/uploads/<id>/chunks/<index>"""
+    try:
+        get_client()
+        data = request.json or {}
+        file_name = data.get('file_name')
+        if not file_name or data.get('size_bytes') is None:
+            return jsonify({'success': False, 'error': 'file_name and size_bytes are required'}), 400
+        mime_type = data.get('mime_type')
+        if not mime_type or mime_type == 'application/octet-stream':
+            mime_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+        try:
+            upload = chunked_uploads.create(api_key_hash(), file_name, data['size_bytes'], mime_type,
+                                            data.get('chunk_size'))
+        except (TypeError, ValueError) as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        return jsonify({'success': True, **upload}), 201
     except Exception as e:
-        logger.error(f"Error uploading file: {e}")
-        if 'filepath' in locals() and os.path.exists(filepath):
-            os.remove(filepath)
-        return jsonify({'success': False, 'error': str(e)}), 500
+        logger.error(f"Error starting chunked upload: {e}")
+        return error_response(e)
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """Received and missing chunks of a chunked upload, for resuming it"""
+    upload = chunked_uploads.status(upload_id, api_key_hash())
+    if upload is None:
+        return jsonify({'success': False, 'error': 'Upload not found'}), 404
+    return jsonify({'success': True, **upload})
+
+@app.route('/api/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    """Write one chunk (raw request body) at its offset in the part file"""
+    try:
+        upload = chunked_uploads.write_chunk(upload_id, api_key_hash(), index,
+                                             request.stream, request.content_length)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if upload is None:
+        return jsonify({'success': False, 'error': 'Upload not found'}), 404
+    return jsonify({
+        'success': True,
+        'chunk': index,
+        'received_chunks': len(upload['received']),
+        'chunks': upload['chunks'],
+        'received_bytes': upload['received_bytes'],
+        'complete': upload['complete']
+    })
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """Assemble a chunked upload and hand it to the store or Files API upload path
+
+    `target` is `store` (default; needs `store_name`, accepts the
+    `/api/upload-to-store` options) or `file` for the Files API.
+    """
+    try:
+        client = get_client()
+        data = request.json or {}
+        target = data.get('target', 'store')
+        if target not in ('store', 'file'):
+            return jsonify({'success': False, 'error': 'target must be store or file'}), 400
+        if target == 'store' and not data.get('store_name'):
+            return jsonify({'success': False, 'error': 'store_name is required'}), 400
+
+        upload = chunked_uploads.status(upload_id, api_key_hash())
+        if upload is None:
+            return jsonify({'success': False, 'error': 'Upload not found'}), 404
+        if upload['missing']:
+            return jsonify({
+                'success': False,
+                'error': f"Upload is missing {len(upload['missing'])} chunk(s)",
+                'missing': upload['missing']
+            }), 409
+
+        finished = chunked_uploads.finish(upload_id, api_key_hash())
+        if finished is None:
+            # Completed by a concurrent request
+            return jsonify({'success': False, 'error': 'Upload not found'}), 404
+        stream, upload_info = finished
+        file_name = data.get('file_name') or upload['file_name']
+        if target == 'file':
+            return jsonify(files_upload(client, file_name, stream, upload_info))
+        body, status = start_store_upload(client, data['store_name'], file_name, stream, upload_info, data)
+        return jsonify(body), status
+    except Exception as e:
+        logger.error(f"Error completing chunked upload: {e}")
+        return error_response(e)
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_chunked_upload(upload_id):
+    """Discard a chunked upload and its part file"""
+    if not chunked_uploads.abort(upload_id, api_key_hash()):
+        return jsonify({'success': False, 'error': 'Upload not found'}), 404
+    return jsonify({'success': True, 'message': 'Upload discarded'})
 
 @app.route('/api/import-file', methods=['POST'])
 def import_file():
@@ -182,36 +796,273 @@ def import_file():
         file_name = data.get('file_name')
         custom_metadata = data.get('custom_metadata', [])
 
-        # Import file
-        operation = client.file_search_stores.import_file(
-            file_search_store_name=store_name,
-            file_name=file_name,
-            custom_metadata=custom_metadata
-        )
+        # Import file; the operation is tracked by the background poller
+        def start(client):
+            return client.file_search_stores.import_file(
+                file_search_store_name=store_name,
+                file_name=file_name,
+                config={'custom_metadata': custom_metadata} if custom_metadata else None
+            )
 
-        # Wait for operation to complete
-        max_wait = 60
-        elapsed = 0
-        while not operation.done and elapsed < max_wait:
-            time.sleep(2)
-            operation = client.operations.get(operation)
-            elapsed += 2
+        job = jobs.submit(
+            'import_file', client, start,
+            on_done=import_job_done,
+            meta={'store_name': store_name, 'file_name': file_name},
+            owner=api_key_hash()
+        )
 
-        if operation.done:
-            return jsonify({
-                'success': True,
-                'message': 'File imported successfully'
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': 'Operation timeout',
-                'message': 'File import may still be processing'
-            }), 202
+        return jsonify({
+            'success': True,
+            'message': 'File import started',
+            'job_id': job.id,
+            'status': job.status
+        }), 202
 
     except Exception as e:
         logger.error(f"Error importing file: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
+
+def batch_progress_path(batch_id):
+    return os.path.join(app.config['BATCH_FOLDER'], f"{batch_id}.json")
+
+def stream_opener(stream):
+    """Opener for a BatchItem backed by an already-detached upload buffer"""
+    def open_stream():
+        stream.seek(0)
+        return stream
+    return open_stream
+
+def start_batch(client, store_name, batch_id, items, concurrency, streams, owner=None):
+    """Ingest items on a background thread; closes `streams` when done
+
+    The store's listing stops counting as complete as soon as the batch starts
+    (documents appear while it runs) and each imported document is patched
+    into the caches and indexes like a single upload.
+    """
+    hashes = {}
+
+    def index_text(item, stream):
+        hashes[item.key] = retrieval.add_stream(stream, item.mime_type)
+
+    def record_document(item, operation):
+        document_added(store_name, client, operation)
+        document_name = getattr(getattr(operation, 'response', None), 'document_name', None)
+        if document_name and hashes.get(item.key):
+            retrieval.link(store_name, document_name, hashes[item.key])
+
+    ingestor = BatchIngestor(client, store_name, concurrency,
+                             BatchProgress(batch_progress_path(batch_id)),
+                             on_upload=index_text, on_imported=record_document)
+    ingestor.owner = owner or api_key_hash()
+    store_changed(store_name)
+
+    def run():
+        try:
+            ingestor.run(items)
+        except Exception as e:
+            logger.error(f"Batch {batch_id} failed: {e}")
+        finally:
+            for stream in streams:
+                stream.close()
+            store_changed(store_name)
+
+    # Joined by drain_batches on shutdown; daemon so a hung import cannot block exit
+    ingestor.thread = threading.Thread(target=run, name=f"batch-{batch_id[:8]}", daemon=True)
+    with batches_lock:
+        batches[batch_id] = ingestor
+    ingestor.thread.start()
+    return ingestor
+
+def batch_concurrency(value, default=4):
+    """Requested batch concurrency, capped at BATCH_MAX_CONCURRENCY; raises ValueError unless >= 1"""
+    try:
+        concurrency = default if value in (None, '') else int(value)
+    except (TypeError, ValueError):
+        raise ValueError('concurrency must be an integer') from None
+    if concurrency < 1:
+        raise ValueError('concurrency must be at least 1')
+    return min(concurrency, app.config['BATCH_MAX_CONCURRENCY'])
+
+def drain_batches(timeout):
+    """Wait up to `timeout` seconds for running batches; returns how many are still running"""
+    deadline = time.monotonic() + timeout
+    with batches_lock:
+        running = [ingestor for ingestor in batches.values() if ingestor.status == BATCH_RUNNING]
+    for ingestor in running:
+        ingestor.thread.join(max(0.0, deadline - time.monotonic()))
+    return sum(1 for ingestor in running if ingestor.thread.is_alive())
+
+@app.route('/api/batch-upload', methods=['POST'])
+def batch_upload():
+    """Upload many files or a .zip archive into a store with bounded concurrency
+
+    Pass the same `batch_id` again after an interruption to skip files that
+    already finished. With `piece_size_mb`, large text files and PDFs are
+    split into pieces that are ingested as separate documents.
+    """
+    try:
+        client = get_client()
+        store_name = request.form.get('store_name')
+        batch_id = request.form.get('batch_id') or uuid.uuid4().hex
+        try:
+            concurrency = batch_concurrency(request.form.get('concurrency'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        try:
+            metadata = json.loads(request.form.get('custom_metadata') or '{}')
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'custom_metadata is not valid JSON: {e}'}), 400
+        if not isinstance(metadata, dict):
+            return jsonify({'success': False, 'error': 'custom_metadata must be a JSON object'}), 400
+
+        if not store_name:
+            return jsonify({'success': False, 'error': 'store_name is required'}), 400
+
+        if not re.fullmatch(r'[A-Za-z0-9_-]{1,64}', batch_id):
+            return jsonify({'success': False, 'error': 'Invalid batch_id'}), 400
+
+        with batches_lock:
+            running = batches.get(batch_id)
+            if running is not None and running.status == 'running':
+                return jsonify({'success': False, 'error': 'Batch is already running'}), 409
+
+        items = []
+        streams = []
+        for file in request.files.getlist('files'):
+            if file.filename:
+                stream, upload_info = detach_upload(file)
+                streams.append(stream)
+                items.append(BatchItem(file.filename, upload_info['size_bytes'],
+                                       stream_opener(stream), upload_info['mime_type']))
+
+        archive = request.files.get('archive')
+        if archive and archive.filename:
+            stream, _ = detach_upload(archive)
+            streams.append(stream)
+            items.extend(items_from_zip(zipfile.ZipFile(stream)))
+
+        if not items:
+            for stream in streams:
+                stream.close()
+            return jsonify({'success': False, 'error': 'No files provided'}), 400
+
+        apply_metadata(items, metadata)
+        files = len(items)
+        piece_size = piece_size_bytes(request.form.get('piece_size_mb') or app.config['UPLOAD_PIECE_SIZE_MB'])
+        items = list(split_items(items, piece_size))
+        start_batch(client, store_name, batch_id, items, concurrency, streams)
+
+        return jsonify({
+            'success': True,
+            'batch_id': batch_id,
+            'files': files,
+            'total': len(items),
+            'concurrency': concurrency
+        }), 202
+
+    except Exception as e:
+        logger.error(f"Error starting batch upload: {e}")
+        return error_response(e)
+
+@app.route('/api/batch-upload/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    """Per-file results and aggregate throughput for a batch upload"""
+    with batches_lock:
+        ingestor = batches.get(batch_id)
+    if ingestor is not None and ingestor.owner == api_key_hash():
+        return jsonify({'success': True, 'batch_id': batch_id, **ingestor.summary()})
+
+    # After a restart only the persisted progress survives
+    if re.fullmatch(r'[A-Za-z0-9_-]{1,64}', batch_id) and os.path.exists(batch_progress_path(batch_id)):
+        completed = BatchProgress(batch_progress_path(batch_id)).completed
+        return jsonify({
+            'success': True,
+            'batch_id': batch_id,
+            'status': 'interrupted',
+            'succeeded': len(completed),
+            'files': list(completed.values())
+        })
+    return jsonify({'success': False, 'error': 'Batch not found'}), 404
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the status of an upload/import job"""
+    if get_api_key():
+        resume_operations(get_api_key())
+    job = jobs.status(job_id, owner=api_key_hash())
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """Bulk job status; pass ?ids=a,b,c to select specific jobs"""
+    ids = request.args.get('ids')
+    ids = [i for i in ids.split(',') if i] if ids else None
+    if get_api_key():
+        resume_operations(get_api_key())
+    job_list = jobs.statuses(ids, owner=api_key_hash())
+    return jsonify({
+        'success': True,
+        'jobs': job_list,
+        'pending': sum(1 for job in job_list if not job['done'])
+    })
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """Runtime statistics for the client pool and background jobs"""
+    return jsonify({
+        'success': True,
+        'client_pool': client_pool.stats(),
+        'uploads': upload_stats.to_dict(),
+        'query_cache': query_cache.stats(),
+        'document_cache': document_cache.stats(),
+        'metadata_index': metadata_index.stats(),
+        'retrieval_index': retrieval.stats(),
+        'dedup': upload_manifest.stats(),
+        'chunked_uploads': chunked_uploads.stats(),
+        'imports': lazy_import.stats(),
+        'operations': {**operation_store.stats(), 'orphans_removed': orphan_cleanup},
+        'upstream_guard': upstream_guard.summary(),
+        'sessions': sessions.stats(),
+        'coalescing': flights.stats(),
+        'model_routing': model_router.stats(),
+        'jobs': {'pending': jobs.pending_count()}
+    })
+
+@app.route('/api/upstream-status', methods=['GET'])
+def upstream_status():
+    """Rate-limit tokens and circuit breaker state per endpoint class for this API key"""
+    status = upstream_guard.status(api_key_hash())
+    healthy = all(state['state'] == 'closed' for state in status.values())
+    return jsonify({'success': True, 'healthy': healthy, 'endpoints': status})
+
+def build_file_search_tool(store_names, metadata_filter=None):
+    """Build file search configuration correctly with Tool wrapper"""
+    if metadata_filter:
+        tool = types.Tool(
+            file_search=types.FileSearch(
+                file_search_store_names=store_names,
+                metadata_filter=metadata_filter
+            )
+        )
+    else:
+        tool = types.Tool(
+            file_search=types.FileSearch(
+                file_search_store_names=store_names
+            )
+        )
+
+    logger.info(f"Tool created: {tool}")
+    return tool
+
+def shape_answer(result, mode):
+    """A cached or fresh answer with its grounding in the requested mode"""
+    return {**result, 'grounding_metadata': grounding.shape(result['grounding_metadata'], mode)}
+
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {response_encoding.dumps(data).decode('utf-8')}\n\n"
 
 @app.route('/api/query', methods=['POST'])
 def query():
@@ -229,46 +1080,348 @@ def query():
         if not store_names:
             return jsonify({'success': False, 'error': 'No store names provided'}), 400
 
-        # Build file search configuration correctly with Tool wrapper
-        if metadata_filter:
-            tool = types.Tool(
-                file_search=types.FileSearch(
-                    file_search_store_names=store_names,
-                    metadata_filter=metadata_filter
-                )
-            )
-        else:
-            tool = types.Tool(
-                file_search=types.FileSearch(
-                    file_search_store_names=store_names
-                )
+        grounding_mode = data.get('grounding', 'full')
+        if grounding_mode not in grounding.MODES:
+            return jsonify({'success': False, 'error': f"grounding must be one of {', '.join(grounding.MODES)}"}), 400
+
+        # Skip the generate call when the filter cannot match any indexed document
+        unmatched = None if data.get('check_filter') is False else metadata_filter_error(store_names, metadata_filter)
+        if unmatched:
+            return jsonify(unmatched), 400
+
+        try:
+            decision = apply_prefilter(prefilter_mode(data), query_text, store_names, metadata_filter)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if decision and decision['outcome'] == 'no_match':
+            return jsonify({'success': True, 'response': None, 'grounding_metadata': None, 'no_match': True,
+                            'message': no_match_message(decision), 'prefilter': decision})
+        # Stores the local index ruled out are left out of the File Search call
+        search_stores = decision['store_names'] if decision else store_names
+
+        try:
+            route = model_router.resolve('query', data, query_text, search_stores)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        cache_key = make_key(query_text, search_stores, metadata_filter, api_key_hash(), route.variant)
+        if not data.get('no_cache'):
+            cached = query_cache.get(cache_key)
+            if cached is not None:
+                return jsonify({'success': True, **shape_answer(cached, grounding_mode), 'cached': True,
+                                'routing': route.to_dict(), 'prefilter': decision})
+
+        def generate():
+            tool = build_file_search_tool(search_stores, metadata_filter)
+
+            # Generate content with file search on the routed model
+            started = time.perf_counter()
+            response = client.models.generate_content(
+                model=route.model,
+                contents=query_text,
+                config=route.config(tools=[tool])
             )
+            model_router.record(route, time.perf_counter() - started, response.usage_metadata)
 
-        logger.info(f"Tool created: {tool}")
+            # Grounding is cached in full structured form and shaped per request;
+            # a write to any of the requested stores (dropped ones too) invalidates it
+            result = {
+                'response': response.text,
+                'grounding_metadata': grounding.from_response(response)
+            }
+            query_cache.set(cache_key, result, store_names)
+            return result
 
-        # Generate content with file search
-        # Use gemini-2.5-flash as required by file search documentation
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=query_text,
-            config=types.GenerateContentConfig(tools=[tool])
-        )
+        # The cache key already includes the API key hash
+        result, coalesced = flights.do('query', cache_key, generate)
+
+        return jsonify({'success': True, **shape_answer(result, grounding_mode), 'cached': False,
+                        'coalesced': coalesced, 'routing': route.to_dict(), 'prefilter': decision})
+    except Exception as e:
+        logger.error(f"Error querying: {e}")
+        return error_response(e)
+
+@app.route('/api/query-stream', methods=['POST'])
+def query_stream():
+    """Query the file search store, streaming the answer as Server-Sent Events"""
+    try:
+        client = get_client()
+        data = request.json
+        query_text = data.get('query')
+        store_names = data.get('store_names', [])
+        metadata_filter = data.get('metadata_filter', None)
+
+        if not query_text:
+            return jsonify({'success': False, 'error': 'No query provided'}), 400
+
+        if not store_names:
+            return jsonify({'success': False, 'error': 'No store names provided'}), 400
+
+        grounding_mode = data.get('grounding', 'full')
+        if grounding_mode not in grounding.MODES:
+            return jsonify({'success': False, 'error': f"grounding must be one of {', '.join(grounding.MODES)}"}), 400
+
+        # Skip the generate call when the filter cannot match any indexed document
+        unmatched = None if data.get('check_filter') is False else metadata_filter_error(store_names, metadata_filter)
+        if unmatched:
+            return jsonify(unmatched), 400
+
+        try:
+            decision = apply_prefilter(prefilter_mode(data), query_text, store_names, metadata_filter)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if decision and decision['outcome'] == 'no_match':
+            # Settled locally: a single final event, no File Search call
+            return Response(sse_event('done', {
+                'grounding_metadata': None,
+                'ttfb_ms': decision['elapsed_ms'],
+                'total_ms': decision['elapsed_ms'],
+                'cached': False,
+                'no_match': True,
+                'message': no_match_message(decision),
+                'prefilter': decision
+            }), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        search_stores = decision['store_names'] if decision else store_names
+
+        try:
+            route = model_router.resolve('query-stream', data, query_text, search_stores)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        cache_key = make_key(query_text, search_stores, metadata_filter, api_key_hash(), route.variant)
+        cached = None if data.get('no_cache') else query_cache.get(cache_key)
+        tool = build_file_search_tool(search_stores, metadata_filter) if cached is None else None
+    except Exception as e:
+        logger.error(f"Error querying: {e}")
+        return error_response(e)
+
+    def generate():
+        started = time.perf_counter()
+        if cached is not None:
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            yield sse_event('chunk', {'text': cached['response']})
+            yield sse_event('done', {
+                'grounding_metadata': grounding.shape(cached['grounding_metadata'], grounding_mode),
+                'ttfb_ms': elapsed_ms,
+                'total_ms': elapsed_ms,
+                'cached': True,
+                'routing': route.to_dict(),
+                'prefilter': decision
+            })
+            return
 
-        # Extract grounding metadata if available
+        ttfb_ms = None
         grounding_metadata = None
-        if response.candidates and len(response.candidates) > 0:
-            candidate = response.candidates[0]
-            if hasattr(candidate, 'grounding_metadata'):
-                grounding_metadata = str(candidate.grounding_metadata)
+        usage = None
+        text_parts = []
+        try:
+            for chunk in client.models.generate_content_stream(
+                model=route.model,
+                contents=query_text,
+                config=route.config(tools=[tool])
+            ):
+                usage = chunk.usage_metadata or usage
+                # Grounding metadata arrives on the final chunk(s)
+                if chunk.candidates:
+                    metadata = getattr(chunk.candidates[0], 'grounding_metadata', None)
+                    if metadata:
+                        grounding_metadata = grounding.extract(metadata)
+
+                if chunk.text:
+                    if ttfb_ms is None:
+                        ttfb_ms = round((time.perf_counter() - started) * 1000, 1)
+                    text_parts.append(chunk.text)
+                    yield sse_event('chunk', {'text': chunk.text})
+
+            query_cache.set(cache_key, {
+                'response': ''.join(text_parts),
+                'grounding_metadata': grounding_metadata
+            }, store_names)
+            total = time.perf_counter() - started
+            model_router.record(route, total, usage, ttfb=ttfb_ms / 1000 if ttfb_ms is not None else None)
+
+            yield sse_event('done', {
+                'grounding_metadata': grounding.shape(grounding_metadata, grounding_mode),
+                'ttfb_ms': ttfb_ms,
+                'total_ms': round(total * 1000, 1),
+                'cached': False,
+                'routing': route.to_dict(),
+                'prefilter': decision
+            })
+        except Exception as e:
+            logger.error(f"Error streaming query: {e}")
+            record_error(e)
+            yield sse_event('error', {'error': str(e), **retry_hint(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def query_batch_params(data, owner=None):
+    """Validate a /api/query-batch body; returns (items, store_names, metadata_filter, grounding_mode)"""
+    items = normalize_queries(data.get('queries'))
+    store_names = data.get('store_names', [])
+    if not store_names:
+        raise ValueError('No store names provided')
+    if len(items) > app.config['QUERY_BATCH_MAX_QUERIES']:
+        raise ValueError(f"At most {app.config['QUERY_BATCH_MAX_QUERIES']} queries per batch")
+    grounding_mode = data.get('grounding', 'full')
+    if grounding_mode not in grounding.MODES:
+        raise ValueError(f"grounding must be one of {', '.join(grounding.MODES)}")
+    metadata_filter = data.get('metadata_filter', None)
+    unmatched = None if data.get('check_filter') is False else metadata_filter_error(store_names, metadata_filter, owner)
+    if unmatched:
+        raise ValueError(unmatched['error'])
+    model_router.check('query-batch', data)
+    return items, store_names, metadata_filter, grounding_mode
+
+@app.route('/api/query-batch', methods=['POST'])
+def query_batch():
+    """Run many queries against the same stores, streaming NDJSON results as they finish
+
+    With `mode: "batch"` the queries go through Gemini's batch mode instead;
+    the response is a job ID whose result holds every answer.
+    """
+    try:
+        client = get_client()
+        data = request.json
+        try:
+            items, store_names, metadata_filter, grounding_mode = query_batch_params(data, api_key_hash())
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        # One tool config shared by every query in the batch
+        tool = build_file_search_tool(store_names, metadata_filter)
+
+        if data.get('mode') == 'batch':
+            # One model for the whole job; `auto` falls back to the balanced tier
+            route = model_router.resolve('query-batch', data, None, store_names)
+            job = jobs.submit(
+                'query_batch', client,
+                lambda client: create_batch_job(client, items, tool, data.get('display_name'), route),
+                on_done=lambda job, batch_job: batch_job_finished(batch_job, items, grounding_mode),
+                poll=lambda client, batch_job: client.batches.get(name=batch_job.name),
+                meta={'store_names': store_names, 'queries': len(items)},
+                owner=api_key_hash()
+            )
+            return jsonify({
+                'success': True,
+                'message': 'Batch job started',
+                'job_id': job.id,
+                'status': job.status,
+                'queries': len(items)
+            }), 202
+
+        concurrency = min(int(data.get('concurrency', 8)), app.config['QUERY_BATCH_MAX_CONCURRENCY'])
+        batch = QueryBatch(client, tool, store_names, metadata_filter, query_cache, api_key_hash(),
+                           concurrency, use_cache=not data.get('no_cache'), grounding_mode=grounding_mode,
+                           router=model_router, hints=data)
+    except Exception as e:
+        logger.error(f"Error starting query batch: {e}")
+        return error_response(e)
+
+    def generate():
+        for result in batch.run(items):
+            yield response_encoding.json_line(result)
+        yield response_encoding.json_line({'done': True, **batch.summary()})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/sessions', methods=['POST'])
+def create_session():
+    """Start a multi-turn conversation against a fixed set of stores"""
+    try:
+        data = request.json or {}
+        store_names = data.get('store_names', [])
+        metadata_filter = data.get('metadata_filter', None)
+        if not store_names:
+            return jsonify({'success': False, 'error': 'No store names provided'}), 400
+
+        unmatched = None if data.get('check_filter') is False else metadata_filter_error(store_names, metadata_filter)
+        if unmatched:
+            return jsonify(unmatched), 400
+
+        # Fixed for the session's lifetime: a context cache belongs to one model
+        try:
+            route = model_router.resolve('sessions', data, None, store_names)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        session = sessions.create(api_key_hash(), store_names, metadata_filter, data.get('system_instruction'),
+                                  route)
+        return jsonify({'success': True, **session.to_dict()}), 201
+    except Exception as e:
+        logger.error(f"Error creating session: {e}")
+        return error_response(e)
+
+@app.route('/api/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    """Session state, history and accumulated token/latency savings"""
+    session = sessions.get(session_id, owner=api_key_hash())
+    if session is None:
+        return jsonify({'success': False, 'error': 'Session not found'}), 404
+    return jsonify({'success': True, **session.to_dict(history=True)})
+
+@app.route('/api/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """End a session and drop its context cache"""
+    try:
+        session = sessions.delete(session_id, owner=api_key_hash())
+        if session is None:
+            return jsonify({'success': False, 'error': 'Session not found'}), 404
+        if session.cache_name:
+            with session.lock:
+                sessions.drop_cache(session, get_client())
+        return jsonify({'success': True, 'message': 'Session deleted', 'turns': len(session.turns)})
+    except Exception as e:
+        logger.error(f"Error deleting session: {e}")
+        return error_response(e)
+
+@app.route('/api/sessions/<session_id>/query', methods=['POST'])
+def session_query(session_id):
+    """Ask the next question of a session; earlier turns are sent as history"""
+    try:
+        client = get_client()
+        data = request.json or {}
+        query_text = data.get('query')
+        if not query_text:
+            return jsonify({'success': False, 'error': 'No query provided'}), 400
+
+        grounding_mode = data.get('grounding', 'full')
+        if grounding_mode not in grounding.MODES:
+            return jsonify({'success': False, 'error': f"grounding must be one of {', '.join(grounding.MODES)}"}), 400
+
+        session = sessions.get(session_id, owner=api_key_hash())
+        if session is None:
+            return jsonify({'success': False, 'error': 'Session not found'}), 404
+
+        # Answers depend on the history, so sessions bypass the query cache
+        tool = build_file_search_tool(session.store_names, session.metadata_filter)
+        with session.lock:
+            contents, config = sessions.prepare(session, client, tool, query_text)
+            started = time.perf_counter()
+            response = client.models.generate_content(
+                model=sessions.model_for(session),
+                contents=contents,
+                config=config
+            )
+            latency_ms = round((time.perf_counter() - started) * 1000, 1)
+            model_router.record(session.route, latency_ms / 1000, response.usage_metadata)
+            turn = sessions.record(session, query_text, response.text or '',
+                                   response.usage_metadata, latency_ms)
 
         return jsonify({
             'success': True,
+            'session_id': session.id,
             'response': response.text,
-            'grounding_metadata': grounding_metadata
+            'grounding_metadata': grounding.shape(grounding.from_response(response), grounding_mode),
+            **turn
         })
     except Exception as e:
-        logger.error(f"Error querying: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        logger.error(f"Error in session query: {e}")
+        return error_response(e)
 
 @app.route('/api/delete-store', methods=['POST'])
 def delete_store():
@@ -283,6 +1436,7 @@ def delete_store():
             name=store_name,
             config={'force': force}
         )
+        store_deleted(store_name)
 
         return jsonify({
             'success': True,
@@ -290,89 +1444,119 @@ def delete_store():
         })
     except Exception as e:
         logger.error(f"Error deleting store: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
 
 @app.route('/api/list-documents', methods=['GET'])
 def list_documents():
-    """List all documents in a file search store"""
+    """List documents in a file search store
+
+    Optional `page_size`/`page_token` return one page and a `next_page_token`;
+    `format=ndjson` streams one JSON document per line. Listings come from the
+    metadata index when the store was listed before (`refresh=true` skips it)
+    and are re-synced with the API in the background once stale.
+    """
     try:
         client = get_client()
         store_name = request.args.get('store_name')
+        page_size = request.args.get('page_size', type=int)
+        page_token = request.args.get('page_token')
+        ndjson = request.args.get('format') == 'ndjson'
 
         if not store_name:
             return jsonify({'success': False, 'error': 'store_name parameter is required'}), 400
 
-        # Try to use SDK method first
-        try:
-            documents = []
-            # Check if SDK supports documents.list
-            if hasattr(client.file_search_stores, 'documents'):
-                for doc in client.file_search_stores.documents.list(parent=store_name):
-                    documents.append({
-                        'name': doc.name,
-                        'display_name': getattr(doc, 'display_name', 'N/A'),
-                        'create_time': str(getattr(doc, 'create_time', 'N/A')),
-                        'update_time': str(getattr(doc, 'update_time', 'N/A'))
-                    })
-            else:
-                # Fallback to REST API
-                import requests
-                api_key = request.headers.get('X-API-Key') or os.environ.get('GEMINI_API_KEY')
-                url = f"https://generativelanguage.googleapis.com/v1beta/{store_name}/documents"
-                headers = {'Content-Type': 'application/json'}
-                params = {'key': api_key}
-
-                response = requests.get(url, headers=headers, params=params)
-                response.raise_for_status()
-                data = response.json()
-
-                for doc in data.get('documents', []):
-                    documents.append({
-                        'name': doc.get('name', 'N/A'),
-                        'display_name': doc.get('displayName', 'N/A'),
-                        'create_time': doc.get('createTime', 'N/A'),
-                        'update_time': doc.get('updateTime', 'N/A')
-                    })
+        api_key, owner = get_api_key(), api_key_hash()
+        if request.args.get('refresh') == 'true':
+            document_cache.drop(store_name)
+        lister = DocumentLister(client, api_key, http_session, document_cache, owner)
 
-            return jsonify({
-                'success': True,
-                'documents': documents,
-                'count': len(documents)
-            })
-        except Exception as e:
-            logger.error(f"Error listing documents: {e}")
-            # If SDK method doesn't exist, try REST API
-            import requests
-            api_key = request.headers.get('X-API-Key') or os.environ.get('GEMINI_API_KEY')
-            url = f"https://generativelanguage.googleapis.com/v1beta/{store_name}/documents"
-            headers = {'Content-Type': 'application/json'}
-            params = {'key': api_key}
-
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            data = response.json()
-
-            documents = []
-            for doc in data.get('documents', []):
-                documents.append({
-                    'name': doc.get('name', 'N/A'),
-                    'display_name': doc.get('displayName', 'N/A'),
-                    'create_time': doc.get('createTime', 'N/A'),
-                    'update_time': doc.get('updateTime', 'N/A')
-                })
+        def reconcile():
+            # Index the whole store (or re-sync a stale listing) without holding up the response
+            metadata_index.refresh_later(owner, store_name,
+                                         lambda: refresh_documents(client, api_key, owner, store_name))
 
-            return jsonify({
-                'success': True,
-                'documents': documents,
-                'count': len(documents)
-            })
+        if ndjson and not page_size:
+            # Stream page by page so very large stores never build one big response
+            def generate():
+                try:
+                    for document in lister.iter_documents(store_name):
+                        yield response_encoding.json_line(document)
+                    reconcile()
+                except Exception as e:
+                    logger.error(f"Error streaming documents: {e}")
+                    record_error(e)
+                    yield response_encoding.json_line({'error': str(e)})
+
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+        def list_all():
+            documents, cached = lister.all(store_name)
+            if not cached:
+                # A fresh full listing is authoritative; drop manifest entries for removed documents
+                upload_manifest.reconcile(store_name, [document['name'] for document in documents])
+            return documents, cached
+
+        flight = (owner, store_name, page_size, page_token, request.args.get('refresh') == 'true')
+        if page_size:
+            (documents, next_page_token, cached), coalesced = flights.do(
+                'list-documents', flight, lambda: lister.page(store_name, page_size, page_token))
+        else:
+            (documents, cached), coalesced = flights.do('list-documents', flight, list_all)
+            next_page_token = None
+        reconcile()
+
+        if ndjson:
+            body = ''.join(response_encoding.json_line(document) for document in documents)
+            response = Response(body, mimetype='application/x-ndjson')
+            if next_page_token:
+                response.headers['X-Next-Page-Token'] = next_page_token
+            return response
+
+        return conditional_json({
+            'success': True,
+            'documents': documents,
+            'count': len(documents),
+            'next_page_token': next_page_token,
+            'cached': cached,
+            'coalesced': coalesced
+        }, {'documents': documents, 'next_page_token': next_page_token})
 
     except Exception as e:
         logger.error(f"Error listing documents: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return error_response(e)
+
+def init_worker():
+    """Per-process setup that must not run before a fork (threads, claimed operations)"""
+    if app.config['IMPORT_WARMUP']:
+        lazy_import.warm_up()
+    jobs.reclaim()
+    # Operations of the server's own API key resume right away; other keys on their next request
+    if os.environ.get('GEMINI_API_KEY'):
+        resume_operations(os.environ['GEMINI_API_KEY'])
+
+def shutdown_worker(timeout=None):
+    """Give pending jobs and running batches up to `timeout` seconds (JOB_DRAIN_SECONDS) to finish"""
+    timeout = app.config['JOB_DRAIN_SECONDS'] if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    pending = jobs.pending_count()
+    if pending:
+        logger.info(f"Draining {pending} pending job(s) for up to {timeout}s")
+    left = jobs.shutdown(wait=True, timeout=timeout)
+    if left:
+        logger.warning(f"Stopped with {left} job(s) pending; persisted operations resume on the next start")
+    # Batches kept running while jobs drained; they get whatever time is left
+    unfinished = drain_batches(max(0.0, deadline - time.monotonic()))
+    if unfinished:
+        logger.warning(f"Stopped with {unfinished} batch(es) running; finished files are recorded, "
+                       f"re-post the same batch_id to upload the rest")
+
+# gunicorn.conf.py sets WEB_PREFORK and calls init_worker in each worker after the fork
+if os.environ.get('WEB_PREFORK') != '1':
+    init_worker()
 
 if __name__ == '__main__':
+    # Development server only; use `gunicorn` (see gunicorn.conf.py) for production
     print("Starting Gemini File Search Test Server...")
     print("Open http://localhost:3000 in your browser")
     print("Note: API Key can be set in the web interface (Settings tab)")
-    app.run(debug=True, host='0.0.0.0', port=3000)
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host='0.0.0.0', port=3000)
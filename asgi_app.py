@@ -0,0 +1,928 @@
+"""Native asyncio (ASGI) serving mode for the Gemini-bound endpoints
+
+The Flask app in `app.py` holds one thread per request for the whole Gemini
+round trip. This module serves the same routes from an event loop instead:
+store management, uploads, imports, queries and document listings await the
+SDK's async client (`client.aio`), and upload/import operations are polled by
+`JobManager.submit_async` tasks. One process can therefore keep hundreds of
+Gemini calls in flight without a thread for each.
+
+Everything else (the web page, static files, jobs, batches, stats, metrics)
+is delegated to the Flask app in a worker thread, and both modes share the
+same client pool, caches, dedup manifest and job manager.
+
+    uvicorn asgi_app:app --port 3001
+
+The sync server (`python3 app.py`) stays available for comparison.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+import uuid
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import FileStorage, Headers
+from werkzeug.http import parse_etags, parse_options_header, quote_etag
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+import app as sync_app
+import metrics
+from batch_ingest import BatchItem
+from chunking import can_split, piece_size_bytes, split_items
+from document_listing import AsyncDocumentLister
+from metadata_index import STORES_SCOPE, store_to_dict
+import grounding
+import response_encoding
+from query_batch import QueryBatch, batch_job_finished, create_batch_job
+from query_cache import make_key
+from tracing import end_trace, span, start_trace
+from upload_stream import HashingSpooledFile, detach_upload
+from upstream_guard import UpstreamUnavailable
+
+logger = logging.getLogger(__name__)
+
+flask_app = sync_app.app
+
+# Request bodies handed to the Flask app are buffered in memory up to this size
+WSGI_SPOOL_MAX_MEMORY = 1024 * 1024
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncRequest:
+    """The parts of an ASGI HTTP request the handlers need"""
+
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = Headers([(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers']])
+        self.args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self.route = self.path
+
+    async def chunks(self):
+        """Yield the request body as it arrives, enforcing MAX_CONTENT_LENGTH"""
+        limit = flask_app.config['MAX_CONTENT_LENGTH']
+        received = 0
+        while True:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                raise HTTPError(400, 'Client disconnected')
+            body = message.get('body', b'')
+            received += len(body)
+            if limit and received > limit:
+                raise HTTPError(413, 'Request body too large')
+            if body:
+                yield body
+            if not message.get('more_body'):
+                return
+
+    async def json(self):
+        body = b''.join([chunk async for chunk in self.chunks()])
+        return json.loads(body) if body else {}
+
+    async def form(self):
+        """Parse a multipart body into (form, files) while it streams in
+
+        Files are written to the same hashing spooled buffers the Flask app
+        uses, so `detach_upload` works on them unchanged.
+        """
+        mimetype, options = parse_options_header(self.headers.get('Content-Type', ''))
+        if mimetype != 'multipart/form-data' or 'boundary' not in options:
+            raise HTTPError(400, 'Expected multipart/form-data')
+
+        form, files = {}, {}
+        decoder = MultipartDecoder(options['boundary'].encode('latin-1'),
+                                   flask_app.config.get('MAX_FORM_MEMORY_SIZE'))
+        part, buffer = None, None
+        with metrics.upload_parse_duration.time(), span('upload.parse'):
+            chunks = self.chunks()
+            while True:
+                event = decoder.next_event()
+                if isinstance(event, NeedData):
+                    decoder.receive_data(await anext(chunks, None))
+                elif isinstance(event, (Field, File)):
+                    part = event
+                    if isinstance(event, File):
+                        buffer = HashingSpooledFile(
+                            max_size=flask_app.config['UPLOAD_SPOOL_MAX_MEMORY'],
+                            mode='rb+',
+                            dir=flask_app.config['UPLOAD_FOLDER']
+                        )
+                    else:
+                        buffer = bytearray()
+                elif isinstance(event, Data) and isinstance(part, File):
+                    buffer.write(event.data)
+                    if not event.more_data:
+                        buffer.seek(0)
+                        files[part.name] = FileStorage(buffer, part.filename, part.name, headers=part.headers)
+                elif isinstance(event, Data):
+                    buffer.extend(event.data)
+                    if not event.more_data:
+                        form[part.name] = buffer.decode('utf-8')
+                elif isinstance(event, Epilogue):
+                    return form, files
+
+
+class JSONResponse:
+    def __init__(self, data, status=200, headers=None):
+        self.data = data
+        self.status = status
+        self.headers = headers or {}
+
+    async def send(self, send, headers, request):
+        # Same serializer (and json_serialize_duration timing) as jsonify
+        body = flask_app.json.encode(self.data) + b'\n'
+        response_headers = dict(self.headers)
+        if sync_app.compression_encodings:
+            body, encoding = response_encoding.compress(
+                body, request.headers.get('Accept-Encoding'),
+                sync_app.compression_encodings, flask_app.config['COMPRESS_MIN_BYTES'])
+            response_headers['Vary'] = ', '.join(filter(None, [response_headers.get('Vary'), 'Accept-Encoding']))
+            if encoding:
+                response_headers['Content-Encoding'] = encoding
+        response_headers['Content-Length'] = str(len(body))
+        extra = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response_headers.items()]
+        await send({'type': 'http.response.start', 'status': self.status,
+                    'headers': [(b'content-type', b'application/json'), *extra, *headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+class NotModifiedResponse:
+    def __init__(self, headers):
+        self.status = 304
+        self.headers = headers
+
+    async def send(self, send, headers, request):
+        extra = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in self.headers.items()]
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': [*extra, *headers]})
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+class StreamingResponse:
+    def __init__(self, chunks, content_type, headers=None):
+        self.chunks = chunks
+        self.content_type = content_type
+        self.status = 200
+        self.headers = headers or {}
+
+    async def send(self, send, headers, request):
+        extra = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in self.headers.items()]
+        await send({'type': 'http.response.start', 'status': self.status,
+                    'headers': [(b'content-type', self.content_type.encode('latin-1')), *extra, *headers]})
+        async for chunk in self.chunks:
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+def get_api_key(request):
+    """Get API key from request header or environment variable"""
+    return request.headers.get('X-API-Key') or os.environ.get('GEMINI_API_KEY')
+
+async def get_client(request):
+    api_key = get_api_key(request)
+    if not api_key:
+        raise ValueError("API key not provided. Please set your API key in the settings.")
+    # Resuming reads the operation store; only the first request per key pays for it
+    if sync_app.jobs.has_unresumed(sync_app.api_key_hash(api_key)):
+        await asyncio.to_thread(sync_app.resume_operations, api_key)
+    return sync_app.client_pool.get(api_key)
+
+def conditional_json(request, payload, data):
+    """JSONResponse for `payload`, or 304 if the client already has `data` (see app.conditional_json)"""
+    tag = response_encoding.etag(data)
+    headers = {'ETag': quote_etag(tag, weak=True), 'Cache-Control': 'private, no-cache', 'Vary': 'X-API-Key'}
+    if parse_etags(request.headers.get('If-None-Match')).contains_weak(tag):
+        metrics.not_modified_responses.inc(route=request.route)
+        return NotModifiedResponse(headers)
+    return JSONResponse(payload, headers=headers)
+
+def record_error(request, e):
+    """Count an exception against the current route"""
+    metrics.route_errors.inc(route=request.route, exception=type(e).__name__)
+
+def error_response(request, e, status=500):
+    record_error(request, e)
+    if isinstance(e, UpstreamUnavailable):
+        return JSONResponse({'success': False, 'error': str(e), 'retry_after': round(e.retry_after, 1)},
+                            e.status, headers={'Retry-After': str(math.ceil(e.retry_after))})
+    return JSONResponse({'success': False, 'error': str(e)}, status)
+
+
+async def create_store(request):
+    """Create a new file search store"""
+    try:
+        client = await get_client(request)
+        data = await request.json()
+        display_name = data.get('display_name', 'my-file-search-store')
+
+        file_search_store = await client.aio.file_search_stores.create(
+            config={'display_name': display_name}
+        )
+        owner = sync_app.api_key_hash(get_api_key(request))
+        await asyncio.to_thread(sync_app.metadata_index.put_store, owner, store_to_dict(file_search_store))
+        await asyncio.to_thread(sync_app.metadata_index.replace_documents, owner, file_search_store.name, [])
+
+        return JSONResponse({
+            'success': True,
+            'store_name': file_search_store.name,
+            'display_name': display_name
+        })
+    except Exception as e:
+        logger.error(f"Error creating store: {e}")
+        return error_response(request, e)
+
+async def list_stores(request):
+    """List all file search stores (from the metadata index when possible)"""
+    try:
+        client = await get_client(request)
+        owner = sync_app.api_key_hash(get_api_key(request))
+        index = sync_app.metadata_index
+        stores = None if request.args.get('refresh') == 'true' else await asyncio.to_thread(index.stores, owner)
+        cached, coalesced = stores is not None, False
+        if cached:
+            await asyncio.to_thread(index.refresh_later, owner, STORES_SCOPE,
+                                    lambda: sync_app.refresh_stores(client, owner))
+        else:
+            async def refresh():
+                stores = [store_to_dict(store) async for store in await client.aio.file_search_stores.list()]
+                return await asyncio.to_thread(index.replace_stores, owner, stores)
+            stores, coalesced = await sync_app.flights.do_async('list-stores', owner, refresh)
+
+        return conditional_json(request, {'success': True, 'stores': stores, 'cached': cached, 'coalesced': coalesced},
+                                stores)
+    except Exception as e:
+        logger.error(f"Error listing stores: {e}")
+        return error_response(request, e)
+
+async def upload_to_store(request):
+    """Upload file directly to file search store"""
+    # The detached upload buffer is closed here unless a job or batch took it over
+    stream, handed_off = None, False
+    try:
+        client = await get_client(request)
+        form, files = await request.form()
+        if 'file' not in files:
+            return JSONResponse({'success': False, 'error': 'No file provided'}, 400)
+
+        file = files['file']
+        store_name = form.get('store_name')
+        file_name = form.get('file_name', file.filename)
+
+        if file.filename == '':
+            return JSONResponse({'success': False, 'error': 'No file selected'}, 400)
+
+        try:
+            concurrency = sync_app.batch_concurrency(form.get('concurrency'))
+        except ValueError as e:
+            return JSONResponse({'success': False, 'error': str(e)}, 400)
+
+        stream, upload_info = detach_upload(file)
+
+        # Identical bytes already indexed in this store: skip the upload entirely
+        force = form.get('force', '').lower() == 'true'
+        existing = None if force else await asyncio.to_thread(
+            sync_app.upload_manifest.lookup, store_name, upload_info['sha256'])
+        if existing:
+            logger.info(f"Duplicate upload of {file_name} to {store_name}: {existing['document_name']}")
+            return JSONResponse({
+                'success': True,
+                'duplicate': True,
+                'message': 'Identical file already exists in this store',
+                'document_name': existing['document_name'],
+                'upload': upload_info
+            })
+
+        # Same bytes still indexing (possibly since before a restart): follow that job instead
+        pending_job = None if force else await asyncio.to_thread(
+            sync_app.operation_store.find_upload, store_name, upload_info['sha256'],
+            sync_app.api_key_hash(get_api_key(request)))
+        if pending_job:
+            logger.info(f"Duplicate upload of {file_name} to {store_name} while job {pending_job} is pending")
+            return JSONResponse({
+                'success': True,
+                'duplicate': True,
+                'pending': True,
+                'message': 'Identical file is already being indexed in this store',
+                'job_id': pending_job,
+                'upload': upload_info
+            }, 202)
+
+        # Large text/PDF files are split and ingested as parallel pieces
+        piece_size = piece_size_bytes(form.get('piece_size_mb') or flask_app.config['UPLOAD_PIECE_SIZE_MB'])
+        item = BatchItem(file_name, upload_info['size_bytes'], sync_app.stream_opener(stream),
+                         upload_info['mime_type'])
+        if can_split(item, piece_size):
+            batch_id = uuid.uuid4().hex
+            pieces = list(split_items([item], piece_size))
+            await asyncio.to_thread(sync_app.start_batch, client, store_name, batch_id, pieces, concurrency,
+                                    [stream], owner=sync_app.api_key_hash(get_api_key(request)))
+            handed_off = True
+            return JSONResponse({
+                'success': True,
+                'message': f'File split into {len(pieces)} pieces',
+                'batch_id': batch_id,
+                'pieces': len(pieces),
+                'concurrency': concurrency,
+                'upload': upload_info
+            }, 202)
+
+        config_dict = {'mime_type': upload_info['mime_type']}
+        if file_name:
+            config_dict['display_name'] = file_name
+
+        async def start(client):
+            try:
+                await asyncio.to_thread(sync_app.retrieval.add_text, upload_info['sha256'], stream,
+                                        upload_info['mime_type'])
+                return await client.aio.file_search_stores.upload_to_file_search_store(
+                    file_search_store_name=store_name,
+                    file=stream,
+                    config=config_dict
+                )
+            finally:
+                stream.close()
+
+        # Started and polled on the event loop; return a job ID at once
+        job = sync_app.jobs.submit_async(
+            'upload_to_store', client, start,
+            on_done=sync_app.upload_job_done,
+            meta={'store_name': store_name, 'file_name': file_name, 'upload': upload_info},
+            owner=sync_app.api_key_hash(get_api_key(request))
+        )
+        handed_off = True
+
+        return JSONResponse({
+            'success': True,
+            'message': 'File upload started',
+            'job_id': job.id,
+            'status': job.status,
+            'upload': upload_info
+        }, 202)
+
+    except Exception as e:
+        logger.error(f"Error uploading to store: {e}")
+        return error_response(request, e, getattr(e, 'status', 500))
+    finally:
+        if stream is not None and not handed_off:
+            stream.close()
+
+async def upload_file(request):
+    """Upload file using Files API"""
+    try:
+        client = await get_client(request)
+        form, files = await request.form()
+        if 'file' not in files:
+            return JSONResponse({'success': False, 'error': 'No file provided'}, 400)
+
+        file = files['file']
+        file_name = form.get('file_name', file.filename)
+
+        if file.filename == '':
+            return JSONResponse({'success': False, 'error': 'No file selected'}, 400)
+
+        stream, upload_info = detach_upload(file)
+        try:
+            await asyncio.to_thread(sync_app.retrieval.add_text, upload_info['sha256'], stream,
+                                    upload_info['mime_type'])
+            uploaded_file = await client.aio.files.upload(
+                file=stream,
+                config={'name': file_name, 'mime_type': upload_info['mime_type']}
+            )
+        finally:
+            stream.close()
+        await asyncio.to_thread(sync_app.retrieval.remember_file, uploaded_file.name, upload_info['sha256'])
+
+        return JSONResponse({
+            'success': True,
+            'file_name': uploaded_file.name,
+            'display_name': file_name,
+            'upload': upload_info
+        })
+    except Exception as e:
+        logger.error(f"Error uploading file: {e}")
+        return error_response(request, e, getattr(e, 'status', 500))
+
+async def import_file(request):
+    """Import an uploaded file into file search store"""
+    try:
+        client = await get_client(request)
+        data = await request.json()
+        store_name = data.get('store_name')
+        file_name = data.get('file_name')
+        custom_metadata = data.get('custom_metadata', [])
+
+        async def start(client):
+            return await client.aio.file_search_stores.import_file(
+                file_search_store_name=store_name,
+                file_name=file_name,
+                config={'custom_metadata': custom_metadata} if custom_metadata else None
+            )
+
+        job = sync_app.jobs.submit_async(
+            'import_file', client, start,
+            on_done=sync_app.import_job_done,
+            meta={'store_name': store_name, 'file_name': file_name},
+            owner=sync_app.api_key_hash(get_api_key(request))
+        )
+
+        return JSONResponse({
+            'success': True,
+            'message': 'File import started',
+            'job_id': job.id,
+            'status': job.status
+        }, 202)
+
+    except Exception as e:
+        logger.error(f"Error importing file: {e}")
+        return error_response(request, e)
+
+async def parse_query(request):
+    """Validate a query body; returns (data, error_response)"""
+    data = await request.json()
+    if not data.get('query'):
+        return data, JSONResponse({'success': False, 'error': 'No query provided'}, 400)
+    if not data.get('store_names'):
+        return data, JSONResponse({'success': False, 'error': 'No store names provided'}, 400)
+    if data.get('grounding', 'full') not in grounding.MODES:
+        return data, JSONResponse({
+            'success': False, 'error': f"grounding must be one of {', '.join(grounding.MODES)}"}, 400)
+    if data.get('check_filter') is not False:
+        unmatched = await asyncio.to_thread(sync_app.metadata_filter_error, data['store_names'],
+                                            data.get('metadata_filter'), sync_app.api_key_hash(get_api_key(request)))
+        if unmatched:
+            return data, JSONResponse(unmatched, 400)
+    return data, None
+
+async def query(request):
+    """Query the file search store"""
+    try:
+        client = await get_client(request)
+        data, invalid = await parse_query(request)
+        if invalid:
+            return invalid
+        query_text = data['query']
+        store_names = data['store_names']
+        metadata_filter = data.get('metadata_filter', None)
+        grounding_mode = data.get('grounding', 'full')
+        owner = sync_app.api_key_hash(get_api_key(request))
+
+        try:
+            decision = await asyncio.to_thread(sync_app.apply_prefilter, sync_app.prefilter_mode(data), query_text,
+                                               store_names, metadata_filter, owner)
+        except ValueError as e:
+            return JSONResponse({'success': False, 'error': str(e)}, 400)
+        if decision and decision['outcome'] == 'no_match':
+            return JSONResponse({'success': True, 'response': None, 'grounding_metadata': None, 'no_match': True,
+                                 'message': sync_app.no_match_message(decision), 'prefilter': decision})
+        search_stores = decision['store_names'] if decision else store_names
+
+        try:
+            route = sync_app.model_router.resolve('query', data, query_text, search_stores)
+        except ValueError as e:
+            return JSONResponse({'success': False, 'error': str(e)}, 400)
+
+        cache_key = make_key(query_text, search_stores, metadata_filter, owner, route.variant)
+        if not data.get('no_cache'):
+            cached = sync_app.query_cache.get(cache_key)
+            if cached is not None:
+                return JSONResponse({'success': True, **sync_app.shape_answer(cached, grounding_mode), 'cached': True,
+                                     'routing': route.to_dict(), 'prefilter': decision})
+
+        async def generate():
+            tool = sync_app.build_file_search_tool(search_stores, metadata_filter)
+
+            started = time.perf_counter()
+            response = await client.aio.models.generate_content(
+                model=route.model,
+                contents=query_text,
+                config=route.config(tools=[tool])
+            )
+            sync_app.model_router.record(route, time.perf_counter() - started, response.usage_metadata)
+
+            result = {
+                'response': response.text,
+                'grounding_metadata': grounding.from_response(response)
+            }
+            sync_app.query_cache.set(cache_key, result, store_names)
+            return result
+
+        result, coalesced = await sync_app.flights.do_async('query', cache_key, generate)
+
+        return JSONResponse({'success': True, **sync_app.shape_answer(result, grounding_mode), 'cached': False,
+                             'coalesced': coalesced, 'routing': route.to_dict(), 'prefilter': decision})
+    except Exception as e:
+        logger.error(f"Error querying: {e}")
+        return error_response(request, e)
+
+async def query_stream(request):
+    """Query the file search store, streaming the answer as Server-Sent Events"""
+    try:
+        client = await get_client(request)
+        data, invalid = await parse_query(request)
+        if invalid:
+            return invalid
+        query_text = data['query']
+        store_names = data['store_names']
+        metadata_filter = data.get('metadata_filter', None)
+        grounding_mode = data.get('grounding', 'full')
+        owner = sync_app.api_key_hash(get_api_key(request))
+
+        try:
+            decision = await asyncio.to_thread(sync_app.apply_prefilter, sync_app.prefilter_mode(data), query_text,
+                                               store_names, metadata_filter, owner)
+        except ValueError as e:
+            return JSONResponse({'success': False, 'error': str(e)}, 400)
+        if decision and decision['outcome'] == 'no_match':
+            async def no_match():
+                yield sync_app.sse_event('done', {
+                    'grounding_metadata': None,
+                    'ttfb_ms': decision['elapsed_ms'],
+                    'total_ms': decision['elapsed_ms'],
+                    'cached': False,
+                    'no_match': True,
+                    'message': sync_app.no_match_message(decision),
+                    'prefilter': decision
+                })
+            return StreamingResponse(no_match(), 'text/event-stream',
+                                     headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        search_stores = decision['store_names'] if decision else store_names
+
+        try:
+            route = sync_app.model_router.resolve('query-stream', data, query_text, search_stores)
+        except ValueError as e:
+            return JSONResponse({'success': False, 'error': str(e)}, 400)
+
+        cache_key = make_key(query_text, search_stores, metadata_filter, owner, route.variant)
+        cached = None if data.get('no_cache') else sync_app.query_cache.get(cache_key)
+        tool = sync_app.build_file_search_tool(search_stores, metadata_filter) if cached is None else None
+    except Exception as e:
+        logger.error(f"Error querying: {e}")
+        return error_response(request, e)
+
+    async def generate():
+        started = time.perf_counter()
+        if cached is not None:
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            yield sync_app.sse_event('chunk', {'text': cached['response']})
+            yield sync_app.sse_event('done', {
+                'grounding_metadata': grounding.shape(cached['grounding_metadata'], grounding_mode),
+                'ttfb_ms': elapsed_ms,
+                'total_ms': elapsed_ms,
+                'cached': True,
+                'routing': route.to_dict(),
+                'prefilter': decision
+            })
+            return
+
+        ttfb_ms = None
+        grounding_metadata = None
+        usage = None
+        text_parts = []
+        try:
+            async for chunk in await client.aio.models.generate_content_stream(
+                model=route.model,
+                contents=query_text,
+                config=route.config(tools=[tool])
+            ):
+                usage = chunk.usage_metadata or usage
+                if chunk.candidates:
+                    metadata = getattr(chunk.candidates[0], 'grounding_metadata', None)
+                    if metadata:
+                        grounding_metadata = grounding.extract(metadata)
+
+                if chunk.text:
+                    if ttfb_ms is None:
+                        ttfb_ms = round((time.perf_counter() - started) * 1000, 1)
+                    text_parts.append(chunk.text)
+                    yield sync_app.sse_event('chunk', {'text': chunk.text})
+
+            sync_app.query_cache.set(cache_key, {
+                'response': ''.join(text_parts),
+                'grounding_metadata': grounding_metadata
+            }, store_names)
+            total = time.perf_counter() - started
+            sync_app.model_router.record(route, total, usage,
+                                         ttfb=ttfb_ms / 1000 if ttfb_ms is not None else None)
+
+            yield sync_app.sse_event('done', {
+                'grounding_metadata': grounding.shape(grounding_metadata, grounding_mode),
+                'ttfb_ms': ttfb_ms,
+                'total_ms': round(total * 1000, 1),
+                'cached': False,
+                'routing': route.to_dict(),
+                'prefilter': decision
+            })
+        except Exception as e:
+            logger.error(f"Error streaming query: {e}")
+            record_error(request, e)
+            yield sync_app.sse_event('error', {'error': str(e), **sync_app.retry_hint(e)})
+
+    return StreamingResponse(
+        generate(), 'text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+async def query_batch(request):
+    """Run many queries against the same stores, streaming NDJSON results as they finish"""
+    try:
+        client = await get_client(request)
+        data = await request.json()
+        owner = sync_app.api_key_hash(get_api_key(request))
+        try:
+            items, store_names, metadata_filter, grounding_mode = sync_app.query_batch_params(data, owner)
+        except ValueError as e:
+            return JSONResponse({'success': False, 'error': str(e)}, 400)
+
+        tool = sync_app.build_file_search_tool(store_names, metadata_filter)
+
+        if data.get('mode') == 'batch':
+            route = sync_app.model_router.resolve('query-batch', data, None, store_names)
+
+            async def start(client):
+                return await create_batch_job(client.aio, items, tool, data.get('display_name'), route)
+
+            async def poll(client, batch_job):
+                return await client.aio.batches.get(name=batch_job.name)
+
+            job = sync_app.jobs.submit_async(
+                'query_batch', client, start,
+                on_done=lambda job, batch_job: batch_job_finished(batch_job, items, grounding_mode),
+                poll=poll,
+                meta={'store_names': store_names, 'queries': len(items)},
+                owner=owner
+            )
+            return JSONResponse({
+                'success': True,
+                'message': 'Batch job started',
+                'job_id': job.id,
+                'status': job.status,
+                'queries': len(items)
+            }, 202)
+
+        concurrency = min(int(data.get('concurrency', 8)), flask_app.config['QUERY_BATCH_MAX_CONCURRENCY'])
+        batch = QueryBatch(client, tool, store_names, metadata_filter, sync_app.query_cache, owner,
+                           concurrency, use_cache=not data.get('no_cache'), grounding_mode=grounding_mode,
+                           router=sync_app.model_router, hints=data)
+    except Exception as e:
+        logger.error(f"Error starting query batch: {e}")
+        return error_response(request, e)
+
+    async def generate():
+        async for result in batch.run_async(items):
+            yield response_encoding.json_line(result)
+        yield response_encoding.json_line({'done': True, **batch.summary()})
+
+    return StreamingResponse(generate(), 'application/x-ndjson')
+
+async def delete_store(request):
+    """Delete a file search store"""
+    try:
+        client = await get_client(request)
+        data = await request.json()
+        store_name = data.get('store_name')
+        force = data.get('force', True)
+
+        await client.aio.file_search_stores.delete(
+            name=store_name,
+            config={'force': force}
+        )
+        await asyncio.to_thread(sync_app.store_deleted, store_name)
+
+        return JSONResponse({
+            'success': True,
+            'message': 'Store deleted successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error deleting store: {e}")
+        return error_response(request, e)
+
+async def list_documents(request):
+    """List documents in a file search store (same parameters as the Flask route)"""
+    try:
+        client = await get_client(request)
+        store_name = request.args.get('store_name')
+        page_size = int(request.args['page_size']) if request.args.get('page_size', '').isdigit() else None
+        page_token = request.args.get('page_token')
+        ndjson = request.args.get('format') == 'ndjson'
+
+        if not store_name:
+            return JSONResponse({'success': False, 'error': 'store_name parameter is required'}, 400)
+
+        api_key = get_api_key(request)
+        owner = sync_app.api_key_hash(api_key)
+        if request.args.get('refresh') == 'true':
+            await asyncio.to_thread(sync_app.document_cache.drop, store_name)
+        lister = AsyncDocumentLister(client, api_key, sync_app.http_session, sync_app.document_cache, owner)
+
+        async def reconcile():
+            await asyncio.to_thread(
+                sync_app.metadata_index.refresh_later,
+                owner, store_name, lambda: sync_app.refresh_documents(client, api_key, owner, store_name))
+
+        if ndjson and not page_size:
+            async def generate():
+                try:
+                    async for document in lister.iter_documents(store_name):
+                        yield response_encoding.json_line(document)
+                    await reconcile()
+                except Exception as e:
+                    logger.error(f"Error streaming documents: {e}")
+                    record_error(request, e)
+                    yield response_encoding.json_line({'error': str(e)})
+
+            return StreamingResponse(generate(), 'application/x-ndjson')
+
+        async def list_all():
+            documents, cached = await lister.all(store_name)
+            if not cached:
+                await asyncio.to_thread(sync_app.upload_manifest.reconcile, store_name,
+                                        [document['name'] for document in documents])
+            return documents, cached
+
+        flight = (owner, store_name, page_size, page_token, request.args.get('refresh') == 'true')
+        if page_size:
+            (documents, next_page_token, cached), coalesced = await sync_app.flights.do_async(
+                'list-documents', flight, lambda: lister.page(store_name, page_size, page_token))
+        else:
+            (documents, cached), coalesced = await sync_app.flights.do_async('list-documents', flight, list_all)
+            next_page_token = None
+        await reconcile()
+
+        if ndjson:
+            async def body():
+                yield ''.join(response_encoding.json_line(document) for document in documents)
+            return StreamingResponse(body(), 'application/x-ndjson',
+                                     headers={'X-Next-Page-Token': next_page_token} if next_page_token else None)
+
+        return conditional_json(request, {
+            'success': True,
+            'documents': documents,
+            'count': len(documents),
+            'next_page_token': next_page_token,
+            'cached': cached,
+            'coalesced': coalesced
+        }, {'documents': documents, 'next_page_token': next_page_token})
+
+    except Exception as e:
+        logger.error(f"Error listing documents: {e}")
+        return error_response(request, e)
+
+
+ROUTES = {
+    ('POST', '/api/create-store'): create_store,
+    ('GET', '/api/list-stores'): list_stores,
+    ('POST', '/api/upload-to-store'): upload_to_store,
+    ('POST', '/api/upload-file'): upload_file,
+    ('POST', '/api/import-file'): import_file,
+    ('POST', '/api/query'): query,
+    ('POST', '/api/query-stream'): query_stream,
+    ('POST', '/api/query-batch'): query_batch,
+    ('POST', '/api/delete-store'): delete_store,
+    ('GET', '/api/list-documents'): list_documents,
+}
+
+
+async def call_wsgi(scope, receive, send):
+    """Serve a request with the Flask app on a worker thread
+
+    The body is spooled before the call; response chunks are handed back to
+    the event loop as the WSGI iterable produces them, so streamed responses
+    stay streamed.
+    """
+    request = AsyncRequest(scope, receive)
+    body = tempfile.SpooledTemporaryFile(max_size=WSGI_SPOOL_MAX_MEMORY, dir=flask_app.config['UPLOAD_FOLDER'])
+    try:
+        async for chunk in request.chunks():
+            body.write(chunk)
+    except HTTPError as e:
+        body.close()
+        await JSONResponse({'success': False, 'error': str(e)}, e.status).send(send, [], request)
+        return
+    body.seek(0)
+
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in request.headers.items():
+        key = name.upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = f"HTTP_{key}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+
+    def start_response(status, headers, exc_info=None):
+        loop.call_soon_threadsafe(queue.put_nowait, ('start', status, headers))
+
+    def run():
+        try:
+            result = flask_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if chunk:
+                        loop.call_soon_threadsafe(queue.put_nowait, ('body', chunk))
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        finally:
+            body.close()
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    worker = loop.run_in_executor(None, run)
+    while True:
+        item = await queue.get()
+        if item is done:
+            break
+        if item[0] == 'start':
+            await send({
+                'type': 'http.response.start',
+                'status': int(item[1].split(' ', 1)[0]),
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in item[2]]
+            })
+        else:
+            await send({'type': 'http.response.body', 'body': item[1], 'more_body': True})
+    await worker
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # Polling tasks keep running on the loop while the drain waits in a thread
+            await asyncio.to_thread(sync_app.shutdown_worker)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    handler = ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        # Metrics for delegated routes are recorded by the Flask hooks
+        await call_wsgi(scope, receive, send)
+        return
+
+    request = AsyncRequest(scope, receive)
+    started = time.perf_counter()
+    trace, token = start_trace(request.headers.get('traceparent'))
+    metrics.http_requests_in_flight.inc(route=request.route)
+    try:
+        try:
+            response = await handler(request)
+        except HTTPError as e:
+            response = error_response(request, e, e.status)
+        metrics.http_request_duration.observe(
+            time.perf_counter() - started,
+            route=request.route, method=request.method, status=response.status
+        )
+        headers = [(b'traceparent', trace.traceparent.encode('latin-1'))]
+        timing = trace.server_timing()
+        if timing:
+            headers.append((b'server-timing', timing.encode('latin-1')))
+        await response.send(send, headers, request)
+    finally:
+        metrics.http_requests_in_flight.dec(route=request.route)
+        end_trace(token)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run('asgi_app:app', host='0.0.0.0', port=int(os.environ.get('ASGI_PORT', 3001)))
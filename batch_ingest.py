@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""Bulk ingestion of many files into a file search store
+
+Each file goes through the same two steps as the step-by-step UI: upload with
+the Files API, then `import_file` with the file's `custom_metadata`. Files are
+processed on a bounded thread pool, rate-limit errors are retried with backoff,
+and completed files are recorded in a JSON progress file so an interrupted
+batch can be resumed without re-uploading what already finished.
+
+Large text files and PDFs can be split into pieces first (`--piece-size-mb`,
+see `chunking.py`) so one big file is ingested in parallel too.
+
+Usage:
+    python batch_ingest.py --store fileSearchStores/xxx docs/ more.pdf corpus.zip
+    python batch_ingest.py --store fileSearchStores/xxx --piece-size-mb 20 big-corpus.txt
+"""
+
+import argparse
+import json
+import logging
+import mimetypes
+import os
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from retry import call_with_backoff
+
+logger = logging.getLogger(__name__)
+
+# Batch states
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+# Archive members up to this size are extracted in memory
+ARCHIVE_SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+
+class BatchItem:
+    """One file to ingest; `open()` returns a seekable binary stream"""
+
+    def __init__(self, name, size, opener, mime_type=None, custom_metadata=None):
+        self.name = name
+        self.size = size
+        self.open = opener
+        self.mime_type = mime_type or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.custom_metadata = custom_metadata or []
+
+    @property
+    def key(self):
+        """Identity used to recognise already-ingested files on resume"""
+        return f"{self.name}:{self.size}"
+
+
+def items_from_path(path):
+    """BatchItems for a file, every file under a directory, or a .zip archive"""
+    if os.path.isdir(path):
+        items = []
+        for root, _, files in os.walk(path):
+            for filename in sorted(files):
+                full_path = os.path.join(root, filename)
+                items.append(file_item(full_path, os.path.relpath(full_path, path)))
+        return items
+    if zipfile.is_zipfile(path):
+        return items_from_zip(zipfile.ZipFile(path))
+    return [file_item(path, os.path.basename(path))]
+
+
+def file_item(path, name):
+    return BatchItem(name, os.path.getsize(path), lambda: open(path, 'rb'))
+
+
+def items_from_zip(archive):
+    """BatchItems for every file in an open ZipFile
+
+    Archive members are not seekable, so each one is extracted into a spooled
+    buffer just before it is uploaded.
+    """
+    def opener(info):
+        def open_member():
+            buffer = tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_MAX_MEMORY, mode='rb+')
+            with archive.open(info) as member:
+                while True:
+                    chunk = member.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    buffer.write(chunk)
+            buffer.seek(0)
+            return buffer
+        return open_member
+
+    return [BatchItem(info.filename, info.file_size, opener(info))
+            for info in archive.infolist() if not info.is_dir()]
+
+
+def apply_metadata(items, metadata):
+    """Attach custom_metadata from a {filename: [...], '*': [...]} mapping"""
+    default = metadata.get('*', [])
+    for item in items:
+        item.custom_metadata = metadata.get(item.name, default)
+    return items
+
+
+class BatchProgress:
+    """JSON file recording the result of every completed item"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.completed = {}
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.completed = json.load(f).get('completed', {})
+
+    def is_done(self, item):
+        return item.key in self.completed
+
+    def mark_done(self, item, result):
+        with self._lock:
+            self.completed[item.key] = result
+            if not self.path:
+                return
+            # Write atomically so a crash mid-write never corrupts progress
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'completed': self.completed}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+
+class BatchIngestor:
+    """Upload and import many files with bounded concurrency
+
+    `on_upload(item, stream)` and `on_imported(item, operation)`, if given, are
+    called from the worker thread just before each file is uploaded (the
+    stream must be left where it was) and as soon as its import has finished,
+    so callers can record the new document without waiting for the whole batch.
+    """
+
+    def __init__(self, client, store_name, concurrency=4, progress=None,
+                 retries=5, poll_interval=1.0, max_poll_interval=10.0, max_wait=3600, on_upload=None,
+                 on_imported=None):
+        self.client = client
+        self.store_name = store_name
+        self.concurrency = concurrency
+        self.progress = progress or BatchProgress()
+        self.retries = retries
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.max_wait = max_wait
+        self.on_upload = on_upload
+        self.on_imported = on_imported
+        self._lock = threading.Lock()
+        self.status = RUNNING
+        self.results = []
+        self.total = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def run(self, items):
+        """Ingest every item; returns the summary dict"""
+        self.total = len(items)
+        self.started_at = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='batch') as pool:
+                futures = []
+                for item in items:
+                    if self.progress.is_done(item):
+                        self._record({**self.progress.completed[item.key], 'status': 'skipped'})
+                        continue
+                    futures.append(pool.submit(self._ingest, item))
+                for future in as_completed(futures):
+                    self._record(future.result())
+            self.status = COMPLETED
+        except Exception:
+            self.status = FAILED
+            raise
+        finally:
+            self.finished_at = time.time()
+            # Pieces of a split file share one parent stream
+            sources = {id(item.source): item.source for item in items if getattr(item, 'source', None)}
+            for source in sources.values():
+                source.close()
+        return self.summary()
+
+    def _record(self, result):
+        with self._lock:
+            self.results.append(result)
+
+    def _ingest(self, item):
+        started = time.time()
+        attempts = {'count': 0}
+
+        def count_retry(attempt, error):
+            attempts['count'] += 1
+
+        result = {
+            'name': item.name,
+            'size_bytes': item.size,
+            'status': 'failed'
+        }
+        try:
+            stream = item.open()
+            self._notify(self.on_upload, item, stream)
+
+            def rewind(attempt, error):
+                count_retry(attempt, error)
+                stream.seek(0)
+
+            try:
+                uploaded = call_with_backoff(
+                    lambda: self.client.files.upload(
+                        file=stream,
+                        config={'display_name': item.name, 'mime_type': item.mime_type}
+                    ),
+                    retries=self.retries,
+                    on_retry=rewind
+                )
+            finally:
+                stream.close()
+
+            operation = call_with_backoff(
+                lambda: self.client.file_search_stores.import_file(
+                    file_search_store_name=self.store_name,
+                    file_name=uploaded.name,
+                    config={'custom_metadata': item.custom_metadata} if item.custom_metadata else None
+                ),
+                retries=self.retries,
+                on_retry=count_retry
+            )
+            operation = self._wait(operation)
+            self._notify(self.on_imported, item, operation)
+
+            result.update({
+                'status': 'succeeded',
+                'file_name': uploaded.name,
+                'document_name': getattr(getattr(operation, 'response', None), 'document_name', None)
+            })
+        except Exception as e:
+            logger.error(f"Batch item {item.name} failed: {e}")
+            result['error'] = str(e)
+
+        result['retries'] = attempts['count']
+        result['seconds'] = round(time.time() - started, 3)
+        if result['status'] == 'succeeded':
+            self.progress.mark_done(item, result)
+        return result
+
+    def _notify(self, callback, item, *args):
+        if callback is None:
+            return
+        try:
+            callback(item, *args)
+        except Exception as e:
+            # The upload goes ahead either way; only the caller's bookkeeping failed
+            logger.warning(f"Batch item {item.name}: {callback.__name__} failed: {e}")
+
+    def _wait(self, operation):
+        """Poll an import operation with backoff until it is done"""
+        deadline = time.time() + self.max_wait
+        interval = self.poll_interval
+        while not operation.done:
+            if time.time() > deadline:
+                raise TimeoutError('Operation timeout; file import may still be processing')
+            time.sleep(interval)
+            operation = call_with_backoff(lambda: self.client.operations.get(operation), retries=self.retries)
+            interval = min(interval * 1.5, self.max_poll_interval)
+        if getattr(operation, 'error', None):
+            raise RuntimeError(str(operation.error))
+        return operation
+
+    def summary(self):
+        with self._lock:
+            results = list(self.results)
+        end = self.finished_at or time.time()
+        elapsed = max(end - (self.started_at or end), 1e-9)
+        processed = [r for r in results if r['status'] != 'skipped']
+        succeeded = [r for r in processed if r['status'] == 'succeeded']
+        total_bytes = sum(r['size_bytes'] for r in succeeded)
+        return {
+            'status': self.status,
+            'store_name': self.store_name,
+            'total': self.total,
+            'done': len(results),
+            'succeeded': len(succeeded),
+            'failed': len(processed) - len(succeeded),
+            'skipped': len(results) - len(processed),
+            'bytes': total_bytes,
+            'elapsed_seconds': round(elapsed, 3),
+            'files_per_second': round(len(succeeded) / elapsed, 3),
+            'mb_per_second': round(total_bytes / (1024 * 1024) / elapsed, 3),
+            'files': results
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk upload files into a Gemini file search store')
+    parser.add_argument('paths', nargs='+', help='Files, directories or .zip archives')
+    parser.add_argument('--store', required=True, help='File search store name (fileSearchStores/xxx)')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--metadata', help='JSON file mapping file names (or "*") to custom_metadata lists')
+    parser.add_argument('--progress', default='.batch-progress.json',
+                        help='Progress file used to resume an interrupted batch')
+    parser.add_argument('--piece-size-mb', type=float, default=0,
+                        help='Split text files and PDFs larger than this into pieces (0 = never split)')
+    args = parser.parse_args(argv)
+
+    api_key = os.environ.get('GEMINI_API_KEY')
+    if not api_key:
+        print("Error: GEMINI_API_KEY environment variable not set")
+        return 1
+
+    from google import genai
+    client = genai.Client(api_key=api_key)
+
+    items = []
+    for path in args.paths:
+        items.extend(items_from_path(path))
+    if args.metadata:
+        with open(args.metadata, 'r', encoding='utf-8') as f:
+            apply_metadata(items, json.load(f))
+    if args.piece_size_mb:
+        from chunking import piece_size_bytes, split_items
+        items = list(split_items(items, piece_size_bytes(args.piece_size_mb)))
+
+    ingestor = BatchIngestor(client, args.store, args.concurrency, BatchProgress(args.progress))
+    summary = ingestor.run(items)
+
+    for result in summary['files']:
+        print(f"{result['status']:>9}  {result['name']}  ({result.get('seconds', 0)}s)"
+              + (f"  {result['error']}" if result.get('error') else ''))
+    print(f"\n{summary['succeeded']} succeeded, {summary['failed']} failed, {summary['skipped']} skipped "
+          f"in {summary['elapsed_seconds']}s "
+          f"({summary['files_per_second']} files/s, {summary['mb_per_second']} MB/s)")
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,636 @@
+#!/usr/bin/env python3
+"""Offline benchmark for every app.py endpoint against the fake Gemini backend
+
+Runs each scenario with a fixed number of requests at a given concurrency and
+reports p50/p95/p99 latency, throughput and peak memory. Results are written
+as JSON so two runs can be compared:
+
+    python3 benchmark.py --requests 200 --concurrency 16 --output bench_results.json
+    python3 benchmark.py --output new.json --compare bench_results.json
+
+By default the app runs in-process with `GEMINI_BACKEND=fake`. To measure a
+real server instead, start it with `GEMINI_BACKEND=fake python3 app.py` and
+pass `--base-url http://localhost:3000`.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+API_KEY = 'benchmark-key'
+HEADERS = {'X-API-Key': API_KEY}
+
+# Seed text for the query_no_match store; shares no words with its query
+TEXT_DOCUMENTS = (
+    'Quarterly revenue grew in the northern region after the new warehouse opened.',
+    'The onboarding guide explains how to request laptop access and building badges.'
+)
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class InProcessTransport:
+    """Drive the Flask app through per-thread test clients"""
+
+    def __init__(self, args):
+        os.environ['GEMINI_BACKEND'] = 'fake'
+        os.environ.setdefault('DATA_FOLDER', tempfile.mkdtemp(prefix='bench-data-'))
+        # Measure the app, not the client-side rate limiter in front of Gemini
+        os.environ.setdefault('UPSTREAM_RATE_LIMITS',
+                              'generate=1000:1000,upload=1000:1000,operations=1000:1000,list=1000:1000')
+        import fake_genai
+        fake_genai._default_backend = fake_genai.FakeBackend(fake_genai.FakeConfig(
+            latency=args.latency,
+            jitter=args.jitter,
+            operation_delay=args.operation_delay,
+            error_rate=args.error_rate,
+            seed=args.seed
+        ))
+        import app
+        # Request logging would dominate the measurement
+        logging.getLogger().setLevel(logging.WARNING)
+        self.app = app.app
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def get(self, path, params=None):
+        response = self._client().get(path, query_string=params, headers=HEADERS)
+        return response.status_code, response.get_json(silent=True)
+
+    def post_json(self, path, body):
+        response = self._client().post(path, json=body, headers=HEADERS)
+        return response.status_code, response.get_json(silent=True)
+
+    def post_form(self, path, data, files):
+        payload = dict(data)
+        for field, items in files.items():
+            payload[field] = [(io.BytesIO(content), name) for name, content in items]
+        response = self._client().post(path, data=payload, headers=HEADERS,
+                                       content_type='multipart/form-data')
+        return response.status_code, response.get_json(silent=True)
+
+    def post_stream(self, path, body, on_first_byte):
+        response = self._client().post(path, json=body, headers=HEADERS, buffered=False)
+        first = True
+        for _ in response.response:
+            if first:
+                on_first_byte()
+                first = False
+        response.close()
+        return response.status_code
+
+
+class HttpTransport:
+    """Drive a running server over HTTP"""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+
+    def get(self, path, params=None):
+        response = self.session.get(self.base_url + path, params=params)
+        return response.status_code, self._json(response)
+
+    def post_json(self, path, body):
+        response = self.session.post(self.base_url + path, json=body)
+        return response.status_code, self._json(response)
+
+    def post_form(self, path, data, files):
+        file_list = [(field, (name, content)) for field, items in files.items() for name, content in items]
+        response = self.session.post(self.base_url + path, data=data, files=file_list)
+        return response.status_code, self._json(response)
+
+    def post_stream(self, path, body, on_first_byte):
+        with self.session.post(self.base_url + path, json=body, stream=True) as response:
+            first = True
+            for _ in response.iter_content(chunk_size=None):
+                if first:
+                    on_first_byte()
+                    first = False
+            return response.status_code
+
+    @staticmethod
+    def _json(response):
+        try:
+            return response.json()
+        except ValueError:
+            return None
+
+
+class Benchmark:
+    def __init__(self, transport, args):
+        self.transport = transport
+        self.args = args
+        self.store_name = None
+        self.text_store_name = None
+        self.counter = 0
+        self.lock = threading.Lock()
+        self.text_store_lock = threading.Lock()
+
+    def next_id(self):
+        with self.lock:
+            self.counter += 1
+            return self.counter
+
+    def payload(self):
+        return os.urandom(self.args.file_size)
+
+    def wait_for_job(self, job_id, timeout=120):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            status, data = self.transport.get(f'/api/jobs/{job_id}')
+            job = (data or {}).get('job') or {}
+            if job.get('done'):
+                return job
+            time.sleep(0.05)
+        raise TimeoutError(f'Job {job_id} did not finish')
+
+    def setup(self):
+        status, data = self.transport.post_json('/api/create-store', {'display_name': 'benchmark'})
+        if status != 200:
+            raise RuntimeError(f'Could not create benchmark store: {data}')
+        self.store_name = data['store_name']
+        job_ids = []
+        for i in range(self.args.seed_documents):
+            status, data = self.transport.post_form(
+                '/api/upload-to-store',
+                {'store_name': self.store_name, 'file_name': f'seed-{i}.txt'},
+                {'file': [(f'seed-{i}.txt', self.payload())]}
+            )
+            if data and data.get('job_id'):
+                job_ids.append(data['job_id'])
+        for job_id in job_ids:
+            self.wait_for_job(job_id)
+
+    def text_store(self):
+        """A store holding only indexed text uploads, so the retrieval index covers it
+
+        The shared store also receives batch uploads the index does not link.
+        """
+        with self.text_store_lock:
+            if self.text_store_name is None:
+                status, data = self.transport.post_json('/api/create-store', {'display_name': 'benchmark-text'})
+                if status != 200:
+                    raise RuntimeError(f'Could not create benchmark text store: {data}')
+                store_name = data['store_name']
+                for i, text in enumerate(TEXT_DOCUMENTS):
+                    status, data = self.transport.post_form(
+                        '/api/upload-to-store',
+                        {'store_name': store_name, 'file_name': f'text-{i}.txt'},
+                        {'file': [(f'text-{i}.txt', text.encode('utf-8'))]}
+                    )
+                    if not data or not data.get('job_id'):
+                        raise RuntimeError(f'Could not seed benchmark text store: {data}')
+                    self.wait_for_job(data['job_id'])
+                # Indexing runs in the background, behind every earlier upload
+                deadline = time.time() + 120
+                while self.prefilter_outcome(store_name, 'warehouse') == 'uncovered':
+                    if time.time() > deadline:
+                        raise TimeoutError('Benchmark text store was never indexed')
+                    time.sleep(0.1)
+                self.text_store_name = store_name
+            return self.text_store_name
+
+    def prefilter_outcome(self, store_name, query_text):
+        status, data = self.transport.post_json('/api/query', {
+            'query': query_text, 'store_names': [store_name], 'prefilter': 'narrow'})
+        return ((data or {}).get('prefilter') or {}).get('outcome')
+
+    # Scenarios: each performs one logical request and returns (ok, latency_seconds, extra)
+
+    def timed(self, fn):
+        started = time.perf_counter()
+        status = fn()
+        return status, time.perf_counter() - started
+
+    def scenario_list_stores(self):
+        (status, _), elapsed = self.timed(lambda: self.transport.get('/api/list-stores'))
+        return status == 200, elapsed, None
+
+    def scenario_create_store(self):
+        (status, _), elapsed = self.timed(
+            lambda: self.transport.post_json('/api/create-store', {'display_name': f'bench-{self.next_id()}'}))
+        return status == 200, elapsed, None
+
+    def scenario_delete_store(self):
+        status, data = self.transport.post_json('/api/create-store', {'display_name': f'bench-del-{self.next_id()}'})
+        if status != 200:
+            return False, 0.0, None
+        (status, _), elapsed = self.timed(
+            lambda: self.transport.post_json('/api/delete-store', {'store_name': data['store_name']}))
+        return status == 200, elapsed, None
+
+    def scenario_list_documents(self):
+        (status, _), elapsed = self.timed(
+            lambda: self.transport.get('/api/list-documents', {'store_name': self.store_name}))
+        return status == 200, elapsed, None
+
+    def scenario_list_documents_paged(self):
+        (status, _), elapsed = self.timed(
+            lambda: self.transport.get('/api/list-documents', {'store_name': self.store_name, 'page_size': 5}))
+        return status == 200, elapsed, None
+
+    def scenario_upload_to_store(self):
+        n = self.next_id()
+        (status, _), elapsed = self.timed(lambda: self.transport.post_form(
+            '/api/upload-to-store',
+            {'store_name': self.store_name, 'file_name': f'bench-{n}.txt'},
+            {'file': [(f'bench-{n}.txt', self.payload())]}
+        ))
+        return status in (200, 202), elapsed, None
+
+    def scenario_upload_to_store_complete(self):
+        n = self.next_id()
+        started = time.perf_counter()
+        status, data = self.transport.post_form(
+            '/api/upload-to-store',
+            {'store_name': self.store_name, 'file_name': f'bench-e2e-{n}.txt'},
+            {'file': [(f'bench-e2e-{n}.txt', self.payload())]}
+        )
+        if status == 202:
+            job = self.wait_for_job(data['job_id'])
+            status = 200 if job['status'] == 'succeeded' else 500
+        return status == 200, time.perf_counter() - started, None
+
+    def scenario_upload_file(self):
+        n = self.next_id()
+        (status, _), elapsed = self.timed(lambda: self.transport.post_form(
+            '/api/upload-file', {'file_name': f'bench-file-{n}.txt'},
+            {'file': [(f'bench-file-{n}.txt', self.payload())]}
+        ))
+        return status == 200, elapsed, None
+
+    def scenario_import_file(self):
+        n = self.next_id()
+        status, data = self.transport.post_form(
+            '/api/upload-file', {'file_name': f'bench-import-{n}.txt'},
+            {'file': [(f'bench-import-{n}.txt', self.payload())]}
+        )
+        if status != 200:
+            return False, 0.0, None
+        (status, _), elapsed = self.timed(lambda: self.transport.post_json('/api/import-file', {
+            'store_name': self.store_name,
+            'file_name': data['file_name'],
+            'custom_metadata': [{'key': 'bench', 'string_value': str(n)}]
+        }))
+        return status in (200, 202), elapsed, None
+
+    def scenario_batch_upload(self):
+        n = self.next_id()
+        files = [(f'batch-{n}-{i}.txt', self.payload()) for i in range(5)]
+        (status, _), elapsed = self.timed(lambda: self.transport.post_form(
+            '/api/batch-upload', {'store_name': self.store_name}, {'files': files}))
+        return status == 202, elapsed, None
+
+    def scenario_query(self):
+        n = self.next_id()
+        (status, _), elapsed = self.timed(lambda: self.transport.post_json('/api/query', {
+            'query': f'benchmark question {n}', 'store_names': [self.store_name]}))
+        return status == 200, elapsed, None
+
+    def scenario_query_cached(self):
+        (status, _), elapsed = self.timed(lambda: self.transport.post_json('/api/query', {
+            'query': 'benchmark repeated question', 'store_names': [self.store_name]}))
+        return status == 200, elapsed, None
+
+    def scenario_query_stream(self):
+        n = self.next_id()
+        started = time.perf_counter()
+        first = {}
+        status = self.transport.post_stream('/api/query-stream', {
+            'query': f'benchmark stream {n}', 'store_names': [self.store_name]},
+            lambda: first.setdefault('at', time.perf_counter()))
+        total = time.perf_counter() - started
+        ttfb = first.get('at', started + total) - started
+        return status == 200, total, {'ttfb': ttfb}
+
+    def scenario_query_batch(self):
+        n = self.next_id()
+        started = time.perf_counter()
+        first = {}
+        status = self.transport.post_stream('/api/query-batch', {
+            'queries': [f'benchmark batch {n}-{i}' for i in range(10)],
+            'store_names': [self.store_name], 'concurrency': 10},
+            lambda: first.setdefault('at', time.perf_counter()))
+        total = time.perf_counter() - started
+        ttfb = first.get('at', started + total) - started
+        return status == 200, total, {'ttfb': ttfb}
+
+    def prepare_query_no_match(self):
+        self.text_store()
+
+    def scenario_query_no_match(self):
+        # Settled by the local retrieval index without a generate call
+        store_name = self.text_store()
+        (status, data), elapsed = self.timed(lambda: self.transport.post_json('/api/query', {
+            'query': 'benchmark unmatched question', 'store_names': [store_name], 'prefilter': 'full'}))
+        return status == 200 and bool((data or {}).get('no_match')), elapsed, None
+
+    def scenario_jobs(self):
+        (status, _), elapsed = self.timed(lambda: self.transport.get('/api/jobs'))
+        return status == 200, elapsed, None
+
+    def scenario_stats(self):
+        (status, _), elapsed = self.timed(lambda: self.transport.get('/api/stats'))
+        return status == 200, elapsed, None
+
+    def run_scenario(self, name):
+        fn = getattr(self, f'scenario_{name}')
+        # Set-up a scenario needs is done before the clock starts
+        prepare = getattr(self, f'prepare_{name}', None)
+        if prepare:
+            prepare()
+        latencies = []
+        ttfbs = []
+        errors = 0
+
+        def one(_):
+            try:
+                return fn()
+            except Exception as e:
+                return False, 0.0, {'error': str(e)}
+
+        rss_before = peak_rss_bytes()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            for ok, elapsed, extra in pool.map(one, range(self.args.requests)):
+                if ok:
+                    latencies.append(elapsed)
+                    if extra and 'ttfb' in extra:
+                        ttfbs.append(extra['ttfb'])
+                else:
+                    errors += 1
+        wall = time.perf_counter() - started
+
+        result = {
+            'requests': self.args.requests,
+            'concurrency': self.args.concurrency,
+            'errors': errors,
+            'wall_seconds': round(wall, 3),
+            'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+            'latency_ms': summarize(latencies),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'rss_growth_bytes': peak_rss_bytes() - rss_before
+        }
+        if ttfbs:
+            result['ttfb_ms'] = summarize(ttfbs)
+        return result
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return None
+    ms = lambda v: round(v * 1000, 2)
+    return {
+        'p50': ms(percentile(values, 50)),
+        'p95': ms(percentile(values, 95)),
+        'p99': ms(percentile(values, 99)),
+        'mean': ms(sum(values) / len(values)),
+        'max': ms(values[-1])
+    }
+
+
+SCENARIOS = [
+    'list_stores', 'create_store', 'delete_store', 'list_documents', 'list_documents_paged',
+    'upload_to_store', 'upload_to_store_complete', 'upload_file', 'import_file', 'batch_upload',
+    'query', 'query_cached', 'query_stream', 'query_batch', 'query_no_match', 'jobs', 'stats'
+]
+
+
+# Modules app.py must not import at load time (see lazy_import.py)
+DEFERRED_MODULES = ('google.genai', 'requests')
+
+# Runs in a fresh interpreter: import the app, then time its first Gemini-bound request
+STARTUP_PROBE = r"""
+import json, threading, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+# With IMPORT_WARMUP=1 the request comes once the warm-up is done, as it would a moment after boot
+for thread in threading.enumerate():
+    if thread.name == 'import-warmup':
+        thread.join()
+warmed = time.perf_counter()
+response = app.app.test_client().post('/api/create-store', json={'display_name': 'startup'},
+                                      headers={'X-API-Key': 'benchmark-key'})
+print(json.dumps({'import': imported - started, 'warmup': warmed - imported,
+                  'first_request': time.perf_counter() - warmed,
+                  'status': response.status_code}))
+"""
+
+
+def parse_importtime(stderr, root='app'):
+    """{module: cumulative seconds} for `root` and what it imported, from `-X importtime` output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((len(name) - len(name.lstrip()), name.strip(), int(cumulative) / 1e6))
+    # Lines come in completion order, so a module's imports are the deeper lines right before it
+    end = max(i for i, (_, name, _) in enumerate(rows) if name == root)
+    start = end
+    while start > 0 and rows[start - 1][0] > rows[end][0]:
+        start -= 1
+    return {name: seconds for _, name, seconds in rows[start:end + 1]}
+
+
+def measure_startup(args):
+    """Import profile of app.py plus import/first-request times with and without the warm-up"""
+    import statistics
+    import subprocess
+
+    env = {**os.environ, 'GEMINI_BACKEND': 'fake',
+           'PYTHONPATH': os.path.dirname(os.path.abspath(__file__))}
+    ms = lambda v: round(v * 1000, 1)
+
+    def run(command, warmup):
+        # A fresh cwd and data folder per run, so no run starts with another's state
+        with tempfile.TemporaryDirectory(prefix='bench-startup-') as cwd:
+            return subprocess.run(
+                [sys.executable, *command], cwd=cwd, capture_output=True, text=True, check=True,
+                env={**env, 'DATA_FOLDER': os.path.join(cwd, 'data'), 'IMPORT_WARMUP': warmup}
+            )
+
+    # The profile is taken with the warm-up off, or its imports would show up too
+    profiles = [parse_importtime(run(['-X', 'importtime', '-c', 'import app'], '0').stderr)
+                for _ in range(args.startup_runs)]
+    app_import = statistics.median(profile['app'] for profile in profiles)
+    slowest = sorted(profiles[-1].items(), key=lambda item: -item[1])
+    eager = [module for module in DEFERRED_MODULES if any(module in profile for profile in profiles)]
+
+    probes = {}
+    for warmup in ('0', '1'):
+        samples = [json.loads(run(['-c', STARTUP_PROBE], warmup).stdout.strip().splitlines()[-1])
+                   for _ in range(args.startup_runs)]
+        probes['warmup' if warmup == '1' else 'lazy'] = {
+            'import_ms': ms(statistics.median(sample['import'] for sample in samples)),
+            'warmup_ms': ms(statistics.median(sample['warmup'] for sample in samples)),
+            'first_request_ms': ms(statistics.median(sample['first_request'] for sample in samples)),
+            'errors': sum(1 for sample in samples if sample['status'] != 200)
+        }
+    return {
+        'runs': args.startup_runs,
+        'import_app_ms': ms(app_import),
+        'slowest_imports_ms': {name: ms(seconds) for name, seconds in slowest[1:11]},
+        'eager_deferred_modules': eager,
+        'probes': probes
+    }
+
+
+def report_startup(startup, previous=None):
+    before = (previous or {}).get('startup')
+    delta = f" (was {before['import_app_ms']})" if before else ''
+    print(f"import app: {startup['import_app_ms']} ms median of {startup['runs']}{delta}")
+    for name, value in startup['slowest_imports_ms'].items():
+        print(f"  {name:<40}{value:>10} ms")
+    print(f"\n{'mode':<12}{'import ms':>12}{'warm-up ms':>12}{'first request ms':>20}")
+    for mode, probe in startup['probes'].items():
+        print(f"{mode:<12}{probe['import_ms']:>12}{probe['warmup_ms']:>12}{probe['first_request_ms']:>20}")
+    if startup['eager_deferred_modules']:
+        print(f"\nImported eagerly by app.py: {', '.join(startup['eager_deferred_modules'])}")
+
+
+def compare(current, previous):
+    """Print p50/p95/throughput deltas against an earlier result file"""
+    print(f"\n{'scenario':<28}{'p50 ms':>18}{'p95 ms':>18}{'req/s':>18}")
+    for name, result in current['scenarios'].items():
+        before = previous.get('scenarios', {}).get(name)
+        if not before or not result['latency_ms'] or not before['latency_ms']:
+            continue
+
+        def delta(now, then):
+            if not then:
+                return f"{now}"
+            return f"{now} ({(now - then) / then * 100:+.0f}%)"
+
+        print(f"{name:<28}"
+              f"{delta(result['latency_ms']['p50'], before['latency_ms']['p50']):>18}"
+              f"{delta(result['latency_ms']['p95'], before['latency_ms']['p95']):>18}"
+              f"{delta(result['throughput_rps'], before['throughput_rps']):>18}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark app.py endpoints against a fake Gemini backend')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--scenarios', help=f"Comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument('--latency', type=float, default=0.05, help='Fake upstream latency per call (s)')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--operation-delay', type=float, default=0.5, help='Fake indexing time (s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of upstream calls failing with 429')
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help='Upload payload size (bytes)')
+    parser.add_argument('--seed-documents', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--base-url', help='Benchmark a running server instead of the in-process app')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='Earlier result file to compare against')
+    parser.add_argument('--startup', action='store_true',
+                        help='Measure import time and first-request latency instead of the scenarios')
+    parser.add_argument('--startup-runs', type=int, default=5, help='Fresh interpreters per startup measurement')
+    parser.add_argument('--max-import-ms', type=float,
+                        help='With --startup, exit 1 if importing app.py takes longer than this')
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        return run_startup(args)
+
+    scenarios = args.scenarios.split(',') if args.scenarios else SCENARIOS
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenario(s): {', '.join(unknown)}")
+
+    transport = HttpTransport(args.base_url) if args.base_url else InProcessTransport(args)
+    bench = Benchmark(transport, args)
+    bench.setup()
+
+    results = {
+        'meta': {
+            'run_id': uuid.uuid4().hex,
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'mode': 'http' if args.base_url else 'in-process',
+            'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}
+        },
+        'scenarios': {}
+    }
+
+    print(f"{'scenario':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'errors':>8}")
+    for name in scenarios:
+        result = bench.run_scenario(name)
+        results['scenarios'][name] = result
+        latency = result['latency_ms'] or {}
+        print(f"{name:<28}{latency.get('p50', '-'):>10}{latency.get('p95', '-'):>10}"
+              f"{latency.get('p99', '-'):>10}{result['throughput_rps']:>10}{result['errors']:>8}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f))
+    return 0
+
+
+def run_startup(args):
+    """--startup: exit 1 if app.py imports a deferred module or exceeds --max-import-ms"""
+    results = {
+        'meta': {
+            'run_id': uuid.uuid4().hex,
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'mode': 'startup'
+        },
+        'startup': measure_startup(args)
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    report_startup(results['startup'], previous)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    startup = results['startup']
+    if startup['eager_deferred_modules']:
+        return 1
+    if args.max_import_ms and startup['import_app_ms'] > args.max_import_ms:
+        print(f"import app took {startup['import_app_ms']} ms, over the {args.max_import_ms} ms limit")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""Resumable chunked uploads from the browser
+
+A single multipart POST of a large file starts over when the connection
+drops, and the page cannot show progress while it runs. With the chunked
+protocol the browser splits the file itself:
+
+1. `create` registers the upload (name, size, MIME type) and returns its ID
+   and chunk size; the part file is created at its full size
+2. chunks are PUT in any order, several at a time; each one is copied from
+   the request stream into its own offset of the part file, block by block,
+   so neither a chunk nor the whole file is held in memory
+3. `status` lists the chunks received so far, so an interrupted upload
+   continues with just the missing ones
+4. `finish` hashes the assembled file and returns it as an open stream with
+   the same info `detach_upload` gives for multipart uploads
+
+Upload state is kept in SQLite and part files in a shared folder, so the
+chunks of one upload may be served by different worker processes.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import metrics
+from upload_stream import upload_stats
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunked_uploads (
+    upload_id TEXT PRIMARY KEY,
+    owner TEXT,
+    file_name TEXT NOT NULL,
+    mime_type TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunked_uploads_updated ON chunked_uploads (updated_at);
+CREATE TABLE IF NOT EXISTS upload_chunks (
+    upload_id TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    PRIMARY KEY (upload_id, chunk)
+);
+"""
+
+MIN_CHUNK_SIZE = 256 * 1024
+# Bytes copied from a request stream per read
+COPY_BLOCK_SIZE = 256 * 1024
+
+
+class ChunkedUploads:
+    """Part files plus the SQLite record of which chunks have arrived"""
+
+    def __init__(self, folder, path, chunk_size=8 * 1024 * 1024, max_chunk_size=None,
+                 max_size=None, retention=24 * 3600):
+        self.folder = folder
+        self.path = path
+        self.chunk_size = chunk_size
+        self.max_chunk_size = max_chunk_size or chunk_size
+        self.max_size = max_size
+        self.retention = retention
+        self._lock = threading.Lock()
+        self.chunks_received = 0
+        self.chunks_rejected = 0
+        self.completed = 0
+        self.aborted = 0
+        self.expired = 0
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.folder, f"{upload_id}.part")
+
+    def _load(self, conn, upload_id, owner):
+        row = conn.execute(
+            'SELECT file_name, mime_type, size_bytes, chunk_size, created_at FROM chunked_uploads '
+            'WHERE upload_id = ? AND owner IS ?',
+            (upload_id, owner)
+        ).fetchone()
+        if row is None:
+            return None
+        file_name, mime_type, size, chunk_size, created_at = row
+        return {
+            'upload_id': upload_id,
+            'file_name': file_name,
+            'mime_type': mime_type,
+            'size_bytes': size,
+            'chunk_size': chunk_size,
+            'chunks': -(-size // chunk_size),
+            'created_at': created_at
+        }
+
+    def _status(self, conn, upload):
+        received = [row[0] for row in conn.execute(
+            'SELECT chunk FROM upload_chunks WHERE upload_id = ? ORDER BY chunk', (upload['upload_id'],))]
+        done = set(received)
+        missing = [i for i in range(upload['chunks']) if i not in done]
+        received_bytes = sum(self.chunk_length(upload, i) for i in received)
+        return {
+            **upload,
+            'received': received,
+            'missing': missing,
+            'received_bytes': received_bytes,
+            'complete': not missing
+        }
+
+    def chunk_length(self, upload, index):
+        """Expected size of chunk `index`; only the last chunk may be shorter"""
+        start = index * upload['chunk_size']
+        return min(upload['chunk_size'], upload['size_bytes'] - start)
+
+    def create(self, owner, file_name, size, mime_type, chunk_size=None):
+        """Register an upload and create its part file; raises ValueError on bad sizes"""
+        size = int(size)
+        chunk_size = int(chunk_size or self.chunk_size)
+        if size < 0:
+            raise ValueError('size_bytes must not be negative')
+        if self.max_size is not None and size > self.max_size:
+            raise ValueError(f"File is larger than the {self.max_size // (1024 * 1024)} MB limit")
+        if not MIN_CHUNK_SIZE <= chunk_size <= self.max_chunk_size:
+            raise ValueError(f"chunk_size must be between {MIN_CHUNK_SIZE} and {self.max_chunk_size} bytes")
+
+        self.prune()
+        upload_id = uuid.uuid4().hex
+        # Sized up front so chunks can be written at their offsets in any order
+        with open(self._part_path(upload_id), 'wb') as part:
+            part.truncate(size)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO chunked_uploads VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (upload_id, owner, file_name, mime_type, size, chunk_size, now, now)
+            )
+            status = self._status(conn, self._load(conn, upload_id, owner))
+        logger.info(f"Chunked upload {upload_id} of {file_name}: {size} bytes in {status['chunks']} chunk(s)")
+        return status
+
+    def status(self, upload_id, owner):
+        """Upload details with received/missing chunk indexes, or None if unknown"""
+        with self._connect() as conn:
+            upload = self._load(conn, upload_id, owner)
+            return self._status(conn, upload) if upload else None
+
+    def write_chunk(self, upload_id, owner, index, stream, length):
+        """Copy one chunk from `stream` into the part file
+
+        Returns the updated status, or None if the upload is unknown. Raises
+        ValueError if the index or length is wrong or the stream ends early;
+        the chunk is then simply sent again.
+        """
+        with self._connect() as conn:
+            upload = self._load(conn, upload_id, owner)
+        if upload is None:
+            return None
+        try:
+            if not 0 <= index < upload['chunks']:
+                raise ValueError(f"Chunk index must be between 0 and {upload['chunks'] - 1}")
+            expected = self.chunk_length(upload, index)
+            if length != expected:
+                raise ValueError(f"Chunk {index} must be {expected} bytes, got {length}")
+
+            written = 0
+            with open(self._part_path(upload_id), 'r+b') as part:
+                part.seek(index * upload['chunk_size'])
+                while written < expected:
+                    block = stream.read(min(COPY_BLOCK_SIZE, expected - written))
+                    if not block:
+                        break
+                    part.write(block)
+                    written += len(block)
+            if written != expected:
+                raise ValueError(f"Chunk {index} ended after {written} of {expected} bytes")
+        except (ValueError, OSError):
+            with self._lock:
+                self.chunks_rejected += 1
+            metrics.chunked_upload_chunks.inc(result='rejected')
+            raise
+
+        with self._connect() as conn:
+            conn.execute('INSERT OR IGNORE INTO upload_chunks VALUES (?, ?)', (upload_id, index))
+            conn.execute('UPDATE chunked_uploads SET updated_at = ? WHERE upload_id = ?', (time.time(), upload_id))
+            status = self._status(conn, upload)
+        with self._lock:
+            self.chunks_received += 1
+        metrics.chunked_upload_chunks.inc(result='received')
+        return status
+
+    def finish(self, upload_id, owner):
+        """Take over a complete upload: returns (stream, info), or None if unknown
+
+        Raises ValueError listing the missing chunks if it is incomplete. The
+        part file is unlinked once opened, so the caller only has to close
+        the stream.
+        """
+        with self._connect() as conn:
+            upload = self._load(conn, upload_id, owner)
+            if upload is None:
+                return None
+            status = self._status(conn, upload)
+            if status['missing']:
+                raise ValueError(f"Upload is missing {len(status['missing'])} chunk(s)")
+            # Deleting the row claims the upload, so a repeated request cannot finish it twice
+            claimed = conn.execute('DELETE FROM chunked_uploads WHERE upload_id = ?', (upload_id,)).rowcount
+            conn.execute('DELETE FROM upload_chunks WHERE upload_id = ?', (upload_id,))
+        if not claimed:
+            return None
+
+        stream = open(self._part_path(upload_id), 'rb')
+        try:
+            digest = hashlib.sha256()
+            for block in iter(lambda: stream.read(1024 * 1024), b''):
+                digest.update(block)
+            stream.seek(0)
+        except Exception:
+            stream.close()
+            raise
+        try:
+            os.remove(self._part_path(upload_id))
+        except OSError:
+            # Windows cannot remove an open file; `prune` removes it later
+            pass
+
+        size = upload['size_bytes']
+        upload_stats.record(size, on_disk=True)
+        metrics.upload_bytes.inc(size, staged_on_disk='true')
+        with self._lock:
+            self.completed += 1
+        info = {
+            'size_bytes': size,
+            'mime_type': upload['mime_type'],
+            'staged_on_disk': True,
+            'sha256': digest.hexdigest(),
+            'chunks': upload['chunks'],
+            'chunk_size': upload['chunk_size']
+        }
+        logger.info(f"Chunked upload {upload_id} of {upload['file_name']} assembled: {size} bytes")
+        return stream, info
+
+    def abort(self, upload_id, owner):
+        with self._connect() as conn:
+            if self._load(conn, upload_id, owner) is None:
+                return False
+            conn.execute('DELETE FROM chunked_uploads WHERE upload_id = ?', (upload_id,))
+            conn.execute('DELETE FROM upload_chunks WHERE upload_id = ?', (upload_id,))
+        self._remove_part(upload_id)
+        with self._lock:
+            self.aborted += 1
+        return True
+
+    def _remove_part(self, upload_id):
+        try:
+            os.remove(self._part_path(upload_id))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove part file of upload {upload_id}: {e}")
+
+    def prune(self):
+        """Drop uploads that received nothing for `retention` seconds"""
+        cutoff = time.time() - self.retention
+        with self._connect() as conn:
+            expired = [row[0] for row in conn.execute(
+                'SELECT upload_id FROM chunked_uploads WHERE updated_at < ?', (cutoff,))]
+            for upload_id in expired:
+                conn.execute('DELETE FROM chunked_uploads WHERE upload_id = ?', (upload_id,))
+                conn.execute('DELETE FROM upload_chunks WHERE upload_id = ?', (upload_id,))
+        for upload_id in expired:
+            self._remove_part(upload_id)
+        if expired:
+            with self._lock:
+                self.expired += len(expired)
+            logger.info(f"Expired {len(expired)} unfinished chunked upload(s)")
+        return len(expired)
+
+    def stats(self):
+        with self._connect() as conn:
+            active, reserved = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM chunked_uploads').fetchone()
+        with self._lock:
+            return {
+                'active': active,
+                'reserved_bytes': reserved,
+                'chunk_size': self.chunk_size,
+                'chunks_received': self.chunks_received,
+                'chunks_rejected': self.chunks_rejected,
+                'completed': self.completed,
+                'aborted': self.aborted,
+                'expired': self.expired
+            }
@@ -0,0 +1,216 @@
+"""Split oversized documents into pieces that are ingested in parallel
+
+A single large file used to be one upload and one import operation, so its
+ingestion time grew with its size no matter how much concurrency was
+available. `split_items` turns every text file or PDF larger than the piece
+size into several `BatchItem`s that `BatchIngestor` uploads side by side as
+separate documents:
+
+- text is cut at the last line break before each piece boundary (never inside
+  a UTF-8 sequence); pieces are byte ranges read straight from the source, so
+  nothing is copied and memory stays flat
+- PDFs are cut into page ranges with `pypdf` (optional; without it PDFs are
+  uploaded whole); each piece is written to a spooled buffer only when it is
+  about to be uploaded
+
+Every piece carries its parent's `custom_metadata` plus `parent`, `part` and
+`parts` entries linking it back to the original file.
+"""
+
+import io
+import logging
+import math
+import tempfile
+import threading
+
+from batch_ingest import ARCHIVE_SPOOL_MAX_MEMORY, BatchItem
+
+logger = logging.getLogger(__name__)
+
+# Non-text/* MIME types that are split as text
+TEXT_MIME_TYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'application/xml',
+    'application/javascript',
+    'application/x-yaml',
+    'application/sql'
+}
+
+# How far back from a piece boundary to look for a line break
+BOUNDARY_WINDOW = 64 * 1024
+
+PDF_MIME_TYPE = 'application/pdf'
+
+
+def is_text(mime_type):
+    return mime_type.startswith('text/') or mime_type in TEXT_MIME_TYPES
+
+
+class SharedSource:
+    """One parent stream read by all of its pieces, one read at a time"""
+
+    def __init__(self, opener):
+        self._open = opener
+        self._stream = None
+        self.lock = threading.Lock()
+
+    def stream(self):
+        """The opened parent stream; call with `lock` held"""
+        if self._stream is None:
+            self._stream = self._open()
+        return self._stream
+
+    def read_at(self, offset, size):
+        with self.lock:
+            stream = self.stream()
+            stream.seek(offset)
+            return stream.read(size)
+
+    def close(self):
+        with self.lock:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+
+
+class PieceFile(io.RawIOBase):
+    """Seekable read-only view of bytes [start, end) of a SharedSource"""
+
+    def __init__(self, source, start, end):
+        super().__init__()
+        self._source = source
+        self._start = start
+        self._size = end - start
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._position = min(max(offset, 0), self._size)
+        return self._position
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._size - self._position)
+        if size <= 0:
+            return 0
+        data = self._source.read_at(self._start + self._position, size)
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+class PieceItem(BatchItem):
+    """A BatchItem for one piece of a larger parent item"""
+
+    def __init__(self, parent, source, index, count, size, opener, mime_type):
+        super().__init__(
+            f"{parent.name} [{index}/{count}]", size, opener, mime_type,
+            list(parent.custom_metadata) + [
+                {'key': 'parent', 'string_value': parent.name},
+                {'key': 'part', 'numeric_value': index},
+                {'key': 'parts', 'numeric_value': count}
+            ]
+        )
+        self.parent = parent.name
+        self.source = source
+
+
+def text_boundaries(source, size, piece_size):
+    """Yield (start, end) byte ranges of at most `piece_size`, cut after line breaks"""
+    start = 0
+    while size - start > piece_size:
+        cut = start + piece_size
+        low = max(start + 1, cut - BOUNDARY_WINDOW)
+        # Include the byte at `cut` so a UTF-8 sequence starting there is visible
+        window = source.read_at(low, cut - low + 1)
+        newline = window.rfind(b'\n', 0, cut - low)
+        if newline >= 0:
+            cut = low + newline + 1
+        else:
+            i = cut - low
+            while i > 0 and window[i] & 0xC0 == 0x80:
+                i -= 1
+            cut = low + i if i > 0 else cut
+        yield start, cut
+        start = cut
+    yield start, size
+
+
+def split_text(item, piece_size):
+    source = SharedSource(item.open)
+    ranges = list(text_boundaries(source, item.size, piece_size))
+    for index, (start, end) in enumerate(ranges, 1):
+        yield PieceItem(item, source, index, len(ranges), end - start,
+                        lambda start=start, end=end: PieceFile(source, start, end), item.mime_type)
+
+
+def split_pdf(item, piece_size):
+    try:
+        import pypdf
+    except ImportError:
+        logger.warning(f"pypdf is not installed; uploading {item.name} without splitting")
+        yield item
+        return
+
+    source = SharedSource(item.open)
+    with source.lock:
+        reader = pypdf.PdfReader(source.stream())
+        pages = len(reader.pages)
+    pages_per_piece = max(1, math.floor(pages * piece_size / item.size))
+    count = math.ceil(pages / pages_per_piece)
+    if count <= 1:
+        source.close()
+        yield item
+        return
+
+    def opener(first, last):
+        def open_piece():
+            writer = pypdf.PdfWriter()
+            buffer = tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_MAX_MEMORY, mode='rb+')
+            with source.lock:
+                for page in range(first, last):
+                    writer.add_page(reader.pages[page])
+                writer.write(buffer)
+            buffer.seek(0)
+            return buffer
+        return open_piece
+
+    for index in range(1, count + 1):
+        first = (index - 1) * pages_per_piece
+        last = min(pages, first + pages_per_piece)
+        # Estimated from the page share; the SDK measures the real size
+        size = round(item.size * (last - first) / pages)
+        yield PieceItem(item, source, index, count, size, opener(first, last), PDF_MIME_TYPE)
+
+
+def can_split(item, piece_size):
+    return bool(piece_size) and item.size > piece_size and (
+        is_text(item.mime_type) or item.mime_type == PDF_MIME_TYPE)
+
+
+def split_items(items, piece_size):
+    """Yield every item, with splittable items over `piece_size` bytes replaced by their pieces"""
+    for item in items:
+        if not can_split(item, piece_size):
+            yield item
+        elif item.mime_type == PDF_MIME_TYPE:
+            yield from split_pdf(item, piece_size)
+        else:
+            yield from split_text(item, piece_size)
+
+
+def piece_size_bytes(megabytes):
+    """Piece size from a (possibly fractional) MB setting; 0 or None disables splitting"""
+    return int(float(megabytes or 0) * 1024 * 1024)
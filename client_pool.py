@@ -0,0 +1,101 @@
+"""Per-API-key pool of Gemini clients and a shared HTTP session
+
+Building a `genai.Client` sets up a fresh HTTP client, so creating one per
+request repeats TLS handshakes and connection setup every time. The pool keeps
+one client per API key (keyed by a SHA-256 hash, never the raw key) and reuses
+it until it has been idle for too long or is pushed out by newer keys.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def hash_key(api_key):
+    """SHA-256 hex digest used as the pool key"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+class ClientPool:
+    """Thread-safe LRU pool of clients with idle eviction
+
+    Evicted clients are dropped rather than closed: background jobs may still
+    hold a reference and finish polling with them. They are closed by the SDK
+    once garbage collected.
+    """
+
+    def __init__(self, factory, max_size=32, idle_seconds=600):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, api_key):
+        key = hash_key(api_key)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                self._clients.move_to_end(key)
+                entry[1] = now
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Build outside the lock; a concurrent miss for the same key keeps
+        # whichever client lands first
+        client = self.factory(api_key)
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None:
+                entry[1] = now
+                return entry[0]
+            self._clients[key] = [client, now]
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+        return client
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def _evict_idle(self, now):
+        for key in [k for k, (_, last_used) in self._clients.items()
+                    if now - last_used > self.idle_seconds]:
+            del self._clients[key]
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._clients),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
+
+
+def build_session(pool_size=16):
+    """Shared `requests.Session` with a connection pool for REST fallbacks"""
+    # Deferred with the SDK; see lazy_import
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
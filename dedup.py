@@ -0,0 +1,97 @@
+"""Content-hash manifest for skipping re-uploads of identical documents
+
+Maps (store name, SHA-256 of the uploaded bytes) to the document the upload
+produced. The hash is computed by `upload_stream` while the request body is
+parsed, so a duplicate upload is detected before any byte is sent to Gemini.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    store_name TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    document_name TEXT NOT NULL,
+    display_name TEXT,
+    size_bytes INTEGER,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (store_name, sha256)
+);
+CREATE INDEX IF NOT EXISTS uploads_document ON uploads (document_name);
+"""
+
+
+class UploadManifest:
+    """SQLite-backed (store, sha256) -> document manifest"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.duplicates = 0
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lookup(self, store_name, sha256):
+        """Existing upload of these bytes to this store, or None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT document_name, display_name, size_bytes, created_at FROM uploads '
+                'WHERE store_name = ? AND sha256 = ?',
+                (store_name, sha256)
+            ).fetchone()
+        if row is None:
+            return None
+        with self._lock:
+            self.duplicates += 1
+        return {
+            'document_name': row[0],
+            'display_name': row[1],
+            'size_bytes': row[2],
+            'uploaded_at': row[3]
+        }
+
+    def record(self, store_name, sha256, document_name, display_name=None, size_bytes=None):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?)',
+                (store_name, sha256, document_name, display_name, size_bytes, time.time())
+            )
+
+    def forget_store(self, store_name):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM uploads WHERE store_name = ?', (store_name,))
+
+    def reconcile(self, store_name, document_names):
+        """Drop entries whose document no longer appears in a full store listing"""
+        document_names = set(document_names)
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT document_name FROM uploads WHERE store_name = ?', (store_name,)
+            ).fetchall()
+            stale = [(store_name, row[0]) for row in rows if row[0] not in document_names]
+            conn.executemany('DELETE FROM uploads WHERE store_name = ? AND document_name = ?', stale)
+        if stale:
+            logger.info(f"Dedup manifest: removed {len(stale)} stale entr(y/ies) for {store_name}")
+        return len(stale)
+
+    def stats(self):
+        with self._connect() as conn:
+            entries = conn.execute('SELECT COUNT(*) FROM uploads').fetchone()[0]
+        with self._lock:
+            return {'entries': entries, 'duplicates_skipped': self.duplicates}
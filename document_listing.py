@@ -0,0 +1,308 @@
+"""Paginated, cached document listing for file search stores
+
+All listing goes through `DocumentLister.fetch_page`, which uses the SDK's
+`documents.list` when available and falls back to the REST endpoint
+(following `nextPageToken`) otherwise. Complete listings are cached per store
+and patched in place when an upload or import adds a document, so a store
+with thousands of documents is not re-fetched after every write.
+`AsyncDocumentLister` is the same lister for the ASGI app, awaiting
+`client.aio` instead of blocking on the sync SDK. When the cache is given a
+`MetadataIndex`, complete listings are also written to it and served from it
+after the in-memory entry expires.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+API_BASE = 'https://generativelanguage.googleapis.com/v1beta'
+
+# Page tokens served from a cached listing carry this prefix and an offset
+LOCAL_TOKEN_PREFIX = 'local:'
+
+# Page size used when walking a whole store (the API caps document pages at 20)
+FULL_LISTING_PAGE_SIZE = 20
+
+
+def _field(entry, name, rest_name):
+    if isinstance(entry, dict):
+        return entry.get(name, entry.get(rest_name))
+    return getattr(entry, name, None)
+
+
+def metadata_to_dict(custom_metadata):
+    """{key: value} from SDK CustomMetadata objects or REST/request dicts"""
+    result = {}
+    for entry in custom_metadata or []:
+        key = _field(entry, 'key', 'key')
+        if not key:
+            continue
+        values = _field(entry, 'string_list_value', 'stringListValue')
+        numeric = _field(entry, 'numeric_value', 'numericValue')
+        if values is not None:
+            result[key] = list(_field(values, 'values', 'values') or [])
+        elif numeric is not None:
+            result[key] = numeric
+        else:
+            result[key] = _field(entry, 'string_value', 'stringValue')
+    return result
+
+
+def document_to_dict(doc):
+    """Normalize an SDK Document or a REST JSON document"""
+    if isinstance(doc, dict):
+        return {
+            'name': doc.get('name', 'N/A'),
+            'display_name': doc.get('displayName', 'N/A'),
+            'create_time': doc.get('createTime', 'N/A'),
+            'update_time': doc.get('updateTime', 'N/A'),
+            'custom_metadata': metadata_to_dict(doc.get('customMetadata'))
+        }
+    return {
+        'name': doc.name,
+        'display_name': getattr(doc, 'display_name', 'N/A'),
+        'create_time': str(getattr(doc, 'create_time', 'N/A')),
+        'update_time': str(getattr(doc, 'update_time', 'N/A')),
+        'custom_metadata': metadata_to_dict(getattr(doc, 'custom_metadata', None))
+    }
+
+
+class DocumentListCache:
+    """Complete per-store listings with TTL and incremental updates"""
+
+    def __init__(self, ttl=300, max_stores=256, index=None):
+        self.ttl = ttl
+        self.max_stores = max_stores
+        self.index = index
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.index_hits = 0
+        self.misses = 0
+        self.updates = 0
+
+    def get(self, owner, store_name):
+        with self._lock:
+            entry = self._entries.get((owner, store_name))
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end((owner, store_name))
+                self.hits += 1
+                return list(entry[0])
+            self._entries.pop((owner, store_name), None)
+        documents = self.index.documents(owner, store_name) if self.index is not None else None
+        with self._lock:
+            if documents is None:
+                self.misses += 1
+                return None
+            self.index_hits += 1
+        self._remember(owner, store_name, documents)
+        return list(documents)
+
+    def put(self, owner, store_name, documents):
+        """Cache a complete listing fetched from upstream"""
+        if self.index is not None:
+            self.index.replace_documents(owner, store_name, documents)
+        self._remember(owner, store_name, documents)
+
+    def _remember(self, owner, store_name, documents):
+        with self._lock:
+            self._entries[(owner, store_name)] = (list(documents), time.monotonic() + self.ttl)
+            self._entries.move_to_end((owner, store_name))
+            while len(self._entries) > self.max_stores:
+                self._entries.popitem(last=False)
+
+    def upsert(self, store_name, document):
+        """Add or replace one document in every cached listing of a store"""
+        if self.index is not None:
+            self.index.put_document(store_name, document)
+        with self._lock:
+            for key, (documents, expires_at) in self._entries.items():
+                if key[1] != store_name:
+                    continue
+                for i, existing in enumerate(documents):
+                    if existing['name'] == document['name']:
+                        documents[i] = document
+                        break
+                else:
+                    documents.append(document)
+                self.updates += 1
+
+    def drop(self, store_name):
+        if self.index is not None:
+            self.index.mark_stale(store_name)
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == store_name]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            hits = self.hits + self.index_hits
+            total = hits + self.misses
+            return {
+                'stores': len(self._entries),
+                'hits': self.hits,
+                'index_hits': self.index_hits,
+                'misses': self.misses,
+                'incremental_updates': self.updates,
+                'hit_rate': round(hits / total, 4) if total else 0.0
+            }
+
+
+class DocumentLister:
+    """List documents for one request's client, API key and cache scope"""
+
+    def __init__(self, client, api_key, session, cache, owner):
+        self.client = client
+        self.api_key = api_key
+        self.session = session
+        self.cache = cache
+        self.owner = owner
+
+    @staticmethod
+    def _page_config(page_size, page_token):
+        config = {}
+        if page_size:
+            config['page_size'] = page_size
+        if page_token:
+            config['page_token'] = page_token
+        return config or None
+
+    def fetch_page(self, store_name, page_size=None, page_token=None):
+        """Fetch one upstream page; returns (documents, next_page_token)"""
+        if hasattr(self.client.file_search_stores, 'documents'):
+            try:
+                pager = self.client.file_search_stores.documents.list(
+                    parent=store_name,
+                    config=self._page_config(page_size, page_token)
+                )
+                return [document_to_dict(doc) for doc in pager.page], pager.config.get('page_token')
+            except Exception as e:
+                logger.error(f"Error listing documents via SDK, falling back to REST: {e}")
+        return self._fetch_rest(store_name, page_size, page_token)
+
+    def _fetch_rest(self, store_name, page_size, page_token):
+        params = {'key': self.api_key}
+        if page_size:
+            params['pageSize'] = page_size
+        if page_token:
+            params['pageToken'] = page_token
+        response = self.session.get(
+            f"{API_BASE}/{store_name}/documents",
+            headers={'Content-Type': 'application/json'},
+            params=params
+        )
+        response.raise_for_status()
+        data = response.json()
+        return [document_to_dict(doc) for doc in data.get('documents', [])], data.get('nextPageToken')
+
+    def iter_documents(self, store_name):
+        """Yield every document, from cache or page by page from upstream"""
+        cached = self.cache.get(self.owner, store_name)
+        if cached is not None:
+            yield from cached
+            return
+        yield from self._walk(store_name)
+
+    def _walk(self, store_name):
+        """Follow upstream page tokens to the end and cache the full listing"""
+        documents = []
+        page_token = None
+        while True:
+            page, page_token = self.fetch_page(store_name, FULL_LISTING_PAGE_SIZE, page_token)
+            documents.extend(page)
+            yield from page
+            if not page_token:
+                break
+        self.cache.put(self.owner, store_name, documents)
+
+    def refresh(self, store_name):
+        """Re-list a store from upstream, replacing its cached listing"""
+        return list(self._walk(store_name))
+
+    def all(self, store_name):
+        """Every document in a store; returns (documents, served_from_cache)"""
+        cached = self.cache.get(self.owner, store_name)
+        if cached is not None:
+            return cached, True
+        return list(self._walk(store_name)), False
+
+    def page(self, store_name, page_size, page_token=None):
+        """One page; returns (documents, next_page_token, served_from_cache)
+
+        When the store's listing is cached, pages are sliced locally and carry
+        `local:<offset>` tokens; otherwise the upstream cursor is passed through.
+        """
+        local_token = bool(page_token) and page_token.startswith(LOCAL_TOKEN_PREFIX)
+        cached = None if page_token and not local_token else self.cache.get(self.owner, store_name)
+        if cached is None and not local_token:
+            documents, next_token = self.fetch_page(store_name, page_size, page_token)
+            return documents, next_token, False
+
+        if cached is None:
+            # Local cursor outlived its cache entry; rebuild the listing once
+            cached = list(self._walk(store_name))
+        return self._slice(cached, page_size, page_token)
+
+    @staticmethod
+    def _slice(cached, page_size, page_token):
+        offset = int(page_token[len(LOCAL_TOKEN_PREFIX):]) if page_token else 0
+        end = offset + page_size
+        next_token = f"{LOCAL_TOKEN_PREFIX}{end}" if end < len(cached) else None
+        return cached[offset:end], next_token, True
+
+
+class AsyncDocumentLister(DocumentLister):
+    """DocumentLister whose upstream calls are awaited through `client.aio`"""
+
+    async def fetch_page(self, store_name, page_size=None, page_token=None):
+        try:
+            pager = await self.client.aio.file_search_stores.documents.list(
+                parent=store_name,
+                config=self._page_config(page_size, page_token)
+            )
+            return [document_to_dict(doc) for doc in pager.page], pager.config.get('page_token')
+        except Exception as e:
+            logger.error(f"Error listing documents via SDK, falling back to REST: {e}")
+        return await asyncio.to_thread(self._fetch_rest, store_name, page_size, page_token)
+
+    async def iter_documents(self, store_name):
+        cached = self.cache.get(self.owner, store_name)
+        if cached is not None:
+            for document in cached:
+                yield document
+            return
+        async for document in self._walk(store_name):
+            yield document
+
+    async def _walk(self, store_name):
+        documents = []
+        page_token = None
+        while True:
+            page, page_token = await self.fetch_page(store_name, FULL_LISTING_PAGE_SIZE, page_token)
+            documents.extend(page)
+            for document in page:
+                yield document
+            if not page_token:
+                break
+        self.cache.put(self.owner, store_name, documents)
+
+    async def all(self, store_name):
+        cached = self.cache.get(self.owner, store_name)
+        if cached is not None:
+            return cached, True
+        return [document async for document in self._walk(store_name)], False
+
+    async def page(self, store_name, page_size, page_token=None):
+        local_token = bool(page_token) and page_token.startswith(LOCAL_TOKEN_PREFIX)
+        cached = None if page_token and not local_token else self.cache.get(self.owner, store_name)
+        if cached is None and not local_token:
+            documents, next_token = await self.fetch_page(store_name, page_size, page_token)
+            return documents, next_token, False
+
+        if cached is None:
+            cached = [document async for document in self._walk(store_name)]
+        return self._slice(cached, page_size, page_token)
@@ -0,0 +1,588 @@
+"""Local stand-in for the parts of `google.genai.Client` this app uses
+
+Implements `file_search_stores.*` (including `documents`), `files.upload`,
+`operations.get`, `models.generate_content[_stream]`, `caches.*` and inline
+`batches.create`/`batches.get` in memory, returning
+real `google.genai.types` objects so the app code paths behave exactly as
+they do against the API. Latency, operation completion delay and error rate
+are configurable, which makes it usable for offline benchmarks:
+
+    client = FakeClient(config=FakeConfig(latency=0.05, operation_delay=1.0))
+
+Run the server against it with `GEMINI_BACKEND=fake python3 app.py`.
+`FakeClient.aio` mirrors `client.aio` for the ASGI app; its simulated latency
+is awaited instead of slept, so concurrent calls overlap on one event loop.
+"""
+
+import asyncio
+import contextvars
+import itertools
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from google.genai import errors, types
+
+# Set while an async call runs its sync implementation; latency was already awaited
+_latency_applied = contextvars.ContextVar('latency_applied', default=False)
+
+
+class FakeConfig:
+    """Knobs for simulated upstream behaviour
+
+    `latency` (seconds, +/- `jitter`) applies to every call, `operation_delay`
+    is how long uploads/imports take to finish indexing, and `error_rate` is
+    the fraction of calls that fail with a 429 RESOURCE_EXHAUSTED.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, operation_delay=1.0, error_rate=0.0,
+                 stream_chunks=8, chunk_latency=0.02, answer_words=120, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.operation_delay = operation_delay
+        self.error_rate = error_rate
+        self.stream_chunks = stream_chunks
+        self.chunk_latency = chunk_latency
+        self.answer_words = answer_words
+        self.random = random.Random(seed)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            latency=float(os.environ.get('FAKE_GEMINI_LATENCY', 0.05)),
+            jitter=float(os.environ.get('FAKE_GEMINI_JITTER', 0.0)),
+            operation_delay=float(os.environ.get('FAKE_GEMINI_OPERATION_DELAY', 1.0)),
+            error_rate=float(os.environ.get('FAKE_GEMINI_ERROR_RATE', 0.0))
+        )
+
+
+class FakeBackend:
+    """Shared in-memory state; every FakeClient sees the same stores"""
+
+    def __init__(self, config=None):
+        self.config = config or FakeConfig()
+        self.lock = threading.Lock()
+        self.stores = {}
+        self.documents = {}
+        self.files = {}
+        self.operations = {}
+        self.batch_jobs = {}
+        self.caches = {}
+        self.calls = {}
+        self._ids = itertools.count(1)
+
+    def next_id(self, prefix):
+        return f"{prefix}-{next(self._ids)}-{uuid.uuid4().hex[:6]}"
+
+    def _roll(self, name):
+        """Count a call and draw its latency and whether it fails"""
+        config = self.config
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            delay = max(0.0, config.latency + config.random.uniform(-config.jitter, config.jitter))
+            fail = config.random.random() < config.error_rate
+        return delay, fail
+
+    def _raise_rate_limited(self):
+        raise errors.APIError(429, {'error': {
+            'code': 429,
+            'message': 'Resource has been exhausted (fake backend)',
+            'status': 'RESOURCE_EXHAUSTED'
+        }})
+
+    def call(self, name):
+        """Simulate one upstream round trip: count it, sleep, maybe fail"""
+        if _latency_applied.get():
+            return
+        delay, fail = self._roll(name)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            self._raise_rate_limited()
+
+    async def acall(self, name):
+        """Async variant of `call`; awaits the simulated latency"""
+        delay, fail = self._roll(name)
+        if delay:
+            await asyncio.sleep(delay)
+        if fail:
+            self._raise_rate_limited()
+
+    def require_store(self, store_name):
+        if store_name not in self.stores:
+            raise errors.APIError(404, {'error': {
+                'code': 404,
+                'message': f'{store_name} not found',
+                'status': 'NOT_FOUND'
+            }})
+
+    def start_operation(self, operation_cls, store_name, document):
+        name = f"{store_name}/operations/{self.next_id('op')}"
+        with self.lock:
+            self.operations[name] = (time.monotonic() + self.config.operation_delay, store_name, document)
+        operation = operation_cls(name=name, done=False)
+        # Without a delay the operation comes back finished, with its response
+        return self.resolve_operation(operation) if self.config.operation_delay <= 0 else operation
+
+    def resolve_operation(self, operation):
+        with self.lock:
+            entry = self.operations.get(operation.name)
+        if entry is None:
+            return operation
+        ready_at, store_name, document = entry
+        if time.monotonic() < ready_at:
+            return operation.model_copy(update={'done': False})
+        with self.lock:
+            self.documents.setdefault(store_name, {})[document.name] = document
+        response_cls = (types.UploadToFileSearchStoreResponse
+                        if isinstance(operation, types.UploadToFileSearchStoreOperation)
+                        else types.ImportFileResponse)
+        return operation.model_copy(update={
+            'done': True,
+            'response': response_cls(parent=store_name, document_name=document.name)
+        })
+
+
+_default_backend = None
+_default_lock = threading.Lock()
+
+
+def default_backend():
+    global _default_backend
+    with _default_lock:
+        if _default_backend is None:
+            _default_backend = FakeBackend(FakeConfig.from_env())
+        return _default_backend
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _read_size(file):
+    if isinstance(file, (str, os.PathLike)):
+        return os.path.getsize(file)
+    size = 0
+    while True:
+        chunk = file.read(1024 * 1024)
+        if not chunk:
+            return size
+        size += len(chunk)
+
+
+def _count_tokens(contents):
+    """Rough prompt size of `contents` (a string, Content objects or dicts)"""
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return max(1, len(contents) // 4)
+    if isinstance(contents, (list, tuple)):
+        return sum(_count_tokens(item) for item in contents)
+    if isinstance(contents, types.Content):
+        return sum(_count_tokens(part.text) for part in contents.parts or [])
+    if isinstance(contents, dict):
+        return sum(_count_tokens(part.get('text')) for part in contents.get('parts', []))
+    return 0
+
+
+def _get(config, key, default=None):
+    if config is None:
+        return default
+    if isinstance(config, dict):
+        return config.get(key, default)
+    return getattr(config, key, default) or default
+
+
+class FakePager:
+    """Mimics `google.genai.pagers.Pager` for one page plus iteration"""
+
+    def __init__(self, items, page_size, page_token):
+        offset = int(page_token or 0)
+        self.page = items[offset:offset + page_size]
+        next_offset = offset + page_size
+        self.config = {'page_size': page_size,
+                       'page_token': str(next_offset) if next_offset < len(items) else None}
+        self._items = items[offset:]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    async def __aiter__(self):
+        for item in self._items:
+            yield item
+
+
+class FakeDocuments:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def list(self, *, parent, config=None):
+        self._backend.call('documents.list')
+        self._backend.require_store(parent)
+        with self._backend.lock:
+            documents = list(self._backend.documents.get(parent, {}).values())
+        return FakePager(documents, _get(config, 'page_size', 20), _get(config, 'page_token'))
+
+    def get(self, *, name, config=None):
+        self._backend.call('documents.get')
+        store_name = name.split('/documents/')[0]
+        with self._backend.lock:
+            document = self._backend.documents.get(store_name, {}).get(name)
+        if document is None:
+            raise errors.APIError(404, {'error': {'code': 404, 'message': f'{name} not found', 'status': 'NOT_FOUND'}})
+        return document
+
+
+class FakeFileSearchStores:
+    def __init__(self, backend):
+        self._backend = backend
+        self.documents = FakeDocuments(backend)
+
+    def create(self, *, config=None):
+        self._backend.call('file_search_stores.create')
+        store = types.FileSearchStore(
+            name=f"fileSearchStores/{self._backend.next_id('store')}",
+            display_name=_get(config, 'display_name'),
+            create_time=_now()
+        )
+        with self._backend.lock:
+            self._backend.stores[store.name] = store
+            self._backend.documents[store.name] = {}
+        return store
+
+    def list(self, *, config=None):
+        self._backend.call('file_search_stores.list')
+        with self._backend.lock:
+            return list(self._backend.stores.values())
+
+    def get(self, *, name, config=None):
+        self._backend.call('file_search_stores.get')
+        self._backend.require_store(name)
+        return self._backend.stores[name]
+
+    def delete(self, *, name, config=None):
+        self._backend.call('file_search_stores.delete')
+        self._backend.require_store(name)
+        with self._backend.lock:
+            del self._backend.stores[name]
+            self._backend.documents.pop(name, None)
+
+    def upload_to_file_search_store(self, *, file_search_store_name, file, config=None):
+        self._backend.call('file_search_stores.upload_to_file_search_store')
+        self._backend.require_store(file_search_store_name)
+        size = _read_size(file)
+        document = types.Document(
+            name=f"{file_search_store_name}/documents/{self._backend.next_id('doc')}",
+            display_name=_get(config, 'display_name'),
+            size_bytes=size,
+            mime_type=_get(config, 'mime_type'),
+            custom_metadata=_get(config, 'custom_metadata'),
+            create_time=_now(),
+            update_time=_now()
+        )
+        return self._backend.start_operation(
+            types.UploadToFileSearchStoreOperation, file_search_store_name, document)
+
+    def import_file(self, *, file_search_store_name, file_name, config=None):
+        self._backend.call('file_search_stores.import_file')
+        self._backend.require_store(file_search_store_name)
+        with self._backend.lock:
+            uploaded = self._backend.files.get(file_name)
+        if uploaded is None:
+            raise errors.APIError(404, {'error': {'code': 404, 'message': f'{file_name} not found', 'status': 'NOT_FOUND'}})
+        document = types.Document(
+            name=f"{file_search_store_name}/documents/{self._backend.next_id('doc')}",
+            display_name=uploaded.display_name,
+            size_bytes=uploaded.size_bytes,
+            mime_type=uploaded.mime_type,
+            custom_metadata=_get(config, 'custom_metadata'),
+            create_time=_now(),
+            update_time=_now()
+        )
+        return self._backend.start_operation(types.ImportFileOperation, file_search_store_name, document)
+
+
+class FakeFiles:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def upload(self, *, file, config=None):
+        self._backend.call('files.upload')
+        uploaded = types.File(
+            name=f"files/{self._backend.next_id('file')}",
+            display_name=_get(config, 'display_name') or _get(config, 'name'),
+            mime_type=_get(config, 'mime_type'),
+            size_bytes=_read_size(file),
+            create_time=_now()
+        )
+        with self._backend.lock:
+            self._backend.files[uploaded.name] = uploaded
+        return uploaded
+
+
+class FakeOperations:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def get(self, operation, *, config=None):
+        self._backend.call('operations.get')
+        return self._backend.resolve_operation(operation)
+
+
+class FakeModels:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def _answer(self, contents):
+        words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit']
+        rng = self._backend.config.random
+        with self._backend.lock:
+            length = self._backend.config.answer_words
+            words = [rng.choice(words) for _ in range(length)]
+        return ' '.join(words)
+
+    def _grounding(self, config, answer):
+        store_names = []
+        for tool in (_get(config, 'tools') or []):
+            file_search = getattr(tool, 'file_search', None)
+            if file_search is not None:
+                store_names.extend(file_search.file_search_store_names or [])
+        chunks = []
+        with self._backend.lock:
+            for store_name in store_names:
+                for document in list(self._backend.documents.get(store_name, {}).values())[:3]:
+                    chunks.append(types.GroundingChunk(retrieved_context=types.GroundingChunkRetrievedContext(
+                        title=document.display_name,
+                        text=f"Excerpt from {document.display_name}",
+                        file_search_store=store_name,
+                        document_name=document.name
+                    )))
+        if not chunks:
+            return None
+        supports = [types.GroundingSupport(
+            segment=types.Segment(start_index=0, end_index=min(len(answer), 40), text=answer[:40]),
+            grounding_chunk_indices=list(range(len(chunks)))
+        )]
+        return types.GroundingMetadata(grounding_chunks=chunks, grounding_supports=supports)
+
+    def _usage(self, contents, config):
+        """(prompt tokens, cached tokens); tools come from the cache when one is used"""
+        cached = 0
+        cache_name = _get(config, 'cached_content')
+        if cache_name:
+            with self._backend.lock:
+                entry = self._backend.caches.get(cache_name)
+            if entry is None:
+                raise errors.APIError(404, {'error': {
+                    'code': 404, 'message': f'{cache_name} not found', 'status': 'NOT_FOUND'}})
+            tools, cached = entry
+            config = types.GenerateContentConfig(tools=tools)
+        prompt = 32 + cached + _count_tokens(contents) + _count_tokens(_get(config, 'system_instruction'))
+        return prompt, cached, config
+
+    def _response(self, text, grounding_metadata=None, finished=True, usage=(32, 0)):
+        prompt, cached = usage
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(
+                content=types.Content(role='model', parts=[types.Part(text=text)]),
+                grounding_metadata=grounding_metadata,
+                finish_reason=types.FinishReason.STOP if finished else None
+            )],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt,
+                cached_content_token_count=cached or None,
+                candidates_token_count=len(text.split()),
+                total_token_count=prompt + len(text.split())
+            )
+        )
+
+    def generate_content(self, *, model, contents, config=None):
+        self._backend.call('models.generate_content')
+        prompt, cached, config = self._usage(contents, config)
+        answer = self._answer(contents)
+        return self._response(answer, self._grounding(config, answer), usage=(prompt, cached))
+
+    def _pieces(self, contents):
+        answer = self._answer(contents)
+        words = answer.split(' ')
+        count = max(1, self._backend.config.stream_chunks)
+        size = max(1, -(-len(words) // count))
+        return answer, [' '.join(words[i:i + size]) + ' ' for i in range(0, len(words), size)]
+
+    def generate_content_stream(self, *, model, contents, config=None):
+        self._backend.call('models.generate_content_stream')
+        prompt, cached, config = self._usage(contents, config)
+        answer, pieces = self._pieces(contents)
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(self._backend.config.chunk_latency)
+            last = i == len(pieces) - 1
+            yield self._response(piece, self._grounding(config, answer) if last else None, finished=last,
+                                 usage=(prompt, cached))
+
+
+class FakeCaches:
+    """Explicit context caches; generate calls report their tokens as cached"""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def create(self, *, model, config=None):
+        self._backend.call('caches.create')
+        contents = _get(config, 'contents')
+        tokens = _count_tokens(contents) + _count_tokens(_get(config, 'system_instruction'))
+        cached = types.CachedContent(
+            name=f"cachedContents/{self._backend.next_id('cache')}",
+            display_name=_get(config, 'display_name'),
+            model=model,
+            create_time=_now(),
+            usage_metadata=types.CachedContentUsageMetadata(total_token_count=tokens)
+        )
+        # CachedContent does not echo its tools back; keep them next to it
+        with self._backend.lock:
+            self._backend.caches[cached.name] = (_get(config, 'tools'), tokens)
+        return cached
+
+    def get(self, *, name, config=None):
+        self._backend.call('caches.get')
+        with self._backend.lock:
+            if name not in self._backend.caches:
+                raise errors.APIError(404, {'error': {'code': 404, 'message': f'{name} not found', 'status': 'NOT_FOUND'}})
+        return types.CachedContent(name=name)
+
+    def delete(self, *, name, config=None):
+        self._backend.call('caches.delete')
+        with self._backend.lock:
+            self._backend.caches.pop(name, None)
+
+
+class FakeBatches:
+    """Inline batch jobs; they finish after `operation_delay`"""
+
+    def __init__(self, backend, models):
+        self._backend = backend
+        self._models = models
+
+    def create(self, *, model, src, config=None):
+        self._backend.call('batches.create')
+        job = types.BatchJob(
+            name=f"batches/{self._backend.next_id('batch')}",
+            display_name=_get(config, 'display_name'),
+            state=types.JobState.JOB_STATE_PENDING,
+            model=model,
+            create_time=_now()
+        )
+        with self._backend.lock:
+            self._backend.batch_jobs[job.name] = (time.monotonic() + self._backend.config.operation_delay, list(src), job)
+        return job
+
+    def get(self, *, name, config=None):
+        self._backend.call('batches.get')
+        with self._backend.lock:
+            entry = self._backend.batch_jobs.get(name)
+        if entry is None:
+            raise errors.APIError(404, {'error': {'code': 404, 'message': f'{name} not found', 'status': 'NOT_FOUND'}})
+        ready_at, requests, job = entry
+        if time.monotonic() < ready_at:
+            return job.model_copy(update={'state': types.JobState.JOB_STATE_RUNNING})
+        if job.dest is None:
+            # Batch requests are not individually rate limited or delayed
+            token = _latency_applied.set(True)
+            try:
+                responses = [types.InlinedResponse(response=self._models.generate_content(
+                    model=_get(request, 'model'), contents=_get(request, 'contents'),
+                    config=_get(request, 'config'))) for request in requests]
+            finally:
+                _latency_applied.reset(token)
+            job = job.model_copy(update={
+                'state': types.JobState.JOB_STATE_SUCCEEDED,
+                'end_time': _now(),
+                'dest': types.BatchJobDestination(inlined_responses=responses)
+            })
+            with self._backend.lock:
+                self._backend.batch_jobs[name] = (ready_at, requests, job)
+        return job
+
+
+class FakeAsyncNamespace:
+    """Awaitable view of a fake namespace, like `client.aio.<namespace>`"""
+
+    def __init__(self, target, backend, path):
+        self._target = target
+        self._backend = backend
+        self._path = path
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        path = f"{self._path}.{name}"
+        if name == 'documents':
+            return FakeAsyncNamespace(attr, self._backend, path)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+
+        async def call(*args, **kwargs):
+            await self._backend.acall(path)
+            token = _latency_applied.set(True)
+            try:
+                result = attr(*args, **kwargs)
+            finally:
+                _latency_applied.reset(token)
+            # Async list calls return pagers that support `async for`
+            return FakePager(result, len(result), None) if isinstance(result, list) else result
+        return call
+
+
+class FakeAsyncModels(FakeAsyncNamespace):
+    async def generate_content_stream(self, *, model, contents, config=None):
+        await self._backend.acall('models.generate_content_stream')
+        models = self._target
+        prompt, cached, config = models._usage(contents, config)
+        answer, pieces = models._pieces(contents)
+
+        async def stream():
+            for i, piece in enumerate(pieces):
+                if i:
+                    await asyncio.sleep(self._backend.config.chunk_latency)
+                last = i == len(pieces) - 1
+                yield models._response(piece, models._grounding(config, answer) if last else None,
+                                       finished=last, usage=(prompt, cached))
+        return stream()
+
+
+class FakeAsyncClient:
+    """`client.aio` counterpart of FakeClient"""
+
+    def __init__(self, client):
+        backend = client.backend
+        self.file_search_stores = FakeAsyncNamespace(client.file_search_stores, backend, 'file_search_stores')
+        self.files = FakeAsyncNamespace(client.files, backend, 'files')
+        self.operations = FakeAsyncNamespace(client.operations, backend, 'operations')
+        self.models = FakeAsyncModels(client.models, backend, 'models')
+        self.batches = FakeAsyncNamespace(client.batches, backend, 'batches')
+        self.caches = FakeAsyncNamespace(client.caches, backend, 'caches')
+
+    async def aclose(self):
+        pass
+
+
+class FakeClient:
+    """Drop-in replacement for `genai.Client` backed by FakeBackend"""
+
+    def __init__(self, api_key=None, backend=None, config=None):
+        if backend is None:
+            backend = FakeBackend(config) if config is not None else default_backend()
+        self.api_key = api_key
+        self.backend = backend
+        self.file_search_stores = FakeFileSearchStores(backend)
+        self.files = FakeFiles(backend)
+        self.operations = FakeOperations(backend)
+        self.models = FakeModels(backend)
+        self.batches = FakeBatches(backend, self.models)
+        self.caches = FakeCaches(backend)
+        self.aio = FakeAsyncClient(self)
+
+    def close(self):
+        pass
@@ -0,0 +1,144 @@
+"""Structured grounding metadata for query responses
+
+The routes used to return `str(candidate.grounding_metadata)`, a pydantic
+repr that callers had to re-parse and that carries every empty field. Here it
+is turned into plain JSON once, cached in that form, and shaped per request:
+
+- `full`: every retrieved chunk, citation span and source document
+- `compact`: chunks with identical document and text are merged (citation
+  indices are remapped) and empty fields are dropped
+- `citations`: only the cited spans with their source titles/documents
+"""
+
+import json
+import time
+
+import metrics
+
+MODES = ('full', 'compact', 'citations')
+
+
+def _chunk_to_dict(index, chunk):
+    context = chunk.retrieved_context or chunk.web
+    if context is None:
+        return {'index': index}
+    return {
+        'index': index,
+        'title': getattr(context, 'title', None),
+        'text': getattr(context, 'text', None),
+        'document_name': getattr(context, 'document_name', None),
+        'file_search_store': getattr(context, 'file_search_store', None),
+        'uri': getattr(context, 'uri', None),
+        'page_number': getattr(context, 'page_number', None)
+    }
+
+
+def _support_to_dict(support):
+    segment = support.segment
+    return {
+        'text': getattr(segment, 'text', None),
+        'start_index': getattr(segment, 'start_index', None),
+        'end_index': getattr(segment, 'end_index', None),
+        'chunk_indices': list(support.grounding_chunk_indices or []),
+        'confidence_scores': list(support.confidence_scores or [])
+    }
+
+
+def extract(grounding_metadata):
+    """Full structured form of a GroundingMetadata, or None when empty"""
+    if not grounding_metadata:
+        return None
+    started = time.perf_counter()
+    chunks = [_chunk_to_dict(i, chunk) for i, chunk in enumerate(grounding_metadata.grounding_chunks or [])]
+    citations = [_support_to_dict(support) for support in grounding_metadata.grounding_supports or []]
+    sources = []
+    seen = set()
+    for chunk in chunks:
+        key = chunk.get('document_name') or chunk.get('uri') or chunk.get('title')
+        if key and key not in seen:
+            seen.add(key)
+            sources.append({'title': chunk.get('title'), 'document_name': chunk.get('document_name'),
+                            'uri': chunk.get('uri')})
+    metrics.grounding_extract_duration.observe(time.perf_counter() - started)
+    if not chunks and not citations:
+        return None
+    return {
+        'chunks': chunks,
+        'citations': citations,
+        'sources': sources,
+        'retrieval_queries': list(grounding_metadata.retrieval_queries or [])
+    }
+
+
+def from_response(response):
+    """Structured grounding of a GenerateContentResponse's first candidate"""
+    if response.candidates:
+        return extract(getattr(response.candidates[0], 'grounding_metadata', None))
+    return None
+
+
+def _prune(value):
+    return {k: v for k, v in value.items() if v not in (None, '', [])}
+
+
+def compact(grounding):
+    """Merge duplicate chunks and drop empty fields"""
+    chunks = []
+    remap = {}
+    positions = {}
+    for chunk in grounding['chunks']:
+        key = (chunk.get('document_name') or chunk.get('uri') or chunk.get('title'), chunk.get('text'))
+        if key not in positions:
+            positions[key] = len(chunks)
+            chunks.append(_prune({**chunk, 'index': len(chunks)}))
+        remap[chunk['index']] = positions[key]
+    citations = []
+    for citation in grounding['citations']:
+        indices = sorted({remap[i] for i in citation['chunk_indices'] if i in remap})
+        citations.append(_prune({**citation, 'chunk_indices': indices}))
+    return _prune({
+        'chunks': chunks,
+        'citations': citations,
+        'sources': [_prune(source) for source in grounding['sources']],
+        'retrieval_queries': grounding.get('retrieval_queries')
+    })
+
+
+def citations_only(grounding):
+    """Cited spans with their sources inline, without chunk text"""
+    chunks = {chunk['index']: chunk for chunk in grounding['chunks']}
+    citations = []
+    for citation in grounding['citations']:
+        sources = []
+        for i in citation['chunk_indices']:
+            chunk = chunks.get(i)
+            if chunk is None:
+                continue
+            source = _prune({'title': chunk.get('title'), 'document_name': chunk.get('document_name'),
+                             'uri': chunk.get('uri')})
+            if source not in sources:
+                sources.append(source)
+        citations.append(_prune({
+            'text': citation['text'],
+            'start_index': citation['start_index'],
+            'end_index': citation['end_index'],
+            'sources': sources
+        }))
+    return {'citations': citations}
+
+
+def shape(grounding, mode='full'):
+    """Return cached full grounding in the requested mode and record its size"""
+    if not isinstance(grounding, dict):
+        # Cached before grounding was structured
+        return grounding
+    if mode == 'compact':
+        grounding = compact(grounding)
+    elif mode == 'citations':
+        grounding = citations_only(grounding)
+    started = time.perf_counter()
+    size = len(json.dumps(grounding, ensure_ascii=False).encode('utf-8'))
+    metrics.grounding_serialize_duration.observe(time.perf_counter() - started, mode=mode)
+    metrics.grounding_payload_bytes.observe(size, mode=mode)
+    return grounding
+
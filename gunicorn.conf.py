@@ -0,0 +1,55 @@
+"""Production server settings: `gunicorn` in this directory serves app.py
+
+The app is imported once in the master (`preload_app`), so configuration,
+directory creation, logging setup and the startup cleanup of `uploads/` run
+once and the workers share the imported code copy-on-write. Anything that
+starts threads or claims persisted operations runs per worker in `post_fork`.
+
+On SIGTERM each worker stops accepting requests, finishes the ones in flight
+and then gives its pending jobs up to JOB_DRAIN_SECONDS to complete; keep
+WEB_GRACEFUL_TIMEOUT above that or the master kills the worker first.
+"""
+
+import multiprocessing
+import os
+
+# Tells app.py not to start per-process state while the master imports it
+os.environ['WEB_PREFORK'] = '1'
+
+wsgi_app = 'app:app'
+bind = os.environ.get('WEB_BIND', f"0.0.0.0:{os.environ.get('PORT', 3000)}")
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count()))
+# Requests mostly wait on Gemini, so each worker serves several at once
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 8))
+preload_app = True
+# Seconds a worker may go without a heartbeat; streaming queries keep it alive
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+# An idle keep-alive connection holds a stopping gthread worker for the whole
+# graceful timeout, leaving no time to drain jobs; off unless set
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 0))
+# Recycle workers after this many requests (0 = never)
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('WEB_ACCESS_LOG')
+errorlog = '-'
+
+
+def when_ready(server):
+    # The master has bound the socket; importing the SDK here, before the
+    # workers fork, lets them share it instead of each importing its own copy
+    import app
+    if app.app.config['IMPORT_WARMUP']:
+        import lazy_import
+        lazy_import.warm_up(background=False)
+
+
+def post_fork(server, worker):
+    import app
+    app.init_worker()
+
+
+def worker_exit(server, worker):
+    import app
+    app.shutdown_worker()
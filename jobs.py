@@ -0,0 +1,458 @@
+"""Background job subsystem for long-running Gemini operations
+
+Uploads and imports return a long-running operation that may take minutes to
+finish. Instead of blocking a Flask worker on a sleep/poll loop, the routes
+submit a job here and return its ID at once. A single poller thread tracks
+every pending operation together and polls each one with adaptive backoff.
+The ASGI app uses `submit_async` instead, which starts and polls the
+operation on the event loop through `client.aio`.
+
+Job kinds registered with `resumable` are persisted in an `OperationStore`
+while they poll, and `resume` picks them up again after a restart. With a
+store, finished jobs are saved there as well, so `status` can answer for jobs
+that ran in another worker process.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from retry import is_rate_limited
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+POLLING = 'polling'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+
+FINISHED_STATES = (SUCCEEDED, FAILED, TIMEOUT)
+
+
+class Job:
+    """A single tracked upload/import job"""
+
+    def __init__(self, kind, client, meta=None, owner=None, poll=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.client = client
+        self.poll = poll
+        self.owner = owner
+        self.meta = meta or {}
+        self.status = QUEUED
+        self.operation = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.started_at = None
+        self.finished_at = None
+        self.poll_count = 0
+        self.poll_errors = 0
+        self.interval = None
+        self.next_poll = 0.0
+        self.polling = False
+        self.resumed = False
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'done': self.finished,
+            'operation_name': getattr(self.operation, 'name', None),
+            'poll_count': self.poll_count,
+            'elapsed_seconds': round(end - (self.started_at or self.created_at), 3),
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+            'result': self.result,
+            'error': self.error,
+            'resumed': self.resumed,
+            **self.meta
+        }
+
+
+class JobManager:
+    """Run job start calls on a bounded pool and poll their operations together"""
+
+    def __init__(self, max_workers=4, max_seconds=3600, initial_interval=1.0,
+                 max_interval=15.0, backoff=1.5, retention=3600, max_poll_errors=5, store=None):
+        self.store = store
+        self.max_seconds = max_seconds
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.retention = retention
+        self.max_poll_errors = max_poll_errors
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._pending = {}
+        self._callbacks = {}
+        self._tasks = set()
+        self._resumable = {}
+        # Owners with persisted operations that this process has not picked up yet
+        self._unresumed = store.owners() if store is not None else set()
+        self._cond = threading.Condition()
+        self._poller = None
+        self._stopped = False
+
+    def resumable(self, kind, on_done=None):
+        """Persist operations of this job kind so they survive a restart
+
+        `on_done(job, operation)` is used for resumed jobs of this kind, so it
+        must only rely on `job.meta` and `job.client`.
+        """
+        self._resumable[kind] = on_done
+
+    def reclaim(self):
+        """Release operations of stopped processes and note whose to resume
+
+        Called once per process, e.g. after a pre-forking server forks a worker.
+        """
+        if self.store is None:
+            return
+        self.store.release_stale()
+        owners = self.store.owners()
+        with self._cond:
+            self._unresumed = owners
+
+    def has_unresumed(self, owner):
+        return owner in self._unresumed
+
+    def resume(self, owner, client):
+        """Re-register an owner's persisted operations under their original job IDs
+
+        They are polled right away, together with every other pending job.
+        """
+        with self._cond:
+            if owner not in self._unresumed:
+                return []
+            self._unresumed.discard(owner)
+        entries = self.store.pending(owner)
+        resumed = []
+        with self._cond:
+            for entry in entries:
+                if entry['job_id'] in self._jobs:
+                    continue
+                job = Job(entry['kind'], client, entry['meta'], owner, job_id=entry['job_id'])
+                job.operation = entry['operation']
+                job.resumed = True
+                job.status = POLLING
+                job.created_at = job.started_at = entry['created_at']
+                job.interval = self.initial_interval
+                job.next_poll = time.monotonic()
+                self._jobs[job.id] = job
+                if self._resumable.get(job.kind):
+                    self._callbacks[job.id] = self._resumable[job.kind]
+                self._pending[job.id] = job
+                resumed.append(job)
+            if resumed:
+                self._ensure_poller()
+                self._cond.notify_all()
+        if resumed:
+            logger.info(f"Resumed {len(resumed)} pending operation(s) from before the last restart")
+        return resumed
+
+    def _persist(self, job):
+        if self.store is None or job.kind not in self._resumable:
+            return
+        try:
+            self.store.record(job)
+        except Exception as e:
+            logger.warning(f"Could not persist operation of job {job.id}: {e}")
+
+    def submit(self, kind, client, start, on_done=None, meta=None, owner=None, poll=None):
+        """Queue a job; `start(client)` returns the long-running operation
+
+        `on_done(job, operation)` runs once the operation completes and may
+        return a dict that is merged into the job result. `owner` scopes
+        lookups so one API key cannot read another key's jobs. `poll(client,
+        operation)` refreshes anything that is not an `operations` resource
+        (e.g. a batch job); it defaults to `client.operations.get`.
+        """
+        job = self._register(kind, client, on_done, meta, owner, poll)
+        with self._cond:
+            self._ensure_poller()
+        self._executor.submit(self._start, job, start)
+        return job
+
+    def submit_async(self, kind, client, start, on_done=None, meta=None, owner=None, poll=None):
+        """Like `submit`, but runs as a task on the current event loop
+
+        `start(client)` and `poll(client, operation)` are coroutines; polls
+        await `client.aio.operations.get` by default, so no thread is held
+        while the operation runs. `on_done` still runs in a worker thread
+        since the completion callbacks are synchronous.
+        """
+        job = self._register(kind, client, on_done, meta, owner, poll)
+        task = asyncio.get_running_loop().create_task(self._run_async(job, start))
+        # The loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def _register(self, kind, client, on_done, meta, owner, poll=None):
+        job = Job(kind, client, meta, owner, poll)
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError('Job manager is shutting down')
+            self._prune()
+            self._jobs[job.id] = job
+            if on_done:
+                self._callbacks[job.id] = on_done
+        return job
+
+    def get(self, job_id, owner=None):
+        with self._cond:
+            job = self._jobs.get(job_id)
+        if job is None or (owner is not None and job.owner != owner):
+            return None
+        return job
+
+    def list(self, ids=None, owner=None):
+        with self._cond:
+            if ids is None:
+                jobs = list(self._jobs.values())
+            else:
+                jobs = [self._jobs[i] for i in ids if i in self._jobs]
+        return [job for job in jobs if owner is None or job.owner == owner]
+
+    def status(self, job_id, owner=None):
+        """Status dict of a job, including jobs run by other processes; None if unknown"""
+        job = self.get(job_id, owner)
+        if job is not None:
+            return job.to_dict()
+        if self.store is None:
+            return None
+        try:
+            return self.store.lookup(job_id, owner)
+        except Exception as e:
+            logger.warning(f"Could not look up job {job_id}: {e}")
+            return None
+
+    def statuses(self, ids=None, owner=None):
+        """Status dicts for `list`; explicitly requested IDs may come from other processes"""
+        found = {job.id: job.to_dict() for job in self.list(ids, owner)}
+        if ids is None:
+            return list(found.values())
+        for job_id in ids:
+            if job_id not in found:
+                found[job_id] = self.status(job_id, owner)
+        return [found[job_id] for job_id in ids if found[job_id] is not None]
+
+    def pending_count(self):
+        with self._cond:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def shutdown(self, wait=True, timeout=None):
+        """Stop accepting jobs and optionally wait for pending ones to finish
+
+        Returns the number of jobs still pending when polling stopped.
+        """
+        if wait:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self.pending_count():
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                time.sleep(0.2)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        return self.pending_count()
+
+    def _ensure_poller(self):
+        if self._poller is None or not self._poller.is_alive():
+            self._poller = threading.Thread(target=self._poll_loop, name='job-poller', daemon=True)
+            self._poller.start()
+
+    def _prune(self):
+        """Drop finished jobs older than the retention window"""
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _start(self, job, start):
+        job.status = RUNNING
+        job.started_at = job.updated_at = time.time()
+        try:
+            operation = start(job.client)
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed to start: {e}")
+            self._finish(job, FAILED, error=str(e))
+            return
+
+        job.operation = operation
+        if getattr(operation, 'done', False):
+            self._complete(job, operation)
+            return
+        self._persist(job)
+
+        with self._cond:
+            job.status = POLLING
+            job.interval = self.initial_interval
+            job.next_poll = time.monotonic() + job.interval
+            job.updated_at = time.time()
+            self._pending[job.id] = job
+            self._cond.notify_all()
+
+    async def _run_async(self, job, start):
+        job.status = RUNNING
+        job.started_at = job.updated_at = time.time()
+        try:
+            operation = await start(job.client)
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed to start: {e}")
+            self._finish(job, FAILED, error=str(e))
+            return
+
+        job.operation = operation
+        job.status = POLLING
+        job.interval = self.initial_interval
+        if not getattr(operation, 'done', False):
+            await asyncio.to_thread(self._persist, job)
+        while not getattr(operation, 'done', False):
+            await asyncio.sleep(job.interval)
+            try:
+                if job.poll:
+                    operation = await job.poll(job.client, job.operation)
+                else:
+                    operation = await job.client.aio.operations.get(job.operation)
+                job.operation = operation
+                job.poll_errors = 0
+            except Exception as e:
+                if is_rate_limited(e):
+                    logger.warning(f"Job {job.id} poll throttled: {e}")
+                    job.interval = max(job.interval, getattr(e, 'retry_after', None) or 0)
+                else:
+                    job.poll_errors += 1
+                    logger.warning(f"Job {job.id} poll error ({job.poll_errors}): {e}")
+                    if job.poll_errors >= self.max_poll_errors:
+                        self._finish(job, FAILED, error=str(e))
+                        return
+            finally:
+                job.poll_count += 1
+                job.updated_at = time.time()
+
+            if not getattr(operation, 'done', False) and time.time() - job.started_at > self.max_seconds:
+                self._finish(job, TIMEOUT, error='Operation timeout',
+                             result={'message': 'Operation may still be processing'})
+                return
+            job.interval = min(job.interval * self.backoff, self.max_interval)
+
+        await asyncio.to_thread(self._complete, job, operation)
+
+    def _poll_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    now = time.monotonic()
+                    due = [job for job in self._pending.values()
+                           if not job.polling and job.next_poll <= now]
+                    if due:
+                        break
+                    waiting = [job.next_poll for job in self._pending.values() if not job.polling]
+                    self._cond.wait(timeout=max(min(waiting) - now, 0.01) if waiting else None)
+                for job in due:
+                    job.polling = True
+            for job in due:
+                try:
+                    self._executor.submit(self._poll, job)
+                except RuntimeError:
+                    # Executor already shut down
+                    return
+
+    def _poll(self, job):
+        try:
+            if job.poll:
+                operation = job.poll(job.client, job.operation)
+            else:
+                operation = job.client.operations.get(job.operation)
+            job.operation = operation
+            job.poll_errors = 0
+        except Exception as e:
+            if is_rate_limited(e):
+                # Overload is not a reason to give up on the operation; just poll less often
+                logger.warning(f"Job {job.id} poll throttled: {e}")
+                job.interval = max(job.interval, getattr(e, 'retry_after', None) or 0)
+            else:
+                job.poll_errors += 1
+                logger.warning(f"Job {job.id} poll error ({job.poll_errors}): {e}")
+                if job.poll_errors >= self.max_poll_errors:
+                    self._finish(job, FAILED, error=str(e))
+                    return
+            operation = None
+        finally:
+            job.poll_count += 1
+            job.updated_at = time.time()
+
+        if operation is not None and operation.done:
+            self._complete(job, operation)
+            return
+
+        if time.time() - job.started_at > self.max_seconds:
+            self._finish(job, TIMEOUT, error='Operation timeout',
+                         result={'message': 'Operation may still be processing'})
+            return
+
+        with self._cond:
+            job.interval = min(job.interval * self.backoff, self.max_interval)
+            job.next_poll = time.monotonic() + job.interval
+            job.polling = False
+            self._cond.notify_all()
+
+    def _complete(self, job, operation):
+        error = getattr(operation, 'error', None)
+        if error:
+            self._finish(job, FAILED, error=str(error))
+            return
+
+        result = {'operation': str(operation)}
+        response = getattr(operation, 'response', None)
+        document_name = getattr(response, 'document_name', None)
+        if document_name:
+            result['document_name'] = document_name
+
+        callback = self._callbacks.get(job.id)
+        if callback:
+            try:
+                result.update(callback(job, operation) or {})
+            except Exception as e:
+                logger.error(f"Job {job.id} completion callback failed: {e}")
+        self._finish(job, SUCCEEDED, result=result)
+
+    def _finish(self, job, status, result=None, error=None):
+        with self._cond:
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished_at = job.updated_at = time.time()
+            job.polling = False
+            job.client = None
+            job.poll = None
+            self._pending.pop(job.id, None)
+            self._callbacks.pop(job.id, None)
+            self._cond.notify_all()
+        if self.store is not None:
+            try:
+                self.store.save_result(job)
+                if job.kind in self._resumable:
+                    self.store.remove(job.id)
+            except Exception as e:
+                logger.warning(f"Could not persist result of job {job.id}: {e}")
+        logger.info(f"Job {job.id} ({job.kind}) {status} after {job.poll_count} poll(s)")
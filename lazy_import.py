@@ -0,0 +1,112 @@
+"""Deferred imports of the heavy SDK modules
+
+`google.genai` (mostly `google.genai.types`) and `requests` are about 70% of
+the time it takes to import app.py, yet no route needs them before its first
+Gemini call. Modules that only touch them at call time bind a `Lazy` proxy
+instead of importing them:
+
+    types = lazy_module('google.genai.types')
+
+The module is imported on the first attribute access and the proxy forwards
+to it from then on. `warm_up` imports the same modules ahead of time (in a
+background thread, or synchronously in the gunicorn master after it has
+bound) so the first request normally finds them loaded. Each import records
+how long it took and whether a request or the warm-up paid for it.
+"""
+
+import importlib
+import logging
+import sys
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Imported by `warm_up`; everything app.py defers
+HEAVY_MODULES = ('google.genai', 'google.genai.types', 'requests')
+
+_loads = {}
+_loads_lock = threading.Lock()
+
+
+def load(name, trigger='request'):
+    """Import `name`, recording the time taken if this call loaded it"""
+    if name in sys.modules:
+        # import_module waits if another thread is still initializing it
+        return importlib.import_module(name)
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    seconds = time.perf_counter() - started
+    with _loads_lock:
+        # A concurrent import of the same module waited on the import lock; keep the first
+        if name in _loads:
+            return module
+        _loads[name] = {'seconds': round(seconds, 4), 'trigger': trigger}
+    metrics.module_import_duration.observe(seconds, module=name, trigger=trigger)
+    logger.info(f"Imported {name} in {seconds * 1000:.0f} ms ({trigger})")
+    return module
+
+
+class Lazy:
+    """Proxy that builds its target with `factory()` on first attribute access"""
+
+    def __init__(self, factory, label):
+        self._factory = factory
+        self._label = label
+        self._target = None
+        self._lock = threading.Lock()
+
+    def _resolve(self):
+        target = self._target
+        if target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+                target = self._target
+        return target
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._target is not None else 'not loaded'
+        return f"<lazy {self._label} ({state})>"
+
+
+def lazy_module(name):
+    return Lazy(lambda: load(name), name)
+
+
+def warm_up(names=HEAVY_MODULES, background=True):
+    """Import `names` now; returns the thread when run in the background, else None"""
+    missing = [name for name in names if name not in sys.modules]
+    if not missing:
+        return None
+
+    def run():
+        started = time.perf_counter()
+        for name in missing:
+            try:
+                load(name, trigger='warmup')
+            except Exception as e:
+                # The request that needs it will raise the real error
+                logger.warning(f"Warm-up could not import {name}: {e}")
+        logger.info(f"Import warm-up finished in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    if not background:
+        run()
+        return None
+    thread = threading.Thread(target=run, name='import-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def stats():
+    with _loads_lock:
+        loaded = {name: dict(entry) for name, entry in _loads.items()}
+    return {
+        'loaded': {name: name in sys.modules for name in HEAVY_MODULES},
+        'imports': loaded
+    }
@@ -0,0 +1,400 @@
+"""Local SQLite index of stores, documents and their custom metadata
+
+Listing stores and documents used to go to the API on every page load. The
+index keeps what the API last returned per API key, updated write-through by
+the routes that create stores, add documents or delete stores, so listings
+are answered from disk in milliseconds. Entries older than the reconcile
+interval are refreshed from the API in the background after being served.
+
+Because the index knows every document's `custom_metadata`, it can also tell
+when a query's `metadata_filter` cannot match any document in the queried
+stores, before a generate call is spent on it.
+"""
+
+import fnmatch
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stores (
+    owner TEXT NOT NULL,
+    name TEXT NOT NULL,
+    display_name TEXT,
+    create_time TEXT,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (owner, name)
+);
+CREATE TABLE IF NOT EXISTS documents (
+    store_name TEXT NOT NULL,
+    name TEXT NOT NULL,
+    display_name TEXT,
+    create_time TEXT,
+    update_time TEXT,
+    custom_metadata TEXT,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (store_name, name)
+);
+CREATE TABLE IF NOT EXISTS syncs (
+    owner TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (owner, scope)
+);
+"""
+
+# Sync scope of an API key's store list; document listings use the store name
+STORES_SCOPE = 'stores'
+
+
+def store_to_dict(store):
+    return {
+        'name': store.name,
+        'display_name': getattr(store, 'display_name', 'N/A'),
+        'create_time': str(getattr(store, 'create_time', 'N/A'))
+    }
+
+
+class MetadataIndex:
+    """SQLite-backed store/document index with background reconciliation"""
+
+    def __init__(self, path, reconcile_seconds=60, max_workers=2):
+        self.path = path
+        self.reconcile_seconds = reconcile_seconds
+        self._lock = threading.Lock()
+        self._reconciling = set()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='metadata-reconcile')
+        self.reconciles = 0
+        self.reconcile_failures = 0
+        self.filter_rejections = 0
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _synced(self, conn, owner, scope):
+        conn.execute('INSERT OR REPLACE INTO syncs VALUES (?, ?, ?)', (owner, scope, time.time()))
+
+    def synced_at(self, owner, scope):
+        with self._connect() as conn:
+            row = conn.execute('SELECT synced_at FROM syncs WHERE owner = ? AND scope = ?',
+                               (owner, scope)).fetchone()
+        return row[0] if row else None
+
+    # Stores
+
+    def stores(self, owner):
+        """Indexed stores of an API key, or None if they were never listed"""
+        with self._connect() as conn:
+            if conn.execute('SELECT 1 FROM syncs WHERE owner = ? AND scope = ?',
+                            (owner, STORES_SCOPE)).fetchone() is None:
+                return None
+            rows = conn.execute(
+                'SELECT name, display_name, create_time FROM stores WHERE owner = ? ORDER BY position',
+                (owner,)
+            ).fetchall()
+        return [{'name': row[0], 'display_name': row[1], 'create_time': row[2]} for row in rows]
+
+    def replace_stores(self, owner, stores):
+        """Record a complete store listing from the API"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM stores WHERE owner = ?', (owner,))
+            conn.executemany(
+                'INSERT INTO stores VALUES (?, ?, ?, ?, ?)',
+                [(owner, store['name'], store['display_name'], store['create_time'], i)
+                 for i, store in enumerate(stores)]
+            )
+            self._synced(conn, owner, STORES_SCOPE)
+        return stores
+
+    def put_store(self, owner, store):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO stores VALUES (?, ?, ?, ?, '
+                '(SELECT COALESCE(MAX(position), -1) + 1 FROM stores WHERE owner = ?))',
+                (owner, store['name'], store['display_name'], store['create_time'], owner)
+            )
+
+    def forget_store(self, store_name):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM stores WHERE name = ?', (store_name,))
+            conn.execute('DELETE FROM documents WHERE store_name = ?', (store_name,))
+            conn.execute('DELETE FROM syncs WHERE scope = ?', (store_name,))
+
+    # Documents
+
+    def documents(self, owner, store_name):
+        """Indexed documents of a store, or None if this API key never listed it in full"""
+        with self._connect() as conn:
+            if conn.execute('SELECT 1 FROM syncs WHERE owner = ? AND scope = ?',
+                            (owner, store_name)).fetchone() is None:
+                return None
+            rows = conn.execute(
+                'SELECT name, display_name, create_time, update_time, custom_metadata FROM documents '
+                'WHERE store_name = ? ORDER BY position',
+                (store_name,)
+            ).fetchall()
+        return [{
+            'name': row[0],
+            'display_name': row[1],
+            'create_time': row[2],
+            'update_time': row[3],
+            'custom_metadata': json.loads(row[4]) if row[4] else {}
+        } for row in rows]
+
+    def replace_documents(self, owner, store_name, documents):
+        """Record a complete document listing from the API"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM documents WHERE store_name = ?', (store_name,))
+            conn.executemany(
+                'INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(store_name, doc['name'], doc['display_name'], doc['create_time'], doc['update_time'],
+                  json.dumps(doc.get('custom_metadata') or {}, ensure_ascii=False), i)
+                 for i, doc in enumerate(documents)]
+            )
+            self._synced(conn, owner, store_name)
+
+    def put_document(self, store_name, document):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, '
+                '(SELECT COALESCE(MAX(position), -1) + 1 FROM documents WHERE store_name = ?))',
+                (store_name, document['name'], document['display_name'], document['create_time'],
+                 document['update_time'], json.dumps(document.get('custom_metadata') or {}, ensure_ascii=False),
+                 store_name)
+            )
+
+    def mark_stale(self, store_name):
+        """Stop serving a store's documents until they are listed again in full"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM syncs WHERE scope = ?', (store_name,))
+
+    def document_metadata(self, owner, store_names):
+        """custom_metadata of every document in these stores, or None if any store is not indexed"""
+        with self._connect() as conn:
+            for store_name in store_names:
+                if conn.execute('SELECT 1 FROM syncs WHERE owner = ? AND scope = ?',
+                                (owner, store_name)).fetchone() is None:
+                    return None
+            rows = conn.execute(
+                f"SELECT custom_metadata FROM documents WHERE store_name IN ({','.join('?' * len(store_names))})",
+                list(store_names)
+            ).fetchall()
+        return [json.loads(row[0]) if row[0] else {} for row in rows]
+
+    # Background reconciliation
+
+    def refresh_later(self, owner, scope, refresh):
+        """Run `refresh()` in the background if `scope` was last synced too long ago"""
+        synced_at = self.synced_at(owner, scope)
+        if synced_at is not None and time.time() - synced_at < self.reconcile_seconds:
+            return False
+        key = (owner, scope)
+        with self._lock:
+            if key in self._reconciling:
+                return False
+            self._reconciling.add(key)
+        self._executor.submit(self._reconcile, key, refresh)
+        return True
+
+    def _reconcile(self, key, refresh):
+        try:
+            refresh()
+            with self._lock:
+                self.reconciles += 1
+        except Exception as e:
+            logger.warning(f"Metadata index: reconciling {key[1]} failed: {e}")
+            with self._lock:
+                self.reconcile_failures += 1
+        finally:
+            with self._lock:
+                self._reconciling.discard(key)
+
+    # Metadata filters
+
+    def check_filter(self, owner, store_names, expression):
+        """Reason `expression` cannot match any indexed document, or None
+
+        Returns None whenever the answer is not certain: a store that was
+        never listed in full, or a filter this parser does not understand.
+        """
+        try:
+            tree = parse_filter(expression)
+        except ValueError as e:
+            logger.info(f"Not checking metadata_filter {expression!r}: {e}")
+            return None
+        metadata = self.document_metadata(owner, store_names)
+        if metadata is None or any(matches(tree, entry) for entry in metadata):
+            return None
+        with self._lock:
+            self.filter_rejections += 1
+        return f"metadata_filter matches none of the {len(metadata)} indexed document(s) in these stores"
+
+    def metadata_keys(self, owner, store_names):
+        """Known custom_metadata keys of these stores"""
+        return sorted({key for entry in self.document_metadata(owner, store_names) or [] for key in entry})
+
+    def stats(self):
+        with self._connect() as conn:
+            stores = conn.execute('SELECT COUNT(*) FROM stores').fetchone()[0]
+            documents = conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+        with self._lock:
+            return {
+                'stores': stores,
+                'documents': documents,
+                'reconciles': self.reconciles,
+                'reconcile_failures': self.reconcile_failures,
+                'reconciling': len(self._reconciling),
+                'filter_rejections': self.filter_rejections
+            }
+
+
+# metadata_filter expressions (the AIP-160 subset used with file search):
+#   genre = "fiction" AND (year >= 1930 OR NOT author: "Graves")
+
+TOKEN = re.compile(r'''\s*(?:
+    (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<op><=|>=|!=|=|<|>|:)
+  | (?P<paren>[()])
+  | (?P<word>[^\s()<>=!:"']+)
+)''', re.VERBOSE)
+
+KEY_PREFIXES = ('chunk.custom_metadata.', 'custom_metadata.')
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN.match(expression, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"unexpected character at {position}")
+        position = match.end()
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'string':
+            tokens.append(('value', re.sub(r'\\(.)', r'\1', text[1:-1])))
+        elif kind == 'word' and text in ('AND', 'OR', 'NOT'):
+            tokens.append((text, text))
+        elif kind == 'word':
+            tokens.append(('word', text))
+        else:
+            tokens.append((text, text))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def take(self, *kinds):
+        if self.peek() not in kinds:
+            raise ValueError(f"expected {' or '.join(kinds)}, got {self.peek() or 'end of filter'}")
+        token = self.tokens[self.position]
+        self.position += 1
+        return token[1]
+
+    def parse(self):
+        tree = self.disjunction()
+        if self.peek() is not None:
+            raise ValueError(f"unexpected {self.peek()}")
+        return tree
+
+    def disjunction(self):
+        terms = [self.conjunction()]
+        while self.peek() == 'OR':
+            self.take('OR')
+            terms.append(self.conjunction())
+        return terms[0] if len(terms) == 1 else ('or', terms)
+
+    def conjunction(self):
+        terms = [self.unary()]
+        # Adjacent terms are an implicit AND
+        while self.peek() in ('AND', 'NOT', '(', 'word'):
+            if self.peek() == 'AND':
+                self.take('AND')
+            terms.append(self.unary())
+        return terms[0] if len(terms) == 1 else ('and', terms)
+
+    def unary(self):
+        if self.peek() == 'NOT':
+            self.take('NOT')
+            return ('not', self.unary())
+        if self.peek() == '(':
+            self.take('(')
+            tree = self.disjunction()
+            self.take(')')
+            return tree
+        key = self.take('word')
+        for prefix in KEY_PREFIXES:
+            if key.startswith(prefix):
+                key = key[len(prefix):]
+        op = self.take('=', '!=', '<', '<=', '>', '>=', ':')
+        return ('compare', key, op, self.take('value', 'word'))
+
+
+def parse_filter(expression):
+    """Parse a metadata_filter into a small tree; raises ValueError if unsupported"""
+    return _Parser(_tokenize(expression)).parse()
+
+
+def _compare(actual, op, expected):
+    if isinstance(actual, list):
+        if op == '!=':
+            return expected not in actual
+        return any(_compare(value, op, expected) for value in actual)
+    if isinstance(actual, (int, float)):
+        try:
+            expected = float(expected)
+        except ValueError:
+            return False
+    else:
+        actual = str(actual)
+        if op in ('=', ':') and '*' in expected:
+            return fnmatch.fnmatchcase(actual, expected)
+    if op in ('=', ':'):
+        return actual == expected
+    if op == '!=':
+        return actual != expected
+    if op == '<':
+        return actual < expected
+    if op == '<=':
+        return actual <= expected
+    if op == '>':
+        return actual > expected
+    return actual >= expected
+
+
+def matches(tree, metadata):
+    """Whether a document with this custom_metadata dict satisfies a parsed filter"""
+    kind = tree[0]
+    if kind == 'and':
+        return all(matches(term, metadata) for term in tree[1])
+    if kind == 'or':
+        return any(matches(term, metadata) for term in tree[1])
+    if kind == 'not':
+        return not matches(tree[1], metadata)
+    _, key, op, expected = tree
+    if key not in metadata:
+        return False
+    return _compare(metadata[key], op, expected)
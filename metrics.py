@@ -0,0 +1,251 @@
+"""Minimal Prometheus metrics: counters, gauges and histograms with labels
+
+Rendered in the Prometheus text exposition format (version 0.0.4) by the
+`/metrics` route. Kept dependency-free on purpose; the metric names follow
+Prometheus conventions so dashboards work unchanged with prometheus_client.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_sample(self, key, state):
+        counts, total, count = state
+        lines = []
+        for bound, bucket_count in zip(self.buckets, counts):
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        """Register a callable run before each render, e.g. to refresh gauges"""
+        self._collectors.append(collector)
+
+    def render(self):
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# HTTP routes
+http_request_duration = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Time spent handling a request, until the response headers',
+    ('route', 'method', 'status'))
+http_requests_in_flight = REGISTRY.gauge(
+    'http_requests_in_flight', 'Requests currently being handled', ('route',))
+route_errors = REGISTRY.counter(
+    'http_request_errors_total', 'Requests that failed with an exception', ('route', 'exception'))
+
+# Upstream Gemini calls
+upstream_call_duration = REGISTRY.histogram(
+    'gemini_call_duration_seconds', 'Duration of Gemini SDK calls', ('call',))
+upstream_calls_in_flight = REGISTRY.gauge(
+    'gemini_calls_in_flight', 'Gemini SDK calls currently in progress', ('call',))
+upstream_errors = REGISTRY.counter(
+    'gemini_call_errors_total', 'Gemini SDK calls that raised', ('call', 'exception'))
+operation_polls = REGISTRY.counter(
+    'gemini_operation_polls_total', 'operations.get iterations while waiting for long-running operations')
+
+# Uploads and serialization
+upload_bytes = REGISTRY.counter(
+    'upload_bytes_total', 'Bytes received in file uploads', ('staged_on_disk',))
+upload_parse_duration = REGISTRY.histogram(
+    'upload_parse_duration_seconds', 'Time spent parsing multipart uploads into spool buffers')
+chunked_upload_chunks = REGISTRY.counter(
+    'chunked_upload_chunks_total', 'Chunks of resumable browser uploads, received or rejected', ('result',))
+json_serialize_duration = REGISTRY.histogram(
+    'json_serialize_duration_seconds', 'Time spent serializing JSON responses',
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5))
+
+# Background work
+jobs_pending = REGISTRY.gauge(
+    'background_jobs_pending', 'Jobs queued, running or polling an upstream operation')
+
+# Grounding metadata
+grounding_extract_duration = REGISTRY.histogram(
+    'grounding_extract_duration_seconds', 'Time spent converting grounding metadata to JSON-ready dicts',
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05))
+grounding_serialize_duration = REGISTRY.histogram(
+    'grounding_serialize_duration_seconds', 'Time spent serializing grounding metadata per response mode',
+    ('mode',), buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05))
+grounding_payload_bytes = REGISTRY.histogram(
+    'grounding_payload_bytes', 'Size of the grounding metadata sent per response mode',
+    ('mode',), buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576))
+
+# Client-side upstream rate limiting
+upstream_rejections = REGISTRY.counter(
+    'gemini_guard_rejections_total', 'Gemini calls rejected before being sent upstream',
+    ('endpoint_class', 'reason'))
+upstream_throttle_wait = REGISTRY.histogram(
+    'gemini_guard_wait_seconds', 'Time calls waited for a rate-limit token', ('endpoint_class',))
+
+# Request coalescing
+coalesced_requests = REGISTRY.counter(
+    'coalesced_requests_total', 'Requests served by sharing an identical in-flight upstream call', ('kind',))
+
+# Model routing
+query_routes = REGISTRY.counter(
+    'query_routes_total', 'Queries routed to each model tier, by how the tier was chosen', ('tier', 'source'))
+query_tier_duration = REGISTRY.histogram(
+    'query_tier_duration_seconds', 'Upstream generate latency per model tier', ('tier', 'model'))
+query_tier_tokens = REGISTRY.counter(
+    'query_tier_tokens_total', 'Tokens used per model tier (prompt, output, thinking)', ('tier', 'kind'))
+
+# Startup
+module_import_duration = REGISTRY.histogram(
+    'module_import_duration_seconds', 'Time to import a deferred module, by who paid for it', ('module', 'trigger'))
+
+# Response encoding
+response_bytes = REGISTRY.counter(
+    'response_bytes_total', 'Bytes sent for compressible responses, by content encoding', ('encoding',))
+response_bytes_saved = REGISTRY.counter(
+    'response_bytes_saved_total', 'Bytes saved by compressing responses', ('encoding',))
+not_modified_responses = REGISTRY.counter(
+    'not_modified_responses_total', 'Listings answered 304 because the client already had them', ('route',))
+
+# Local retrieval pre-filter
+retrieval_index_duration = REGISTRY.histogram(
+    'retrieval_index_duration_seconds', 'Time to tokenize and index the text of one upload')
+prefilter_decisions = REGISTRY.counter(
+    'query_prefilter_decisions_total', 'Queries checked against the local retrieval index, by outcome', ('outcome',))
+prefilter_stores_dropped = REGISTRY.counter(
+    'query_prefilter_stores_dropped_total', 'Stores left out of File Search calls because no document matched')
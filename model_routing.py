@@ -0,0 +1,269 @@
+"""Model and generation-config routing for queries
+
+Every query used to go to `gemini-2.5-flash` with default settings, so a
+one-line lookup paid the same latency as a multi-part analysis. A
+`ModelRouter` picks a tier per request:
+
+- `fast`: gemini-2.5-flash with thinking disabled, for short lookups
+- `balanced`: gemini-2.5-flash with dynamic thinking (the previous behaviour)
+- `deep`: gemini-2.5-pro with dynamic thinking, for long or analytical questions
+
+Requests may name a `tier` (or `auto`), a `model` from the configured tiers,
+and `generation` overrides (`max_output_tokens`, `temperature`, `top_p`,
+`thinking_budget`). `auto` uses `classify`, a keyword/length heuristic.
+Each route (`query`, `query-stream`, `query-batch`, `sessions`) has its own
+default tier. Latency and token usage are recorded per tier so the policy
+can be tuned against real traffic.
+"""
+
+import json
+import logging
+import re
+import threading
+
+import metrics
+from lazy_import import lazy_module
+
+logger = logging.getLogger(__name__)
+
+types = lazy_module('google.genai.types')
+
+AUTO = 'auto'
+
+# tier -> (model, thinking budget; -1 lets the model decide)
+DEFAULT_TIERS = {
+    'fast': ('gemini-2.5-flash', 0),
+    'balanced': ('gemini-2.5-flash', -1),
+    'deep': ('gemini-2.5-pro', -1)
+}
+
+DEFAULT_ROUTES = {
+    'query': AUTO,
+    'query-stream': AUTO,
+    'query-batch': AUTO,
+    'sessions': 'balanced'
+}
+
+# Tier used when `auto` has no query text to look at
+FALLBACK_TIER = 'balanced'
+
+GENERATION_FIELDS = ('max_output_tokens', 'temperature', 'top_p', 'thinking_budget')
+
+# Questions asking for reasoning rather than lookup
+ANALYTIC_PATTERN = re.compile(
+    r'\b(compare|contrast|why|explain|analy[sz]e|evaluate|assess|implications?|trade-?offs?|'
+    r'pros and cons|step by step|reason|summari[sz]e all)\b|比較|分析|為什麼|为什么|解釋|解释|評估|评估|總結|总结|優缺點',
+    re.IGNORECASE
+)
+CJK_PATTERN = re.compile(r'[㐀-鿿]')
+
+
+def word_count(text):
+    """Whitespace words, with every two CJK characters counted as one word"""
+    cjk = len(CJK_PATTERN.findall(text))
+    return len(CJK_PATTERN.sub(' ', text).split()) + cjk // 2
+
+
+def classify(query_text, store_names=()):
+    """(tier, reason) for a query from its length and wording"""
+    words = word_count(query_text)
+    score = words // 25
+    reasons = [f"{words} words"]
+    if ANALYTIC_PATTERN.search(query_text):
+        score += 1
+        reasons.append('analytic wording')
+    if query_text.count('?') + query_text.count('？') >= 2:
+        score += 1
+        reasons.append('several questions')
+    if len(store_names) >= 3:
+        score += 1
+        reasons.append(f"{len(store_names)} stores")
+    if score >= 3:
+        return 'deep', ', '.join(reasons)
+    if score == 0 and words <= 12:
+        return 'fast', ', '.join(reasons)
+    return 'balanced', ', '.join(reasons)
+
+
+class Route:
+    """A resolved tier, model and generation settings for one request"""
+
+    def __init__(self, tier, model, source, reason, generation):
+        self.tier = tier
+        self.model = model
+        # How the tier was chosen: classifier, requested, default or model
+        self.source = source
+        self.reason = reason
+        self.generation = generation
+
+    def config(self, **kwargs):
+        """GenerateContentConfig with this route's settings plus `kwargs` (tools, ...)"""
+        settings = dict(self.generation)
+        budget = settings.pop('thinking_budget', None)
+        if budget is not None:
+            settings['thinking_config'] = types.ThinkingConfig(thinking_budget=budget)
+        return types.GenerateContentConfig(**settings, **kwargs)
+
+    @property
+    def variant(self):
+        """Cache-key component; answers from different settings are not shared"""
+        return json.dumps([self.model, self.generation], sort_keys=True)
+
+    def to_dict(self):
+        return {'tier': self.tier, 'model': self.model, 'source': self.source, 'reason': self.reason,
+                **self.generation}
+
+
+def _generation(overrides):
+    """Validated generation overrides from a request body"""
+    if overrides is None:
+        return {}
+    if not isinstance(overrides, dict):
+        raise ValueError('generation must be an object')
+    unknown = set(overrides) - set(GENERATION_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown generation settings: {', '.join(sorted(unknown))}")
+    generation = {}
+    try:
+        if overrides.get('max_output_tokens') is not None:
+            generation['max_output_tokens'] = int(overrides['max_output_tokens'])
+            if generation['max_output_tokens'] < 1:
+                raise ValueError('max_output_tokens must be positive')
+        if overrides.get('temperature') is not None:
+            generation['temperature'] = float(overrides['temperature'])
+            if not 0 <= generation['temperature'] <= 2:
+                raise ValueError('temperature must be between 0 and 2')
+        if overrides.get('top_p') is not None:
+            generation['top_p'] = float(overrides['top_p'])
+            if not 0 < generation['top_p'] <= 1:
+                raise ValueError('top_p must be in (0, 1]')
+        if overrides.get('thinking_budget') is not None:
+            generation['thinking_budget'] = int(overrides['thinking_budget'])
+            if generation['thinking_budget'] < -1:
+                raise ValueError('thinking_budget must be -1 (dynamic), 0 (off) or a token count')
+    except (TypeError, ValueError) as e:
+        raise ValueError(str(e)) from None
+    return generation
+
+
+class ModelRouter:
+    """Resolve per-request routes and keep per-tier latency/token statistics"""
+
+    def __init__(self, tiers=None, routes=None):
+        self.tiers = {**DEFAULT_TIERS, **(tiers or {})}
+        self.routes = {**DEFAULT_ROUTES, **(routes or {})}
+        for route, tier in self.routes.items():
+            if tier != AUTO and tier not in self.tiers:
+                raise ValueError(f"Route {route} defaults to unknown tier {tier}")
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def resolve(self, route, data=None, query_text=None, store_names=()):
+        """Route for a request body (`tier`, `model`, `generation`); raises ValueError on bad hints"""
+        resolved = self._resolve(route, data or {}, query_text, store_names)
+        metrics.query_routes.inc(tier=resolved.tier, source=resolved.source)
+        return resolved
+
+    def check(self, route, data):
+        """Raise ValueError if a request body's routing hints are invalid"""
+        self._resolve(route, data or {}, None, ())
+
+    def _resolve(self, route, data, query_text, store_names):
+        tier = data.get('tier') or self.routes.get(route, AUTO)
+        if tier == AUTO:
+            source = 'classifier'
+            if query_text:
+                tier, reason = classify(query_text, store_names)
+            else:
+                tier, reason = FALLBACK_TIER, 'no query text'
+        elif tier in self.tiers:
+            source = 'requested' if data.get('tier') else 'default'
+            reason = f"{route} default" if source == 'default' else f"tier {tier}"
+        else:
+            raise ValueError(f"tier must be one of {', '.join([AUTO, *self.tiers])}")
+        model, budget = self.tiers[tier]
+
+        if data.get('model'):
+            models = {name for name, _ in self.tiers.values()}
+            if data['model'] not in models:
+                raise ValueError(f"model must be one of {', '.join(sorted(models))}")
+            model, source, reason = data['model'], 'model', f"model {data['model']}"
+
+        generation = {'thinking_budget': budget}
+        generation.update(_generation(data.get('generation')))
+        if 'pro' in model and generation['thinking_budget'] == 0:
+            if 'thinking_budget' in (data.get('generation') or {}):
+                raise ValueError(f"{model} cannot run with thinking disabled")
+            # A pro model picked for a fast tier keeps the smallest budget it accepts
+            generation['thinking_budget'] = 128
+        return Route(tier, model, source, reason, generation)
+
+    def record(self, route, seconds, usage=None, ttfb=None):
+        """Record one upstream call made with `route`"""
+        tokens = {
+            'prompt': getattr(usage, 'prompt_token_count', None) or 0,
+            'output': getattr(usage, 'candidates_token_count', None) or 0,
+            'thinking': getattr(usage, 'thoughts_token_count', None) or 0
+        }
+        metrics.query_tier_duration.observe(seconds, tier=route.tier, model=route.model)
+        for kind, count in tokens.items():
+            if count:
+                metrics.query_tier_tokens.inc(count, tier=route.tier, kind=kind)
+        with self._lock:
+            stats = self._stats.setdefault(route.tier, {
+                'calls': 0, 'seconds': 0.0, 'ttfb_calls': 0, 'ttfb_seconds': 0.0,
+                'prompt': 0, 'output': 0, 'thinking': 0, 'models': {}
+            })
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            if ttfb is not None:
+                stats['ttfb_calls'] += 1
+                stats['ttfb_seconds'] += ttfb
+            for kind, count in tokens.items():
+                stats[kind] += count
+            stats['models'][route.model] = stats['models'].get(route.model, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            tiers = {}
+            for tier, stats in self._stats.items():
+                calls = stats['calls']
+                tiers[tier] = {
+                    'calls': calls,
+                    'avg_latency_ms': round(stats['seconds'] / calls * 1000, 1),
+                    'avg_ttfb_ms': round(stats['ttfb_seconds'] / stats['ttfb_calls'] * 1000, 1)
+                    if stats['ttfb_calls'] else None,
+                    'avg_prompt_tokens': round(stats['prompt'] / calls, 1),
+                    'avg_output_tokens': round(stats['output'] / calls, 1),
+                    'avg_thinking_tokens': round(stats['thinking'] / calls, 1),
+                    'models': dict(stats['models'])
+                }
+        return {
+            'tiers': {tier: {'model': model, 'thinking_budget': budget}
+                      for tier, (model, budget) in self.tiers.items()},
+            'routes': dict(self.routes),
+            'usage': tiers
+        }
+
+
+def parse_tiers(spec):
+    """Parse `fast=gemini-2.5-flash:0,deep=gemini-2.5-pro:4096` (model, optional thinking budget)"""
+    tiers = {}
+    for part in filter(None, (spec or '').split(',')):
+        name, _, value = part.partition('=')
+        model, _, budget = value.strip().partition(':')
+        if not name.strip() or not model:
+            raise ValueError(f"Invalid model tier: {part}")
+        tiers[name.strip()] = (model, int(budget) if budget else -1)
+    return tiers
+
+
+def parse_routes(spec):
+    """Parse `query=auto,query-batch=fast` (route default tiers)"""
+    routes = {}
+    for part in filter(None, (spec or '').split(',')):
+        name, _, tier = part.partition('=')
+        if name.strip() not in DEFAULT_ROUTES:
+            raise ValueError(f"Unknown route in model routing defaults: {name.strip()}")
+        routes[name.strip()] = tier.strip()
+    return routes
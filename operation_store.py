@@ -0,0 +1,297 @@
+"""Durable record of long-running operations that are still being polled
+
+`JobManager` keeps jobs in memory, so a restart used to forget every upload
+or import that was still indexing: the client saw its job disappear, and the
+usual reaction was to upload the same bytes again. Operations of resumable
+job kinds are written here as soon as Gemini returns them and removed once
+the job finishes. On startup (and on the first request from an API key) the
+job manager re-registers whatever is left under the original job IDs and
+polls it together with the other pending jobs.
+
+Only a hash of the API key is stored; the operations of other keys resume
+when that key is next seen.
+
+Under a pre-forking server every worker process has its own job manager.
+Each persisted operation is claimed by the process that polls it (its PID
+and start time in `worker`), so a resumed operation is polled by one worker
+only; claims of processes that are no longer running are released when a
+worker starts. The start time tells a restarted process from an earlier one
+with the same PID, which is the norm in containers (PID 1).
+Finished jobs are kept in `job_results` for the retention window so that
+`/api/jobs` answers from any worker, not just the one that ran the job.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from lazy_import import lazy_module
+
+logger = logging.getLogger(__name__)
+
+types = lazy_module('google.genai.types')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS operations (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    owner TEXT,
+    operation_name TEXT NOT NULL,
+    operation_type TEXT NOT NULL,
+    store_name TEXT,
+    sha256 TEXT,
+    meta TEXT,
+    created_at REAL NOT NULL,
+    worker TEXT
+);
+CREATE INDEX IF NOT EXISTS operations_owner ON operations (owner);
+CREATE INDEX IF NOT EXISTS operations_upload ON operations (store_name, sha256);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id TEXT PRIMARY KEY,
+    owner TEXT,
+    job TEXT NOT NULL,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_results_finished ON job_results (finished_at);
+"""
+
+
+def process_alive(pid):
+    if os.name == 'nt':
+        # No pre-forking server on Windows, so another PID is an earlier run
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Alive, but owned by another user
+        pass
+    return True
+
+
+def process_start(pid):
+    """Start time of a process in clock ticks since boot, or None where /proc is unavailable"""
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name may contain spaces and parentheses; fields resume after the last ')'
+    return stat[stat.rindex(b')') + 2:].split()[19].decode()
+
+
+_tokens = {}
+
+
+def process_token():
+    """Claim token of this process: `pid:start`, unique across restarts that reuse the PID
+
+    Without /proc the start is a random per-process value; computed per PID
+    so a forked worker gets its own.
+    """
+    pid = os.getpid()
+    if pid not in _tokens:
+        _tokens[pid] = f"{pid}:{process_start(pid) or uuid.uuid4().hex}"
+    return _tokens[pid]
+
+
+def token_alive(token):
+    """Whether the process that wrote a claim token is still running"""
+    if token == process_token():
+        return True
+    pid, _, start = str(token).partition(':')
+    if not pid.isdigit():
+        return False
+    pid = int(pid)
+    # Our PID under another token (or a bare PID from an older version): an earlier run
+    if pid == os.getpid() or not process_alive(pid):
+        return False
+    current = process_start(pid)
+    if current is None or not start:
+        # Cannot tell a reused PID apart; keep the claim
+        return True
+    return current == start
+
+
+def load_operation(type_name, name):
+    """Rebuild an SDK operation object from its type and resource name"""
+    operation_cls = getattr(types, type_name, None)
+    if operation_cls is None:
+        raise ValueError(f"Unknown operation type {type_name}")
+    return operation_cls(name=name)
+
+
+class OperationStore:
+    """SQLite-backed table of in-flight operations, keyed by job ID"""
+
+    def __init__(self, path, retention=3600):
+        self.path = path
+        self.retention = retention
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.resumed = 0
+        self.released = 0
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(operations)')}
+            if 'worker' not in columns:
+                # Tables created before operations were claimed per worker
+                conn.execute('ALTER TABLE operations ADD COLUMN worker TEXT')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, job, created_at=None):
+        """Remember a job's operation until `remove` is called"""
+        upload = job.meta.get('upload') or {}
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO operations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job.id, job.kind, job.owner, job.operation.name, type(job.operation).__name__,
+                 job.meta.get('store_name'), upload.get('sha256'),
+                 json.dumps(job.meta, ensure_ascii=False), created_at or job.created_at, process_token())
+            )
+        with self._lock:
+            self.recorded += 1
+
+    def remove(self, job_id):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM operations WHERE job_id = ?', (job_id,))
+
+    def owners(self):
+        """API key hashes with operations no running process is polling"""
+        with self._connect() as conn:
+            return {row[0] for row in conn.execute('SELECT DISTINCT owner FROM operations WHERE worker IS NULL')}
+
+    def release_stale(self):
+        """Unclaim operations of processes that are no longer running"""
+        with self._connect() as conn:
+            workers = [row[0] for row in conn.execute(
+                'SELECT DISTINCT worker FROM operations WHERE worker IS NOT NULL')]
+            stale = [token for token in workers if not token_alive(token)]
+            released = 0
+            for token in stale:
+                released += conn.execute('UPDATE operations SET worker = NULL WHERE worker = ?', (token,)).rowcount
+        if released:
+            with self._lock:
+                self.released += released
+            logger.info(f"Released {released} operation(s) of {len(stale)} stopped process(es)")
+        return released
+
+    def pending(self, owner):
+        """Claim one API key's unclaimed operations for this process and return them
+
+        Operations come back with rebuilt operation objects.
+        """
+        with self._connect() as conn:
+            # The UPDATE takes SQLite's write lock, so two workers never claim the same row
+            conn.execute(
+                'UPDATE operations SET worker = ? WHERE owner IS ? AND worker IS NULL',
+                (process_token(), owner)
+            )
+            rows = conn.execute(
+                'SELECT job_id, kind, operation_name, operation_type, meta, created_at FROM operations '
+                'WHERE owner IS ? AND worker = ? ORDER BY created_at',
+                (owner, process_token())
+            ).fetchall()
+        entries = []
+        for job_id, kind, operation_name, operation_type, meta, created_at in rows:
+            try:
+                operation = load_operation(operation_type, operation_name)
+            except Exception as e:
+                logger.warning(f"Dropping unresumable operation {operation_name}: {e}")
+                self.remove(job_id)
+                continue
+            entries.append({
+                'job_id': job_id,
+                'kind': kind,
+                'operation': operation,
+                'meta': json.loads(meta) if meta else {},
+                'created_at': created_at
+            })
+        with self._lock:
+            self.resumed += len(entries)
+        return entries
+
+    def find_upload(self, store_name, sha256, owner):
+        """Job ID of a still-pending upload of these bytes to this store, or None"""
+        if not sha256:
+            return None
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT job_id FROM operations WHERE store_name = ? AND sha256 = ? AND owner IS ?',
+                (store_name, sha256, owner)
+            ).fetchone()
+        return row[0] if row else None
+
+    def save_result(self, job):
+        """Keep a finished job's status for lookups from other processes"""
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO job_results VALUES (?, ?, ?, ?)',
+                (job.id, job.owner, json.dumps(job.to_dict(), ensure_ascii=False, default=str), job.finished_at)
+            )
+            conn.execute('DELETE FROM job_results WHERE finished_at < ?', (time.time() - self.retention,))
+
+    def lookup(self, job_id, owner):
+        """Status dict of a job run by another process, or None
+
+        Finished jobs come from `job_results`; operations still being polled
+        elsewhere are reported from their persisted record.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT job FROM job_results WHERE job_id = ? AND owner IS ?', (job_id, owner)
+            ).fetchone()
+            if row:
+                return json.loads(row[0])
+            row = conn.execute(
+                'SELECT kind, operation_name, meta, created_at, worker FROM operations '
+                'WHERE job_id = ? AND owner IS ?',
+                (job_id, owner)
+            ).fetchone()
+        if row is None:
+            return None
+        kind, operation_name, meta, created_at, worker = row
+        return {
+            'job_id': job_id,
+            'kind': kind,
+            'status': 'polling',
+            'done': False,
+            'operation_name': operation_name,
+            'elapsed_seconds': round(time.time() - created_at, 3),
+            'created_at': created_at,
+            'result': None,
+            'error': None,
+            'worker': worker,
+            **(json.loads(meta) if meta else {})
+        }
+
+    def stats(self):
+        with self._connect() as conn:
+            pending = conn.execute('SELECT COUNT(*) FROM operations').fetchone()[0]
+            oldest = conn.execute('SELECT MIN(created_at) FROM operations').fetchone()[0]
+            workers = conn.execute(
+                'SELECT COUNT(DISTINCT worker) FROM operations WHERE worker IS NOT NULL').fetchone()[0]
+        with self._lock:
+            return {
+                'pending': pending,
+                'oldest_age_seconds': round(time.time() - oldest, 1) if oldest else None,
+                'polling_processes': workers,
+                'recorded': self.recorded,
+                'resumed': self.resumed,
+                'released': self.released
+            }
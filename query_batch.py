@@ -0,0 +1,262 @@
+"""Run many file search queries against the same stores
+
+Evaluation jobs send hundreds of questions with one shared tool config.
+`QueryBatch` builds the generation config once, fans the queries out over a
+bounded pool (threads for the Flask app, tasks for the ASGI app), retries
+rate-limited calls with backoff and yields results in completion order so
+the route can stream them. Answers go through the same query cache as
+`/api/query`. With a `ModelRouter`, each query is routed to a model tier on
+its own.
+
+`create_batch_job` sends the queries through Gemini's batch mode instead,
+for offline jobs where cost matters more than latency.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import grounding
+from lazy_import import lazy_module
+from query_cache import make_key
+from retry import acall_with_backoff, call_with_backoff
+
+logger = logging.getLogger(__name__)
+
+types = lazy_module('google.genai.types')
+
+# Use gemini-2.5-flash as required by file search documentation
+MODEL = "gemini-2.5-flash"
+
+
+def normalize_queries(queries):
+    """Accept strings or {'id', 'query'} objects; returns [{'id', 'query'}]"""
+    if not isinstance(queries, list) or not queries:
+        raise ValueError('queries must be a non-empty list')
+    items = []
+    for index, entry in enumerate(queries):
+        if isinstance(entry, str):
+            entry = {'query': entry}
+        if not isinstance(entry, dict) or not entry.get('query'):
+            raise ValueError(f'Query {index} is empty')
+        items.append({'id': entry.get('id', index), 'query': entry['query']})
+    return items
+
+
+class QueryBatch:
+    """Fan one batch of queries out with bounded concurrency"""
+
+    def __init__(self, client, tool, store_names, metadata_filter=None, cache=None, owner=None,
+                 concurrency=8, use_cache=True, retries=5, base_delay=1.0, grounding_mode='full',
+                 router=None, hints=None):
+        self.client = client
+        self.tool = tool
+        self.config = types.GenerateContentConfig(tools=[tool])
+        self.router = router
+        self.hints = hints or {}
+        self.store_names = store_names
+        self.metadata_filter = metadata_filter
+        self.cache = cache
+        self.owner = owner
+        self.concurrency = max(1, concurrency)
+        self.use_cache = use_cache
+        self.grounding_mode = grounding_mode
+        self.retries = retries
+        self.base_delay = base_delay
+        self._lock = threading.Lock()
+        self.started_at = None
+        self.finished_at = None
+        self.total = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.cached = 0
+        self.retried = 0
+
+    def _route(self, item):
+        """(route, model, config) for one query; route is None without a router"""
+        if self.router is None:
+            return None, MODEL, self.config
+        route = self.router.resolve('query-batch', self.hints, item['query'], self.store_names)
+        return route, route.model, route.config(tools=[self.tool])
+
+    def _cached(self, item, route):
+        if self.cache is None:
+            return None, None
+        key = make_key(item['query'], self.store_names, self.metadata_filter, self.owner,
+                       route.variant if route else '')
+        return key, self.cache.get(key) if self.use_cache else None
+
+    def _result(self, item, index, started, answer=None, cached=False, retries=0, error=None, route=None):
+        with self._lock:
+            self.retried += retries
+            if error is not None:
+                self.failed += 1
+            else:
+                self.succeeded += 1
+                self.cached += int(cached)
+        result = {
+            'index': index,
+            'id': item['id'],
+            'query': item['query'],
+            'success': error is None,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+            'retries': retries
+        }
+        if route is not None:
+            result['routing'] = {'tier': route.tier, 'model': route.model}
+        if error is not None:
+            result['error'] = str(error)
+        else:
+            result.update(answer, cached=cached)
+            result['grounding_metadata'] = grounding.shape(answer['grounding_metadata'], self.grounding_mode)
+        return result
+
+    def _store(self, key, response):
+        answer = {'response': response.text, 'grounding_metadata': grounding.from_response(response)}
+        if key is not None:
+            self.cache.set(key, answer, self.store_names)
+        return answer
+
+    def _record(self, route, started, response):
+        if route is not None:
+            self.router.record(route, time.perf_counter() - started, response.usage_metadata)
+
+    def _run_one(self, item, index):
+        started = time.perf_counter()
+        route, model, config = self._route(item)
+        key, cached = self._cached(item, route)
+        if cached is not None:
+            return self._result(item, index, started, cached, cached=True, route=route)
+
+        retries = []
+        try:
+            response = call_with_backoff(
+                lambda: self.client.models.generate_content(
+                    model=model, contents=item['query'], config=config),
+                retries=self.retries, base_delay=self.base_delay,
+                on_retry=lambda attempt, error: retries.append(attempt)
+            )
+        except Exception as e:
+            logger.error(f"Batch query {item['id']} failed: {e}")
+            return self._result(item, index, started, retries=len(retries), error=e, route=route)
+        self._record(route, started, response)
+        return self._result(item, index, started, self._store(key, response), retries=len(retries),
+                            route=route)
+
+    async def _run_one_async(self, item, index, semaphore):
+        async with semaphore:
+            started = time.perf_counter()
+            route, model, config = self._route(item)
+            key, cached = self._cached(item, route)
+            if cached is not None:
+                return self._result(item, index, started, cached, cached=True, route=route)
+
+            retries = []
+            try:
+                response = await acall_with_backoff(
+                    lambda: self.client.aio.models.generate_content(
+                        model=model, contents=item['query'], config=config),
+                    retries=self.retries, base_delay=self.base_delay,
+                    on_retry=lambda attempt, error: retries.append(attempt)
+                )
+            except Exception as e:
+                logger.error(f"Batch query {item['id']} failed: {e}")
+                return self._result(item, index, started, retries=len(retries), error=e, route=route)
+            self._record(route, started, response)
+            return self._result(item, index, started, self._store(key, response), retries=len(retries),
+                                route=route)
+
+    def run(self, items):
+        """Yield one result per query as soon as it completes"""
+        self.total = len(items)
+        self.started_at = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=min(self.concurrency, len(items)),
+                                      thread_name_prefix='query-batch')
+        try:
+            futures = [executor.submit(self._run_one, item, i) for i, item in enumerate(items)]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # Stop queued queries if the client went away mid-stream
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.finished_at = time.perf_counter()
+
+    async def run_async(self, items):
+        """Async `run`; concurrency is bounded by a semaphore instead of threads"""
+        self.total = len(items)
+        self.started_at = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = [asyncio.ensure_future(self._run_one_async(item, i, semaphore))
+                 for i, item in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.finished_at = time.perf_counter()
+
+    def summary(self):
+        elapsed = (self.finished_at or time.perf_counter()) - (self.started_at or time.perf_counter())
+        with self._lock:
+            return {
+                'total': self.total,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'cached': self.cached,
+                'retries': self.retried,
+                'concurrency': self.concurrency,
+                'elapsed_seconds': round(elapsed, 3),
+                'queries_per_second': round((self.succeeded + self.failed) / elapsed, 2) if elapsed else 0.0
+            }
+
+
+def inlined_requests(items, tool, route=None):
+    model = route.model if route else MODEL
+    config = route.config(tools=[tool]) if route else types.GenerateContentConfig(tools=[tool])
+    return [types.InlinedRequest(model=model, contents=item['query'], config=config,
+                                 metadata={'id': str(item['id'])})
+            for item in items]
+
+
+def create_batch_job(client, items, tool, display_name=None, route=None):
+    """Submit the queries as one Gemini batch-mode job (about half the cost, hours of latency)
+
+    A batch job runs on a single model, so all queries share one `route`.
+    """
+    return client.batches.create(
+        model=route.model if route else MODEL,
+        src=inlined_requests(items, tool, route),
+        config={'display_name': display_name or f"query-batch-{len(items)}"}
+    )
+
+
+def batch_job_results(batch_job, items, grounding_mode='full'):
+    """Per-query results of a finished batch job, in submission order"""
+    destination = getattr(batch_job, 'dest', None)
+    responses = getattr(destination, 'inlined_responses', None) or []
+    results = []
+    for index, item in enumerate(items):
+        inlined = responses[index] if index < len(responses) else None
+        result = {'index': index, 'id': item['id'], 'query': item['query']}
+        if inlined is None or inlined.error or inlined.response is None:
+            error = getattr(inlined, 'error', None) or 'No response returned'
+            result.update(success=False, error=str(error))
+        else:
+            result.update(success=True, response=inlined.response.text,
+                          grounding_metadata=grounding.shape(grounding.from_response(inlined.response),
+                                                             grounding_mode))
+        results.append(result)
+    return results
+
+
+def batch_job_finished(batch_job, items, grounding_mode='full'):
+    """`on_done` payload for a batch-mode query job"""
+    state = getattr(batch_job, 'state', None)
+    return {
+        'operation': batch_job.name,
+        'state': getattr(state, 'value', state),
+        'results': batch_job_results(batch_job, items, grounding_mode)
+    }
@@ -0,0 +1,217 @@
+"""Response cache for `/api/query`
+
+Answers are cached under the normalized query text, the sorted store names and
+the metadata filter (plus the API key hash, so keys never share answers). Every
+entry is indexed by the stores it touched, so an upload, import or delete on any
+of those stores drops it immediately instead of waiting for the TTL.
+
+Two backends are provided: an in-process LRU (`MemoryBackend`) and a shared
+backend for Redis or any client exposing the same commands (`RedisBackend`).
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text):
+    """Case-fold and collapse whitespace so trivial variations share an entry"""
+    return ' '.join(text.split()).casefold()
+
+
+def make_key(query_text, store_names, metadata_filter=None, owner='', variant=''):
+    """Stable cache key for a query against a set of stores
+
+    `variant` separates answers generated with different models or settings.
+    """
+    payload = json.dumps([
+        owner,
+        normalize_query(query_text),
+        sorted(set(store_names)),
+        (metadata_filter or '').strip(),
+        variant
+    ], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryBackend:
+    """In-process LRU with per-entry expiry"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._by_store = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, store_names, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, store_names, ttl):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, store_names, time.monotonic() + ttl)
+            for store_name in store_names:
+                self._by_store.setdefault(store_name, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_store(self, store_name):
+        with self._lock:
+            keys = self._by_store.pop(store_name, set())
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_store.clear()
+
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for store_name in entry[1]:
+            keys = self._by_store.get(store_name)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_store[store_name]
+
+
+class RedisBackend:
+    """Shared backend over a Redis-compatible client
+
+    Size-bounded eviction is left to the server (`maxmemory-policy allkeys-lru`);
+    TTLs are set on every entry and store index.
+    """
+
+    def __init__(self, client, prefix='gemini-file-sample:query-cache:'):
+        self.client = client
+        self.prefix = prefix
+        self.evictions = 0
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("The redis cache backend requires the 'redis' package: pip install redis")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _index(self, store_name):
+        return f"{self.prefix}store:{store_name}"
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    def set(self, key, value, store_names, ttl):
+        self.client.setex(self.prefix + key, ttl, json.dumps(value, ensure_ascii=False))
+        for store_name in store_names:
+            self.client.sadd(self._index(store_name), key)
+            self.client.expire(self._index(store_name), ttl)
+
+    def invalidate_store(self, store_name):
+        keys = self.client.smembers(self._index(store_name))
+        keys = [k.decode('utf-8') if isinstance(k, bytes) else k for k in keys]
+        if keys:
+            self.client.delete(*[self.prefix + k for k in keys])
+        self.client.delete(self._index(store_name))
+        return len(keys)
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefix}*"):
+            self.client.delete(key)
+
+    def size(self):
+        return None
+
+
+class QueryCache:
+    """TTL cache with store-scoped invalidation and hit-rate counters"""
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"Query cache read failed: {e}")
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value, store_names):
+        try:
+            self.backend.set(key, value, sorted(set(store_names)), self.ttl)
+        except Exception as e:
+            logger.warning(f"Query cache write failed: {e}")
+
+    def invalidate_stores(self, store_names):
+        """Drop every cached answer that involved any of these stores"""
+        removed = 0
+        for store_name in store_names:
+            if not store_name:
+                continue
+            try:
+                removed += self.backend.invalidate_store(store_name)
+            except Exception as e:
+                logger.warning(f"Query cache invalidation failed for {store_name}: {e}")
+        with self._lock:
+            self.invalidations += removed
+        if removed:
+            logger.info(f"Query cache: invalidated {removed} entr(y/ies) for {', '.join(store_names)}")
+        return removed
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'backend': type(self.backend).__name__,
+                'ttl_seconds': self.ttl,
+                'size': self.backend.size(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'evictions': self.backend.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
+
+
+def build_cache(backend='memory', ttl=300, max_entries=1024, redis_url=None):
+    """Create a QueryCache from configuration values"""
+    if backend == 'redis':
+        return QueryCache(RedisBackend.from_url(redis_url or 'redis://localhost:6379/0'), ttl)
+    return QueryCache(MemoryBackend(max_entries), ttl)
@@ -0,0 +1,117 @@
+"""Compact JSON encoding, negotiated compression and ETags for API responses
+
+Grounded answers and document listings are the largest responses the app
+sends, and they went out as plain `jsonify` output encoded by the stdlib.
+
+- `dumps` encodes with orjson when it is installed (several times faster on
+  large listings), falling back to the stdlib encoder for anything orjson
+  rejects, so the output is the same JSON either way
+- `compress` picks brotli or gzip from `Accept-Encoding` (brotli only if the
+  `brotli` package is installed) for compressible bodies above a threshold
+- `etag` hashes the data a listing returns, so a client that already has
+  it gets `304 Not Modified` instead of the same body again
+
+Streamed responses (SSE and NDJSON streams) are never compressed here: a
+compressor would hold events back until its buffer fills.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+
+from werkzeug.http import parse_accept_header
+
+import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/', 'application/javascript',
+                      'image/svg+xml')
+
+# Fast settings: listings and answers are compressed on every request, not cached
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def dumps(obj, default=None, sort_keys=False):
+    """Compact UTF-8 encoded JSON for `obj`; `default` converts unsupported types"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            # Integers beyond 64 bits and the like; the stdlib encoder handles them
+            pass
+    return json.dumps(obj, default=default, sort_keys=sort_keys, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def json_line(obj):
+    """One NDJSON line for streamed responses"""
+    return dumps(obj).decode('utf-8') + '\n'
+
+
+def etag(data):
+    """Validator for the JSON form of `data` (a listing, not the whole response)
+
+    Keys are sorted: the same listing read from the API or from the metadata
+    index has the same fields in a different order.
+    """
+    return hashlib.blake2b(dumps(data, default=str, sort_keys=True), digest_size=16).hexdigest()
+
+
+def available_encodings(spec):
+    """Supported encodings from a preference list like 'br,gzip'"""
+    encodings = []
+    for name in filter(None, (part.strip() for part in (spec or '').split(','))):
+        if name not in ('br', 'gzip'):
+            raise ValueError(f"Unknown response compression: {name}")
+        if name == 'br' and brotli is None:
+            logger.info("brotli package not installed; responses use gzip only")
+            continue
+        encodings.append(name)
+    return tuple(encodings)
+
+
+def compressible(content_type):
+    return (content_type or '').startswith(COMPRESSIBLE_TYPES)
+
+
+def choose_encoding(accept_encoding, encodings):
+    """The first of `encodings` the client accepts with the highest q-value, or None"""
+    accept = parse_accept_header(accept_encoding or '')
+    best, best_quality = None, 0
+    for name in encodings:
+        quality = accept.quality(name)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def compress(body, accept_encoding, encodings, min_bytes):
+    """(body, encoding) for a compressible body; encoding is None if it is sent as is"""
+    encoding = choose_encoding(accept_encoding, encodings) if len(body) >= min_bytes else None
+    if encoding == 'br':
+        compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+    elif encoding == 'gzip':
+        # mtime=0 keeps the output identical for identical bodies
+        compressed = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    else:
+        metrics.response_bytes.inc(len(body), encoding='identity')
+        return body, None
+    metrics.response_bytes.inc(len(compressed), encoding=encoding)
+    metrics.response_bytes_saved.inc(len(body) - len(compressed), encoding=encoding)
+    return compressed, encoding
@@ -0,0 +1,380 @@
+"""Local BM25 index of uploaded text, used to pre-filter queries
+
+Every query used to go to `generate_content` with the File Search tool over
+all the stores it names, even when the answer could be settled locally: a
+question whose words appear in no document of any store, or a multi-store
+query whose terms occur in only one of them.
+
+Text-like uploads (plain text, Markdown, CSV, JSON, XML) are tokenized as
+they are sent to Gemini and stored as an inverted index keyed by content
+hash; documents are linked to their hash when the upload or import
+finishes. At query time `prefilter` scores the documents of the queried
+stores with BM25 and
+
+- drops stores that contain none of the query terms
+- reports "no matching documents" when no store contains any of them
+- proposes a `metadata_filter` value shared by the best-scoring documents
+
+A store only counts as covered when its full document listing is known
+(from the metadata index) and every listed document has indexed text. PDFs,
+oversized files, stores listed only partially and stores a batch is still
+adding to are uncovered and are never dropped, so the pre-filter can narrow
+a query but not lose an answer the index knows nothing about. Matching is lexical: a query phrased with
+synonyms of the document's words is not recognized, which is why the
+pre-filter is off unless enabled.
+"""
+
+import hashlib
+import logging
+import math
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS texts (
+    sha256 TEXT PRIMARY KEY,
+    length INTEGER NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, sha256)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_sha256 ON postings (sha256);
+CREATE TABLE IF NOT EXISTS links (
+    store_name TEXT NOT NULL,
+    document_name TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (store_name, document_name)
+);
+CREATE TABLE IF NOT EXISTS files (
+    file_name TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+MODES = ('off', 'narrow', 'full')
+
+TEXT_TYPES = ('text/', 'application/json', 'application/xml', 'application/csv', 'application/x-ndjson')
+
+# CJK text has no spaces; runs of these characters are indexed as overlapping bigrams
+CJK = '぀-ヿ㐀-䶿一-鿿가-힯豈-﫿'
+TOKEN = re.compile(rf'([{CJK}]+)|([^\W_{CJK}]+)')
+
+STOPWORDS = frozenset('''
+a about an and are as at be but by can do does for from has have how i if in is it its me my
+of on or so that the their there these this those to was what when where which who why will
+with you your
+'''.split())
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Documents scoring at least this fraction of the best score count as top hits
+TOP_SCORE_RATIO = 0.5
+MAX_TOP_DOCUMENTS = 10
+
+
+def tokenize(text):
+    """Lowercased word tokens without stopwords; CJK runs become character bigrams"""
+    tokens = []
+    for cjk, word in TOKEN.findall(text.lower()):
+        if word:
+            if (len(word) > 1 and word not in STOPWORDS) or word.isdigit():
+                tokens.append(word)
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+def is_text(mime_type):
+    mime_type = (mime_type or '').split(';')[0].strip().lower()
+    return mime_type.startswith(TEXT_TYPES) or mime_type.endswith(('+json', '+xml'))
+
+
+def filter_literal(key, value):
+    """`key = value` in metadata_filter syntax, or None if the value cannot be written"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return f'{key} = {int(value) if float(value).is_integer() else value}'
+    if isinstance(value, str) and '"' not in value and '\\' not in value:
+        return f'{key} = "{value}"'
+    return None
+
+
+class RetrievalIndex:
+    """Inverted index of uploaded text plus the store/document links to it"""
+
+    def __init__(self, path, max_bytes=8 * 1024 * 1024, max_workers=1):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='retrieval-index')
+        self.indexed = 0
+        self.skipped = 0
+        self.failures = 0
+        self.decisions = Counter()
+        self.stores_dropped = 0
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # Indexing
+
+    def add_text(self, sha256, stream, mime_type):
+        """Index the text of an upload stream in the background
+
+        Reads at most `max_bytes` and puts the stream back where it was, so
+        the caller can still send it. Binary and oversized files are skipped
+        and leave their documents uncovered. Never raises.
+        """
+        try:
+            if not sha256 or not is_text(mime_type) or self.has_text(sha256):
+                return False
+        except Exception as e:
+            logger.warning(f"Retrieval index: could not check {sha256[:12]}: {e}")
+            return False
+        data = self._read(stream, sha256[:12])
+        if data is None:
+            return False
+        self._executor.submit(self._index, sha256, data)
+        return True
+
+    def add_stream(self, stream, mime_type):
+        """`add_text` for a stream whose hash is not known yet (batch items)
+
+        Returns the content hash to `link` the document with, or None if the
+        stream is not indexed. Never raises.
+        """
+        if not is_text(mime_type):
+            return None
+        data = self._read(stream, 'batch item')
+        if data is None:
+            return None
+        sha256 = hashlib.sha256(data).hexdigest()
+        try:
+            if not self.has_text(sha256):
+                self._executor.submit(self._index, sha256, data)
+        except Exception as e:
+            logger.warning(f"Retrieval index: could not check {sha256[:12]}: {e}")
+            return None
+        return sha256
+
+    def _read(self, stream, label):
+        """All of a stream, put back where it was; None if unreadable or over `max_bytes`"""
+        try:
+            position = stream.tell()
+            data = stream.read(self.max_bytes + 1)
+            stream.seek(position)
+        except Exception as e:
+            logger.warning(f"Retrieval index: could not read {label}: {e}")
+            return None
+        if len(data) > self.max_bytes:
+            with self._lock:
+                self.skipped += 1
+            logger.info(f"Retrieval index: {label} is larger than {self.max_bytes} bytes, not indexed")
+            return None
+        return data
+
+    def _index(self, sha256, data):
+        started = time.perf_counter()
+        try:
+            counts = Counter(tokenize(data.decode('utf-8', errors='replace')))
+            with self._connect() as conn:
+                conn.execute('DELETE FROM postings WHERE sha256 = ?', (sha256,))
+                conn.executemany('INSERT INTO postings VALUES (?, ?, ?)',
+                                 [(term, sha256, tf) for term, tf in counts.items()])
+                conn.execute('INSERT OR REPLACE INTO texts VALUES (?, ?, ?)',
+                             (sha256, sum(counts.values()), time.time()))
+        except Exception as e:
+            logger.warning(f"Retrieval index: indexing {sha256[:12]} failed: {e}")
+            with self._lock:
+                self.failures += 1
+            return
+        seconds = time.perf_counter() - started
+        metrics.retrieval_index_duration.observe(seconds)
+        with self._lock:
+            self.indexed += 1
+        logger.info(f"Retrieval index: {sha256[:12]} indexed, {len(counts)} terms in {seconds * 1000:.0f} ms")
+
+    def has_text(self, sha256):
+        with self._connect() as conn:
+            return conn.execute('SELECT 1 FROM texts WHERE sha256 = ?', (sha256,)).fetchone() is not None
+
+    def link(self, store_name, document_name, sha256):
+        """Record that a store document holds the uploaded bytes `sha256`"""
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO links VALUES (?, ?, ?)', (store_name, document_name, sha256))
+
+    def remember_file(self, file_name, sha256):
+        """Content hash of a Files API upload, for when it is imported into a store"""
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?)', (file_name, sha256, time.time()))
+
+    def link_file(self, store_name, document_name, file_name):
+        with self._connect() as conn:
+            row = conn.execute('SELECT sha256 FROM files WHERE file_name = ?', (file_name,)).fetchone()
+            if row is None:
+                return False
+            conn.execute('INSERT OR REPLACE INTO links VALUES (?, ?, ?)', (store_name, document_name, row[0]))
+        return True
+
+    def forget_store(self, store_name):
+        # Texts stay: the same bytes may be linked from another store
+        with self._connect() as conn:
+            conn.execute('DELETE FROM links WHERE store_name = ?', (store_name,))
+
+    # Queries
+
+    def _covered(self, conn, store_name, documents):
+        """{document name: sha256} if every listed document has indexed text, else None"""
+        if documents is None:
+            return None
+        rows = conn.execute(
+            'SELECT links.document_name, links.sha256 FROM links JOIN texts ON texts.sha256 = links.sha256 '
+            'WHERE links.store_name = ?', (store_name,)
+        ).fetchall()
+        indexed = dict(rows)
+        if any(document['name'] not in indexed for document in documents):
+            return None
+        return {document['name']: indexed[document['name']] for document in documents}
+
+    def _scores(self, conn, terms, hashes):
+        """BM25 score per content hash, over the documents in scope"""
+        hashes = list(hashes)
+        lengths = {}
+        # Batched to stay under SQLite's limit on bound parameters
+        for i in range(0, len(hashes), 500):
+            batch = hashes[i:i + 500]
+            lengths.update(conn.execute(
+                f"SELECT sha256, length FROM texts WHERE sha256 IN ({','.join('?' * len(batch))})", batch).fetchall())
+        by_term = {}
+        for term, sha256, tf in conn.execute(
+                f"SELECT term, sha256, tf FROM postings WHERE term IN ({','.join('?' * len(terms))})", terms):
+            if sha256 in lengths:
+                by_term.setdefault(term, []).append((sha256, tf))
+        count = len(lengths)
+        average = sum(lengths.values()) / count if count else 0
+        scores = Counter()
+        for term, entries in by_term.items():
+            idf = math.log(1 + (count - len(entries) + 0.5) / (len(entries) + 0.5))
+            for sha256, tf in entries:
+                norm = K1 * (1 - B + B * lengths[sha256] / average)
+                scores[sha256] += idf * tf * (K1 + 1) / (tf + norm)
+        return scores
+
+    def prefilter(self, query_text, stores, mode='narrow'):
+        """Decide which of `stores` ({store name: listed documents or None}) a query needs
+
+        Documents should already be restricted to those a metadata_filter
+        admits. Returns a dict with the `store_names` to query, the `outcome`
+        ('no_match', 'narrowed', 'kept', 'uncovered' or 'no_terms') and a
+        `suggested_filter` when the best hits share a metadata value.
+        """
+        started = time.perf_counter()
+        terms = sorted(set(tokenize(query_text)))
+        decision = {'mode': mode, 'store_names': list(stores), 'dropped': [], 'uncovered': [],
+                    'matching_documents': None, 'suggested_filter': None}
+        if not terms:
+            return self._decided(decision, 'no_terms', started)
+
+        with self._connect() as conn:
+            covered = {}
+            for store_name, documents in stores.items():
+                hashes = self._covered(conn, store_name, documents)
+                if hashes is None:
+                    decision['uncovered'].append(store_name)
+                else:
+                    covered[store_name] = hashes
+            if not covered:
+                return self._decided(decision, 'uncovered', started)
+            scores = self._scores(conn, terms, {sha for hashes in covered.values() for sha in hashes.values()})
+
+        matching = {store_name: [name for name, sha in hashes.items() if scores.get(sha)]
+                    for store_name, hashes in covered.items()}
+        decision['matching_documents'] = sum(len(names) for names in matching.values())
+        if not decision['matching_documents']:
+            if decision['uncovered']:
+                # Only stores the index knows nothing about could hold the answer
+                decision['store_names'] = decision['uncovered']
+                decision['dropped'] = list(covered)
+                return self._decided(decision, 'narrowed', started)
+            return self._decided(decision, 'no_match' if mode == 'full' else 'kept', started)
+
+        decision['dropped'] = [store_name for store_name, names in matching.items() if not names]
+        decision['store_names'] = [store_name for store_name in stores if store_name not in decision['dropped']]
+        decision['suggested_filter'] = self._suggest_filter(stores, covered, scores)
+        return self._decided(decision, 'narrowed' if decision['dropped'] else 'kept', started)
+
+    def _suggest_filter(self, stores, covered, scores):
+        """A metadata value shared by all top hits that excludes the most other documents"""
+        hashes = {name: sha for store_hashes in covered.values() for name, sha in store_hashes.items()}
+        documents = [document for store_name in covered for document in stores[store_name]]
+        ranked = sorted(documents, key=lambda document: scores.get(hashes[document['name']], 0), reverse=True)
+        best = scores.get(hashes[ranked[0]['name']], 0)
+        top = [document for document in ranked[:MAX_TOP_DOCUMENTS]
+               if scores.get(hashes[document['name']], 0) >= best * TOP_SCORE_RATIO]
+        shared = {(key, value) for key, value in (top[0].get('custom_metadata') or {}).items()
+                  if filter_literal(key, value)}
+        for document in top[1:]:
+            metadata = document.get('custom_metadata') or {}
+            shared = {(key, value) for key, value in shared if metadata.get(key) == value}
+        best_filter, best_excluded = None, 0
+        for key, value in sorted(shared, key=str):
+            excluded = sum(1 for document in documents if (document.get('custom_metadata') or {}).get(key) != value)
+            if excluded > best_excluded:
+                best_filter, best_excluded = filter_literal(key, value), excluded
+        return best_filter
+
+    def _decided(self, decision, outcome, started):
+        decision['outcome'] = outcome
+        decision['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        metrics.prefilter_decisions.inc(outcome=outcome)
+        if decision['dropped']:
+            metrics.prefilter_stores_dropped.inc(len(decision['dropped']))
+        with self._lock:
+            self.decisions[outcome] += 1
+            self.stores_dropped += len(decision['dropped'])
+        return decision
+
+    def stats(self):
+        with self._connect() as conn:
+            texts, terms = conn.execute('SELECT COUNT(*), COALESCE(SUM(length), 0) FROM texts').fetchone()
+            links = conn.execute('SELECT COUNT(*) FROM links').fetchone()[0]
+        with self._lock:
+            return {
+                'texts': texts,
+                'tokens': terms,
+                'links': links,
+                'indexed': self.indexed,
+                'skipped': self.skipped,
+                'failures': self.failures,
+                'decisions': dict(self.decisions),
+                'stores_dropped': self.stores_dropped
+            }
+
@@ -0,0 +1,64 @@
+"""Retry with exponential backoff for rate-limited Gemini calls"""
+
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = (429, 503)
+
+
+def status_code(exc):
+    """HTTP status carried by an SDK APIError or a requests HTTPError"""
+    code = getattr(exc, 'code', None)
+    if isinstance(code, int):
+        return code
+    response = getattr(exc, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def is_rate_limited(exc):
+    """True for 429/503 responses and quota-exhausted errors"""
+    return status_code(exc) in RETRYABLE_STATUS or 'RESOURCE_EXHAUSTED' in str(exc)
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=30.0):
+    """Jittered exponential delay before retry number `attempt + 1`"""
+    delay = min(base_delay * (2 ** attempt), max_delay)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def call_with_backoff(fn, retries=5, base_delay=1.0, max_delay=30.0, on_retry=None):
+    """Call `fn()`, retrying rate-limit errors with jittered exponential backoff"""
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= retries or not is_rate_limited(e):
+                raise
+            delay = max(backoff_delay(attempt, base_delay, max_delay), getattr(e, 'retry_after', None) or 0)
+            attempt += 1
+            logger.warning(f"Rate limited ({e}); retry {attempt}/{retries} in {delay:.1f}s")
+            if on_retry:
+                on_retry(attempt, e)
+            time.sleep(delay)
+
+
+async def acall_with_backoff(fn, retries=5, base_delay=1.0, max_delay=30.0, on_retry=None):
+    """Async `call_with_backoff`; `fn()` returns an awaitable"""
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt >= retries or not is_rate_limited(e):
+                raise
+            delay = max(backoff_delay(attempt, base_delay, max_delay), getattr(e, 'retry_after', None) or 0)
+            attempt += 1
+            logger.warning(f"Rate limited ({e}); retry {attempt}/{retries} in {delay:.1f}s")
+            if on_retry:
+                on_retry(attempt, e)
+            await asyncio.sleep(delay)
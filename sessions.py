@@ -0,0 +1,319 @@
+"""Server-side conversation sessions for multi-turn file search
+
+`/api/query` is stateless: every question is sent alone, so a follow-up has
+to restate its context. A `Session` keeps the conversation (question and
+answer text only) for a fixed set of stores and sends it back as multi-turn
+`contents` with the same file search tool.
+
+Memory is bounded three ways: at most `max_sessions` sessions (least
+recently used evicted first), sessions idle for `ttl` seconds expire, and
+each session keeps at most `max_turns` turns. History is trimmed in blocks
+of half the window, so the prefix of the conversation stays stable for
+several turns between trims.
+
+When the stable prefix (system instruction plus earlier turns) is large
+enough, it is stored as a Gemini cached content and later turns send only
+the turns after it. Caching is best effort: if creating a cache fails, the
+session keeps sending full history (Gemini may still apply implicit
+caching, which shows up as `cached_tokens` in the usage report).
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from lazy_import import lazy_module
+
+logger = logging.getLogger(__name__)
+
+types = lazy_module('google.genai.types')
+
+# Rough size of a prompt before Gemini has counted it for us
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return len(text or '') // CHARS_PER_TOKEN
+
+
+def turn_contents(turns):
+    """Alternating user/model Content objects for a list of turns"""
+    contents = []
+    for turn in turns:
+        contents.append(types.Content(role='user', parts=[types.Part(text=turn['query'])]))
+        contents.append(types.Content(role='model', parts=[types.Part(text=turn['response'])]))
+    return contents
+
+
+class Session:
+    """One conversation against a fixed set of stores"""
+
+    def __init__(self, owner, store_names, metadata_filter=None, system_instruction=None, route=None):
+        self.id = uuid.uuid4().hex
+        # model_routing.Route chosen at creation; a cache only works with its own model
+        self.route = route
+        self.owner = owner
+        self.store_names = list(store_names)
+        self.metadata_filter = metadata_filter
+        self.system_instruction = system_instruction
+        self.turns = []
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        # Serializes turns so history stays in order
+        self.lock = threading.Lock()
+        # Cached content holding system instruction + turns[:cached_turns]
+        self.cache_name = None
+        self.cached_turns = 0
+        self.cache_expires = 0.0
+        self.cache_disabled = False
+        # Prompt size reported by Gemini for the previous turn
+        self.last_prompt_tokens = 0
+        self.trimmed_turns = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        # [turns, total latency ms] of turns with and without cached tokens
+        self.latency_cached = [0, 0.0]
+        self.latency_uncached = [0, 0.0]
+
+    def savings(self):
+        def average(latency):
+            return round(latency[1] / latency[0], 1) if latency[0] else None
+        return {
+            'prompt_tokens': self.prompt_tokens,
+            'cached_tokens': self.cached_tokens,
+            'cached_ratio': round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+            'avg_latency_cached_ms': average(self.latency_cached),
+            'avg_latency_uncached_ms': average(self.latency_uncached)
+        }
+
+    def to_dict(self, history=False):
+        result = {
+            'session_id': self.id,
+            'store_names': self.store_names,
+            'metadata_filter': self.metadata_filter,
+            'system_instruction': self.system_instruction,
+            'turns': len(self.turns),
+            'trimmed_turns': self.trimmed_turns,
+            'created_at': self.created_at,
+            'cache_name': self.cache_name,
+            'cached_turns': self.cached_turns if self.cache_name else 0,
+            'routing': self.route.to_dict() if self.route else None,
+            'savings': self.savings()
+        }
+        if history:
+            result['history'] = [{'query': t['query'], 'response': t['response']} for t in self.turns]
+        return result
+
+
+class SessionManager:
+    """Bounded LRU of sessions plus the context-cache bookkeeping for each turn"""
+
+    def __init__(self, model, max_sessions=256, ttl=1800, max_turns=20,
+                 cache_min_tokens=2048, cache_enabled=True):
+        self.model = model
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.cache_min_tokens = cache_min_tokens
+        self.cache_enabled = cache_enabled
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.caches_created = 0
+        self.cache_failures = 0
+        self.turns = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def create(self, owner, store_names, metadata_filter=None, system_instruction=None, route=None):
+        session = Session(owner, store_names, metadata_filter, system_instruction, route)
+        with self._lock:
+            self._expire()
+            self._sessions[session.id] = session
+            self.created += 1
+            while len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                self.evictions += 1
+                # Its cached content, if any, runs out with its own TTL
+                logger.info(f"Evicted session {evicted.id} after {len(evicted.turns)} turn(s)")
+        return session
+
+    def get(self, session_id, owner=None):
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None or session.owner != owner:
+                return None
+            self._sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+            return session
+
+    def delete(self, session_id, owner=None):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.owner != owner:
+                return None
+            del self._sessions[session_id]
+            return session
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_used > cutoff:
+                break
+            del self._sessions[session.id]
+            self.expirations += 1
+
+    def drop_cache(self, session, client):
+        """Delete a session's cached content (best effort)"""
+        name, session.cache_name, session.cached_turns = session.cache_name, None, 0
+        if not name:
+            return
+        try:
+            client.caches.delete(name=name)
+        except Exception as e:
+            logger.warning(f"Could not delete cached content {name}: {e}")
+
+    def _trim(self, session, client):
+        """Drop the oldest half of the window once a session reaches max_turns"""
+        if len(session.turns) < self.max_turns:
+            return
+        drop = len(session.turns) - self.max_turns // 2
+        session.turns = session.turns[drop:]
+        session.trimmed_turns += drop
+        # The cached prefix started with turns that are gone now
+        self.drop_cache(session, client)
+
+    def _cache(self, session, client, tool):
+        """Put system instruction + all current turns in a new cached content"""
+        self.drop_cache(session, client)
+        try:
+            cached = client.caches.create(
+                model=self.model_for(session),
+                config=types.CreateCachedContentConfig(
+                    contents=turn_contents(session.turns) or None,
+                    system_instruction=session.system_instruction,
+                    tools=[tool],
+                    ttl=f"{self.ttl}s",
+                    display_name=f"session-{session.id}"
+                )
+            )
+        except Exception as e:
+            # Most often the prefix is below the model's minimum cache size
+            session.cache_disabled = True
+            with self._lock:
+                self.cache_failures += 1
+            logger.warning(f"Context caching disabled for session {session.id}: {e}")
+            return
+        session.cache_name = cached.name
+        session.cached_turns = len(session.turns)
+        session.cache_expires = time.monotonic() + self.ttl
+        with self._lock:
+            self.caches_created += 1
+        logger.info(f"Cached {len(session.turns)} turn(s) of session {session.id} as {cached.name}")
+
+    def model_for(self, session):
+        return session.route.model if session.route else self.model
+
+    def _config(self, session, **kwargs):
+        if session.route:
+            return session.route.config(**kwargs)
+        return types.GenerateContentConfig(**kwargs)
+
+    def prepare(self, session, client, tool, query_text):
+        """(contents, config) for the next turn; call with `session.lock` held"""
+        self._trim(session, client)
+        if session.cache_name and session.cache_expires - time.monotonic() < 60:
+            session.cache_name, session.cached_turns = None, 0
+
+        if self.cache_enabled and not session.cache_disabled:
+            # Tokens that would be re-sent uncached on this turn
+            uncached = turn_contents(session.turns[session.cached_turns:]) if session.cache_name else None
+            prefix_tokens = max(
+                session.last_prompt_tokens,
+                estimate_tokens(session.system_instruction) + sum(
+                    estimate_tokens(t['query']) + estimate_tokens(t['response']) for t in session.turns)
+            )
+            if not session.cache_name and prefix_tokens >= self.cache_min_tokens:
+                self._cache(session, client, tool)
+            elif uncached and sum(estimate_tokens(p.text) for c in uncached for p in c.parts) >= self.cache_min_tokens:
+                # Enough new history since the last cache to be worth re-caching
+                self._cache(session, client, tool)
+
+        question = types.Content(role='user', parts=[types.Part(text=query_text)])
+        if session.cache_name:
+            contents = turn_contents(session.turns[session.cached_turns:]) + [question]
+            config = self._config(session, cached_content=session.cache_name)
+        else:
+            contents = turn_contents(session.turns) + [question]
+            config = self._config(
+                session,
+                tools=[tool],
+                system_instruction=session.system_instruction
+            )
+        return contents, config
+
+    def record(self, session, query_text, response_text, usage, latency_ms):
+        """Append a finished turn and return its usage and savings report"""
+        prompt_tokens = getattr(usage, 'prompt_token_count', None) or 0
+        cached_tokens = getattr(usage, 'cached_content_token_count', None) or 0
+        output_tokens = getattr(usage, 'candidates_token_count', None) or 0
+        history_turns = len(session.turns)
+        session.turns.append({'query': query_text, 'response': response_text})
+        session.last_prompt_tokens = prompt_tokens + output_tokens
+        session.prompt_tokens += prompt_tokens
+        session.cached_tokens += cached_tokens
+        session.output_tokens += output_tokens
+        latency = session.latency_cached if cached_tokens else session.latency_uncached
+        latency[0] += 1
+        latency[1] += latency_ms
+        with self._lock:
+            self.turns += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+
+        if session.cache_name:
+            cache = 'explicit'
+        elif cached_tokens:
+            cache = 'implicit'
+        else:
+            cache = None
+        baseline = session.savings()['avg_latency_uncached_ms']
+        return {
+            'turn': session.trimmed_turns + len(session.turns),
+            'history_turns': history_turns,
+            'cache': cache,
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'cached_tokens': cached_tokens,
+                'output_tokens': output_tokens
+            },
+            'savings': {
+                'cached_ratio': round(cached_tokens / prompt_tokens, 4) if prompt_tokens else 0.0,
+                'latency_ms': latency_ms,
+                # Against the session's average uncached turn, once there is one
+                'latency_saved_ms': round(baseline - latency_ms, 1) if cached_tokens and baseline else None
+            }
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'created': self.created,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'turns': self.turns,
+                'caches_created': self.caches_created,
+                'cache_failures': self.cache_failures,
+                'prompt_tokens': self.prompt_tokens,
+                'cached_tokens': self.cached_tokens,
+                'cached_ratio': round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0
+            }
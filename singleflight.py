@@ -0,0 +1,125 @@
+"""Coalescing of identical in-flight upstream calls
+
+A dashboard that auto-refreshes, or many people opening the UI at once, sends
+the same `/api/list-stores`, `/api/list-documents` and `/api/query` requests
+at the same moment. Caches only help once the first of them has finished, so
+until then every request made its own Gemini call.
+
+`SingleFlight.do(kind, key, fn)` runs `fn` once per key at a time: callers
+that arrive while it is running wait for it and get the same result (or the
+same exception). Keys always include the API key hash, so different keys
+never share a call. `do_async` is the event-loop counterpart used by the
+ASGI app; both count calls made and calls saved per kind.
+"""
+
+import asyncio
+import logging
+import threading
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def _count(self, kind, shared):
+        with self._lock:
+            counts = self._counts.setdefault(kind, {'upstream_calls': 0, 'saved_calls': 0})
+            counts['saved_calls' if shared else 'upstream_calls'] += 1
+        if shared:
+            metrics.coalesced_requests.inc(kind=kind)
+
+    def do(self, kind, key, fn):
+        """Run `fn()` unless an identical call is in flight; returns (result, shared)"""
+        flight = (kind, key)
+        with self._lock:
+            call = self._calls.get(flight)
+            leader = call is None
+            if leader:
+                call = self._calls[flight] = _Call()
+
+        if not leader:
+            call.done.wait()
+            self._count(kind, shared=True)
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        self._count(kind, shared=False)
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[flight]
+            call.done.set()
+        return call.result, False
+
+    async def do_async(self, kind, key, fn):
+        """Await `fn()` unless an identical call is in flight; returns (result, shared)
+
+        The call runs as its own task, so the caller that started it can
+        disconnect without failing the others; it is cancelled only once every
+        caller waiting for it is gone.
+        """
+        flight = (kind, key)
+        with self._lock:
+            call = self._futures.get(flight)
+            leader = call is None
+            if leader:
+                call = self._futures[flight] = {'task': asyncio.ensure_future(fn()), 'waiters': 0}
+                call['task'].add_done_callback(lambda task: self._finished(flight, call))
+            call['waiters'] += 1
+
+        if leader:
+            self._count(kind, shared=False)
+        try:
+            result = await asyncio.shield(call['task'])
+        except asyncio.CancelledError:
+            with self._lock:
+                call['waiters'] -= 1
+                abandoned = call['waiters'] == 0
+            if abandoned:
+                call['task'].cancel()
+            raise
+        if not leader:
+            self._count(kind, shared=True)
+        return result, not leader
+
+    def _finished(self, flight, call):
+        with self._lock:
+            if self._futures.get(flight) is call:
+                del self._futures[flight]
+        task = call['task']
+        if not task.cancelled():
+            # Retrieved here so a failure nobody waited for is not reported as unhandled
+            task.exception()
+
+    def stats(self):
+        with self._lock:
+            kinds = {kind: dict(counts) for kind, counts in self._counts.items()}
+            in_flight = len(self._calls) + len(self._futures)
+        saved = sum(counts['saved_calls'] for counts in kinds.values())
+        made = sum(counts['upstream_calls'] for counts in kinds.values())
+        return {
+            'in_flight': in_flight,
+            'upstream_calls': made,
+            'saved_calls': saved,
+            'saved_ratio': round(saved / (saved + made), 4) if saved + made else 0.0,
+            'kinds': kinds
+        }
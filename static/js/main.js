@@ -83,6 +83,21 @@ function log(message, type = 'info') {
     logBox.scrollTop = logBox.scrollHeight;
 }
 
+// Error for a failed API response; carries the server's retry-after hint when throttled
+function apiError(data) {
+    const error = new Error(data.error || 'API request failed');
+    if (data.retry_after != null) {
+        error.retryAfter = data.retry_after;
+        error.message += `（上游忙碌，請於 ${Math.ceil(data.retry_after)} 秒後重試）`;
+    }
+    if (data.metadata_keys) {
+        error.message += data.metadata_keys.length
+            ? `（已知的 metadata 欄位：${data.metadata_keys.join(', ')}）`
+            : '（這些儲存空間的檔案沒有 custom metadata）';
+    }
+    return error;
+}
+
 // API call wrapper
 async function apiCall(url, options = {}) {
     try {
@@ -100,7 +115,7 @@ async function apiCall(url, options = {}) {
         const data = await response.json();
 
         if (!response.ok) {
-            throw new Error(data.error || 'API request failed');
+            throw apiError(data);
         }
 
         return data;
@@ -110,6 +125,263 @@ async function apiCall(url, options = {}) {
     }
 }
 
+// Last response of each listing URL with its ETag, for If-None-Match revalidation
+const listingCache = new Map();
+
+// GET a listing; when the server answers 304 Not Modified the previous data is
+// returned again with not_modified set instead of downloading it a second time
+async function listingCall(url) {
+    const cached = listingCache.get(url);
+    const headers = cached ? { 'If-None-Match': cached.etag } : {};
+    try {
+        const apiKey = getApiKey();
+        if (!apiKey) {
+            throw new Error('API Key 尚未設定。請先到「設定」頁面輸入您的 API Key。');
+        }
+        headers['X-API-Key'] = apiKey;
+
+        // The browser cache is bypassed so a 304 reaches this code instead of being resolved by it
+        const response = await fetch(url, { headers, cache: 'no-store' });
+        if (response.status === 304 && cached) {
+            return { ...cached.data, not_modified: true };
+        }
+
+        const data = await response.json();
+        if (!response.ok) {
+            throw apiError(data);
+        }
+        const etag = response.headers.get('ETag');
+        if (etag) {
+            listingCache.set(url, { etag, data });
+        }
+        return data;
+    } catch (error) {
+        log(`Error: ${error.message}`, 'error');
+        throw error;
+    }
+}
+
+// POST a JSON body and dispatch each Server-Sent Event to onEvent(event, data)
+async function streamEvents(url, body, onEvent) {
+    const apiKey = getApiKey();
+    if (!apiKey) {
+        throw new Error('API Key 尚未設定。請先到「設定」頁面輸入您的 API Key。');
+    }
+
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'X-API-Key': apiKey },
+        body: JSON.stringify(body)
+    });
+
+    if (!response.ok) {
+        throw apiError(await response.json());
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+            const raw = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = 'message';
+            let data = '';
+            raw.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            onEvent(event, data ? JSON.parse(data) : null);
+        }
+    }
+}
+
+// Poll a background upload/import job until it finishes
+async function waitForJob(jobId, label) {
+    let delay = 1000;
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, delay));
+        const data = await apiCall(`/api/jobs/${jobId}`);
+        const job = data.job;
+
+        if (job.status === 'succeeded') {
+            return job;
+        }
+        if (job.status === 'failed' || job.status === 'timeout') {
+            throw new Error(job.error || `Job ${job.status}`);
+        }
+
+        log(`${label}: ${job.status} (${job.elapsed_seconds}s)...`, 'info');
+        delay = Math.min(delay * 1.5, 10000);
+    }
+}
+
+// Poll a background batch upload until every file (or piece) is done
+async function waitForBatch(batchId, label) {
+    let delay = 1000;
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, delay));
+        const data = await apiCall(`/api/batch-upload/${batchId}`);
+
+        if (data.status !== 'running') {
+            if (data.failed) {
+                throw new Error(`${data.failed} / ${data.total} 個片段上傳失敗`);
+            }
+            return data;
+        }
+
+        log(`${label}: ${data.done} / ${data.total} (${data.elapsed_seconds}s)...`, 'info');
+        delay = Math.min(delay * 1.5, 10000);
+    }
+}
+
+// Chunked uploads: parallel chunk PUTs that resume after an interruption
+const CHUNK_CONCURRENCY = 4;
+const CHUNK_RETRIES = 3;
+
+// localStorage key remembering an unfinished chunked upload of this exact file
+function chunkedUploadKey(file) {
+    return `chunked_upload:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+function showUploadProgress(prefix, loaded, total) {
+    const bar = document.getElementById(`${prefix}-progress`);
+    const text = document.getElementById(`${prefix}-progress-text`);
+    bar.parentElement.style.display = 'flex';
+    bar.max = total || 1;
+    bar.value = total ? loaded : 1;
+    const percent = total ? Math.floor(loaded / total * 100) : 100;
+    text.textContent = `${percent}%（${(loaded / 1048576).toFixed(1)} / ${(total / 1048576).toFixed(1)} MB）`;
+}
+
+// PUT one chunk with XMLHttpRequest, which reports upload progress (fetch does not)
+function putChunk(uploadId, index, blob, onProgress) {
+    return new Promise((resolve, reject) => {
+        const xhr = new XMLHttpRequest();
+        xhr.open('PUT', `/api/uploads/${uploadId}/chunks/${index}`);
+        xhr.setRequestHeader('X-API-Key', getApiKey());
+        xhr.setRequestHeader('Content-Type', 'application/octet-stream');
+        xhr.upload.onprogress = event => onProgress(event.loaded);
+        xhr.onload = () => {
+            let data = {};
+            try {
+                data = JSON.parse(xhr.responseText);
+            } catch (e) {
+                data = { error: `HTTP ${xhr.status}` };
+            }
+            if (xhr.status >= 200 && xhr.status < 300) {
+                resolve(data);
+                return;
+            }
+            const error = apiError(data);
+            error.status = xhr.status;
+            reject(error);
+        };
+        xhr.onerror = () => reject(new Error('網路連線中斷'));
+        xhr.send(blob);
+    });
+}
+
+// Send every chunk the server does not have yet; returns the upload ID.
+// An earlier interrupted upload of the same file continues where it stopped.
+async function uploadChunks(file, progressPrefix) {
+    const apiKey = getApiKey();
+    if (!apiKey) {
+        throw new Error('API Key 尚未設定。請先到「設定」頁面輸入您的 API Key。');
+    }
+
+    const key = chunkedUploadKey(file);
+    let upload = null;
+    const savedId = localStorage.getItem(key);
+    if (savedId) {
+        const response = await fetch(`/api/uploads/${savedId}`, { headers: { 'X-API-Key': apiKey } });
+        if (response.ok) {
+            upload = await response.json();
+            log(`Resuming upload of ${file.name}: ${upload.received.length} / ${upload.chunks} chunks already on the server`, 'info');
+        } else {
+            localStorage.removeItem(key);
+        }
+    }
+    if (!upload) {
+        upload = await apiCall('/api/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ file_name: file.name, size_bytes: file.size, mime_type: file.type })
+        });
+        localStorage.setItem(key, upload.upload_id);
+    }
+
+    const missing = [...upload.missing];
+    const sending = new Map();
+    let doneBytes = upload.received_bytes;
+    let failed = false;
+    const report = () => {
+        let loaded = doneBytes;
+        sending.forEach(bytes => { loaded += bytes; });
+        showUploadProgress(progressPrefix, loaded, file.size);
+    };
+    report();
+
+    async function sendNext() {
+        while (missing.length && !failed) {
+            const index = missing.shift();
+            const start = index * upload.chunk_size;
+            const blob = file.slice(start, Math.min(start + upload.chunk_size, file.size));
+            for (let attempt = 1; ; attempt++) {
+                try {
+                    await putChunk(upload.upload_id, index, blob, loaded => {
+                        sending.set(index, loaded);
+                        report();
+                    });
+                    break;
+                } catch (error) {
+                    sending.delete(index);
+                    if (error.status === 404) {
+                        localStorage.removeItem(key);
+                    }
+                    if (attempt >= CHUNK_RETRIES || error.status === 404) {
+                        failed = true;
+                        throw error;
+                    }
+                    log(`Chunk ${index} failed (${error.message}), retrying...`, 'info');
+                    await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** (attempt - 1)));
+                }
+            }
+            sending.delete(index);
+            doneBytes += blob.size;
+            report();
+        }
+    }
+
+    try {
+        await Promise.all(Array.from({ length: Math.min(CHUNK_CONCURRENCY, missing.length) }, sendNext));
+    } catch (error) {
+        error.message += '（重新選擇同一個檔案再上傳即可從中斷處繼續）';
+        throw error;
+    }
+    return upload.upload_id;
+}
+
+// Assemble an uploaded file on the server and hand it to the store or Files API path
+async function completeChunkedUpload(file, uploadId, body) {
+    try {
+        return await apiCall(`/api/uploads/${uploadId}/complete`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body)
+        });
+    } finally {
+        localStorage.removeItem(chunkedUploadKey(file));
+    }
+}
+
 // Create Store
 async function createStore() {
     const displayName = document.getElementById('store-name').value || 'my-file-search-store';
@@ -137,10 +409,16 @@ async function listStores() {
     log('Fetching store list...', 'info');
 
     try {
-        const data = await apiCall('/api/list-stores');
+        const data = await listingCall('/api/list-stores');
 
         const storeListDiv = document.getElementById('store-list');
 
+        if (data.not_modified && storeListDiv.querySelector('.store-item')) {
+            // Unchanged: keep the rendered list, including any expanded documents
+            log(`Store list unchanged (${data.stores.length} store(s))`, 'success');
+            return;
+        }
+
         if (data.stores.length === 0) {
             storeListDiv.innerHTML = '<p class="info-text">找不到儲存空間。請先建立一個！</p>';
         } else {
@@ -163,12 +441,15 @@ async function listStores() {
             });
         }
 
-        log(`Found ${data.stores.length} store(s)`, 'success');
+        log(`Found ${data.stores.length} store(s)${data.cached ? ' (indexed)' : ''}`, 'success');
     } catch (error) {
         log(`Failed to list stores: ${error.message}`, 'error');
     }
 }
 
+// Documents fetched per page when expanding a store
+const DOCUMENTS_PAGE_SIZE = 20;
+
 // Toggle documents display for a store
 async function toggleDocuments(storeName, containerId) {
     const container = document.getElementById(containerId);
@@ -179,6 +460,12 @@ async function toggleDocuments(storeName, containerId) {
         return;
     }
 
+    // Already loaded once: show it again without another request
+    if (container.dataset.loaded) {
+        container.style.display = 'block';
+        return;
+    }
+
     // Show and load documents
     container.style.display = 'block';
     container.innerHTML = '<p class="info-text">載入中...</p>';
@@ -186,33 +473,74 @@ async function toggleDocuments(storeName, containerId) {
     log(`Fetching documents from ${storeName}...`, 'info');
 
     try {
-        const data = await apiCall(`/api/list-documents?store_name=${encodeURIComponent(storeName)}`);
+        const data = await listingCall(`/api/list-documents?store_name=${encodeURIComponent(storeName)}&page_size=${DOCUMENTS_PAGE_SIZE}`);
 
         if (data.documents.length === 0) {
             container.innerHTML = '<p class="info-text">此儲存空間中沒有檔案。請先上傳檔案！</p>';
             log('No documents found in store', 'info');
         } else {
-            container.innerHTML = `<p class="info-text" style="font-weight: bold; color: #28a745; margin-bottom: 10px;">找到 ${data.count} 個檔案</p>`;
-            data.documents.forEach(doc => {
-                const docItem = document.createElement('div');
-                docItem.style.cssText = 'background: white; padding: 10px; margin-bottom: 8px; border-radius: 4px; border: 1px solid #dee2e6;';
-                docItem.innerHTML = `
-                    <p style="margin: 5px 0;"><strong>📄 檔案名稱：</strong><br>
-                    <code style="background: #e3f2fd; padding: 3px 6px; border-radius: 3px; font-size: 12px; display: inline-block; margin-top: 3px;">${doc.name}</code></p>
-                    <p style="margin: 5px 0; font-size: 13px;"><strong>顯示名稱：</strong> ${doc.display_name}</p>
-                    <p style="margin: 5px 0; font-size: 13px;"><strong>建立時間：</strong> ${doc.create_time}</p>
-                    <p style="margin: 5px 0; font-size: 13px;"><strong>更新時間：</strong> ${doc.update_time}</p>
-                `;
-                container.appendChild(docItem);
-            });
-            log(`Found ${data.count} document(s) in store`, 'success');
+            container.innerHTML = '<p class="info-text documents-count" style="font-weight: bold; color: #28a745; margin-bottom: 10px;"></p>';
+            renderDocumentsPage(storeName, container, data);
         }
+        container.dataset.loaded = 'true';
     } catch (error) {
         container.innerHTML = `<p class="info-text" style="color: #dc3545;">錯誤：${error.message}</p>`;
         log(`Failed to list documents: ${error.message}`, 'error');
     }
 }
 
+// Append one page of documents and a "load more" button when more pages exist
+function renderDocumentsPage(storeName, container, data) {
+    const oldButton = container.querySelector('.load-more');
+    if (oldButton) oldButton.remove();
+
+    data.documents.forEach(doc => {
+        const docItem = document.createElement('div');
+        docItem.className = 'document-item';
+        docItem.style.cssText = 'background: white; padding: 10px; margin-bottom: 8px; border-radius: 4px; border: 1px solid #dee2e6;';
+        docItem.innerHTML = `
+            <p style="margin: 5px 0;"><strong>📄 檔案名稱：</strong><br>
+            <code style="background: #e3f2fd; padding: 3px 6px; border-radius: 3px; font-size: 12px; display: inline-block; margin-top: 3px;">${doc.name}</code></p>
+            <p style="margin: 5px 0; font-size: 13px;"><strong>顯示名稱：</strong> ${doc.display_name}</p>
+            <p style="margin: 5px 0; font-size: 13px;"><strong>建立時間：</strong> ${doc.create_time}</p>
+            <p style="margin: 5px 0; font-size: 13px;"><strong>更新時間：</strong> ${doc.update_time}</p>
+        `;
+        const metadata = Object.entries(doc.custom_metadata || {});
+        if (metadata.length) {
+            const metadataLine = document.createElement('p');
+            metadataLine.style.cssText = 'margin: 5px 0; font-size: 13px;';
+            metadataLine.innerHTML = '<strong>Metadata：</strong> ';
+            metadataLine.append(metadata.map(([key, value]) =>
+                `${key}=${Array.isArray(value) ? value.join('|') : value}`).join(', '));
+            docItem.appendChild(metadataLine);
+        }
+        container.appendChild(docItem);
+    });
+
+    const shown = container.querySelectorAll('.document-item').length;
+    container.querySelector('.documents-count').textContent = data.next_page_token
+        ? `已載入 ${shown} 個檔案（尚有更多）`
+        : `找到 ${shown} 個檔案`;
+    log(`Loaded ${data.count} document(s) from store${data.not_modified ? ' (not modified)' : data.cached ? ' (cached)' : ''}`, 'success');
+
+    if (data.next_page_token) {
+        const button = document.createElement('button');
+        button.className = 'btn btn-small load-more';
+        button.textContent = '載入更多';
+        button.onclick = async () => {
+            button.disabled = true;
+            try {
+                const next = await listingCall(`/api/list-documents?store_name=${encodeURIComponent(storeName)}&page_size=${DOCUMENTS_PAGE_SIZE}&page_token=${encodeURIComponent(data.next_page_token)}`);
+                renderDocumentsPage(storeName, container, next);
+            } catch (error) {
+                button.disabled = false;
+                log(`Failed to list documents: ${error.message}`, 'error');
+            }
+        };
+        container.appendChild(button);
+    }
+}
+
 // Delete Store
 async function deleteStore() {
     const storeName = document.getElementById('delete-store-name').value.trim();
@@ -250,6 +578,7 @@ async function uploadToStore() {
     const fileInput = document.getElementById('direct-upload-file');
     const storeName = document.getElementById('upload-store-name').value.trim();
     const fileName = document.getElementById('upload-file-name').value.trim();
+    const pieceSize = document.getElementById('upload-piece-size').value.trim();
 
     if (!fileInput.files[0]) {
         alert('請選擇檔案');
@@ -261,24 +590,43 @@ async function uploadToStore() {
         return;
     }
 
-    const formData = new FormData();
-    formData.append('file', fileInput.files[0]);
-    formData.append('store_name', storeName);
+    const file = fileInput.files[0];
+    const body = { store_name: storeName };
     if (fileName) {
-        formData.append('file_name', fileName);
+        body.file_name = fileName;
+    }
+    if (pieceSize) {
+        body.piece_size_mb = pieceSize;
     }
 
-    log(`Uploading ${fileInput.files[0].name} to store...`, 'info');
+    log(`Uploading ${file.name} to store...`, 'info');
 
     try {
-        const data = await apiCall('/api/upload-to-store', {
-            method: 'POST',
-            body: formData
-        });
+        const uploadId = await uploadChunks(file, 'direct-upload');
+        const data = await completeChunkedUpload(file, uploadId, body);
+
+        fileInput.value = '';
+        if (data.duplicate && data.pending) {
+            log(`Identical file is still being indexed, following job ${data.job_id}`, 'info');
+        } else if (data.duplicate) {
+            log(`Identical file already in store: ${data.document_name}`, 'info');
+            alert(`此儲存空間已有相同內容的檔案，已略過上傳。\n${data.document_name}`);
+            return;
+        }
+
+        if (data.batch_id) {
+            log(`File split into ${data.pieces} pieces, uploading ${data.concurrency} at a time`, 'info');
+            const summary = await waitForBatch(data.batch_id, 'Upload');
+            log(`${summary.succeeded} pieces imported in ${summary.elapsed_seconds}s (${summary.mb_per_second} MB/s)`, 'success');
+            alert(`檔案已分割為 ${data.pieces} 個片段並上傳匯入成功！`);
+            return;
+        }
+
+        log(`Upload job started: ${data.job_id}`, 'info');
+        await waitForJob(data.job_id, 'Upload');
 
         log(`File uploaded and imported successfully`, 'success');
         alert('檔案上傳並匯入成功！');
-        fileInput.value = '';
     } catch (error) {
         log(`Failed to upload: ${error.message}`, 'error');
         alert(`上傳失敗：${error.message}`);
@@ -295,19 +643,17 @@ async function uploadFile() {
         return;
     }
 
-    const formData = new FormData();
-    formData.append('file', fileInput.files[0]);
+    const file = fileInput.files[0];
+    const body = { target: 'file' };
     if (fileName) {
-        formData.append('file_name', fileName);
+        body.file_name = fileName;
     }
 
-    log(`Uploading ${fileInput.files[0].name}...`, 'info');
+    log(`Uploading ${file.name}...`, 'info');
 
     try {
-        const data = await apiCall('/api/upload-file', {
-            method: 'POST',
-            body: formData
-        });
+        const uploadId = await uploadChunks(file, 'file-upload');
+        const data = await completeChunkedUpload(file, uploadId, body);
 
         log(`File uploaded: ${data.file_name}`, 'success');
 
@@ -368,6 +714,9 @@ async function importFile() {
             })
         });
 
+        log(`Import job started: ${data.job_id}`, 'info');
+        await waitForJob(data.job_id, 'Import');
+
         log(`File imported successfully`, 'success');
         alert('檔案匯入成功！');
     } catch (error) {
@@ -412,6 +761,41 @@ function addMetadataRow() {
     container.appendChild(newRow);
 }
 
+// Conversation session used while "延續對話" is checked, tied to its stores and filter
+let querySession = null;
+
+async function resetSession() {
+    if (querySession) {
+        const sessionId = querySession.id;
+        querySession = null;
+        await apiCall(`/api/sessions/${sessionId}`, {method: 'DELETE'}).catch(() => {});
+        log(`Session ${sessionId} ended`, 'info');
+    }
+}
+
+async function sessionQuery(requestBody) {
+    const key = JSON.stringify([requestBody.store_names, requestBody.metadata_filter || null, requestBody.tier]);
+    if (!querySession || querySession.key !== key) {
+        await resetSession();
+        const created = await apiCall('/api/sessions', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                store_names: requestBody.store_names,
+                metadata_filter: requestBody.metadata_filter,
+                tier: requestBody.tier
+            })
+        });
+        querySession = {id: created.session_id, key: key};
+        log(`Session started: ${created.session_id}`, 'info');
+    }
+    return apiCall(`/api/sessions/${querySession.id}/query`, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({query: requestBody.query, grounding: requestBody.grounding})
+    });
+}
+
 // Query Store
 async function queryStore() {
     const storeNamesInput = document.getElementById('query-store-names').value.trim();
@@ -430,38 +814,94 @@ async function queryStore() {
 
     const requestBody = {
         store_names: storeNames,
-        query: queryText
+        query: queryText,
+        grounding: 'compact',
+        tier: document.getElementById('query-tier').value
     };
 
     if (metadataFilter) {
         requestBody.metadata_filter = metadataFilter;
     }
 
+    const prefilter = document.getElementById('query-prefilter').value;
+    if (prefilter) {
+        requestBody.prefilter = prefilter;
+    }
+
+    const resultBox = document.getElementById('query-result');
+    const groundingBox = document.getElementById('grounding-metadata');
+    resultBox.className = 'result-box';
+    resultBox.textContent = '';
+
+    if (document.getElementById('query-session').checked) {
+        try {
+            const data = await sessionQuery(requestBody);
+            resultBox.className = 'result-box success';
+            resultBox.textContent = data.response;
+            groundingBox.className = 'result-box';
+            if (data.grounding_metadata) {
+                renderGrounding(groundingBox, data.grounding_metadata);
+            } else {
+                groundingBox.innerHTML = '<p class="info-text">無可用的引用資訊</p>';
+            }
+            log(`Turn ${data.turn} completed in ${data.savings.latency_ms} ms ` +
+                `(${data.usage.cached_tokens}/${data.usage.prompt_tokens} prompt tokens cached)`, 'success');
+        } catch (error) {
+            if (error.message.includes('Session not found')) {
+                // Expired or evicted on the server; the next query starts a new one
+                querySession = null;
+            }
+            resultBox.className = 'result-box error';
+            resultBox.textContent = `錯誤：${error.message}`;
+            alert(`查詢失敗：${error.message}`);
+        }
+        return;
+    }
+
     try {
-        const data = await apiCall('/api/query', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(requestBody)
+        // Render tokens as they arrive; grounding metadata comes in the final event
+        let answer = '';
+        let summary = null;
+        await streamEvents('/api/query-stream', requestBody, (event, data) => {
+            if (event === 'chunk') {
+                answer += data.text;
+                resultBox.textContent = answer;
+            } else if (event === 'done') {
+                summary = data;
+            } else if (event === 'error') {
+                throw apiError(data);
+            }
         });
 
-        // Display response
-        const resultBox = document.getElementById('query-result');
+        if (!summary) {
+            throw new Error('Stream ended unexpectedly');
+        }
+
+        if (summary.no_match) {
+            // Settled by the local index without a File Search call
+            resultBox.className = 'result-box';
+            resultBox.textContent = '在所選的儲存空間中找不到相關文件';
+            groundingBox.className = 'result-box';
+            groundingBox.innerHTML = '<p class="info-text">無可用的引用資訊</p>';
+            log(`${summary.message} (checked locally in ${summary.total_ms} ms)`, 'info');
+            return;
+        }
+        logPrefilter(summary.prefilter);
+
         resultBox.className = 'result-box success';
-        resultBox.textContent = data.response;
 
         // Display grounding metadata
-        const groundingBox = document.getElementById('grounding-metadata');
-        if (data.grounding_metadata) {
+        if (summary.grounding_metadata) {
             groundingBox.className = 'result-box';
-            groundingBox.textContent = data.grounding_metadata;
+            renderGrounding(groundingBox, summary.grounding_metadata);
         } else {
             groundingBox.className = 'result-box';
             groundingBox.innerHTML = '<p class="info-text">無可用的引用資訊</p>';
         }
 
-        log(`Query completed successfully`, 'success');
+        const routing = summary.routing ? `, ${summary.routing.tier} tier on ${summary.routing.model}` : '';
+        log(`Query completed successfully (TTFB ${summary.ttfb_ms} ms, total ${summary.total_ms} ms${routing})`, 'success');
     } catch (error) {
-        const resultBox = document.getElementById('query-result');
         resultBox.className = 'result-box error';
         resultBox.textContent = `錯誤：${error.message}`;
 
@@ -470,6 +910,54 @@ async function queryStore() {
     }
 }
 
+// Report what the local retrieval pre-filter did with a query
+function logPrefilter(prefilter) {
+    if (!prefilter) {
+        return;
+    }
+    if (prefilter.dropped.length) {
+        log(`Pre-filter left out ${prefilter.dropped.length} store(s) with no matching document: ` +
+            prefilter.dropped.join(', '), 'info');
+    }
+    if (prefilter.suggested_filter) {
+        log(`Suggested metadata filter: ${prefilter.suggested_filter}`, 'info');
+    }
+}
+
+// Render structured grounding metadata: cited sources, then each citation span
+function renderGrounding(box, grounding) {
+    box.innerHTML = '';
+    const chunks = grounding.chunks || [];
+
+    const sourcesTitle = document.createElement('h4');
+    sourcesTitle.textContent = `引用來源（${(grounding.sources || []).length}）`;
+    box.appendChild(sourcesTitle);
+    const sourceList = document.createElement('ul');
+    (grounding.sources || []).forEach(source => {
+        const item = document.createElement('li');
+        item.textContent = source.title || source.document_name || source.uri;
+        if (source.document_name) {
+            item.title = source.document_name;
+        }
+        sourceList.appendChild(item);
+    });
+    box.appendChild(sourceList);
+
+    (grounding.citations || []).forEach(citation => {
+        const block = document.createElement('blockquote');
+        block.textContent = citation.text || '';
+        const cited = (citation.chunk_indices || [])
+            .map(i => chunks[i] && (chunks[i].title || chunks[i].document_name))
+            .filter(Boolean);
+        if (cited.length) {
+            const sourceNote = document.createElement('small');
+            sourceNote.textContent = ` — ${[...new Set(cited)].join(', ')}`;
+            block.appendChild(sourceNote);
+        }
+        box.appendChild(block);
+    });
+}
+
 // Initialize
 document.addEventListener('DOMContentLoaded', () => {
     // Load saved API key
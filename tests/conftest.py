@@ -0,0 +1,102 @@
+"""Shared fixtures: the Flask app against the fake Gemini backend
+
+app.py reads its configuration and creates its folders at import time, so
+the environment and working directory are set up before it is imported.
+"""
+
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORKDIR = tempfile.mkdtemp(prefix='gemini-file-sample-tests-')
+os.environ.update({
+    'GEMINI_BACKEND': 'fake',
+    'DATA_FOLDER': os.path.join(WORKDIR, 'data'),
+    'UPSTREAM_RATE_LIMITS': 'generate=1000:1000,upload=1000:1000,operations=1000:1000,list=1000:1000',
+    'IMPORT_WARMUP': '0'
+})
+
+import fake_genai  # noqa: E402
+
+fake_genai._default_backend = fake_genai.FakeBackend(fake_genai.FakeConfig(latency=0.0, operation_delay=0.0))
+
+API_KEY = 'test-key'
+
+
+@pytest.fixture(scope='session')
+def backend():
+    return fake_genai._default_backend
+
+
+@pytest.fixture(scope='session')
+def sync_app(backend):
+    # The upload folder is created relative to the working directory
+    os.chdir(WORKDIR)
+    import app
+    return app
+
+
+@pytest.fixture
+def client(sync_app):
+    client = sync_app.app.test_client()
+    client.environ_base['HTTP_X_API_KEY'] = API_KEY
+    return client
+
+
+@pytest.fixture
+def store_name(client):
+    response = client.post('/api/create-store', json={'display_name': 'test-store'})
+    assert response.status_code == 200
+    return response.get_json()['store_name']
+
+
+@pytest.fixture
+def running_batch(client, store_name, sync_app, monkeypatch):
+    """A two-file batch into `store_name`, held after the first file is imported
+
+    Both files carry `genre = "fiction"`. Calling the fixture's value lets the
+    second file through and waits for the batch to finish.
+    """
+    release = threading.Event()
+    upload = fake_genai.FakeFiles.upload
+
+    def held_upload(self, *, file, config=None):
+        if fake_genai._get(config, 'display_name') == 'second.txt':
+            release.wait(10)
+        return upload(self, file=file, config=config)
+
+    monkeypatch.setattr(fake_genai.FakeFiles, 'upload', held_upload)
+    response = client.post('/api/batch-upload', data={
+        'store_name': store_name,
+        'concurrency': '1',
+        'custom_metadata': json.dumps({'*': [{'key': 'genre', 'string_value': 'fiction'}]}),
+        'files': [(io.BytesIO(b'first document about rome'), 'first.txt'),
+                  (io.BytesIO(b'second document about carthage'), 'second.txt')]
+    })
+    assert response.status_code == 202
+    ingestor = sync_app.batches[response.get_json()['batch_id']]
+    wait_until(lambda: ingestor.results, 'first batch item never finished')
+
+    def finish():
+        release.set()
+        wait_until(lambda: ingestor.status != 'running', 'batch never finished')
+        return ingestor
+
+    yield finish
+    finish()
+
+
+def wait_until(condition, message, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, message
+        time.sleep(0.01)
@@ -0,0 +1,64 @@
+import asyncio
+
+import httpx
+import pytest
+
+from conftest import API_KEY
+
+
+@pytest.fixture
+def asgi_app(sync_app):
+    import asgi_app
+    return asgi_app
+
+
+def request(asgi_app, method, path, **kwargs):
+    async def send():
+        transport = httpx.ASGITransport(app=asgi_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test',
+                                     headers={'X-API-Key': API_KEY}) as client:
+            return await client.request(method, path, **kwargs)
+    return asyncio.run(send())
+
+
+def test_oversized_body_on_delegated_route_is_rejected(asgi_app, sync_app, monkeypatch):
+    monkeypatch.setitem(sync_app.app.config, 'MAX_CONTENT_LENGTH', 1024)
+    assert ('POST', '/api/batch-upload') not in asgi_app.ROUTES
+    response = request(asgi_app, 'POST', '/api/batch-upload', content=b'x' * 4096,
+                       headers={'Content-Type': 'application/octet-stream'})
+    assert response.status_code == 413
+    assert response.json()['success'] is False
+
+
+def test_list_stores_and_documents(asgi_app, store_name):
+    response = request(asgi_app, 'GET', '/api/list-stores', params={'refresh': 'true'})
+    assert response.status_code == 200
+    assert store_name in [store['name'] for store in response.json()['stores']]
+    response = request(asgi_app, 'GET', '/api/list-stores')
+    assert response.json()['cached']
+
+    response = request(asgi_app, 'GET', '/api/list-documents', params={'store_name': store_name, 'refresh': 'true'})
+    assert response.status_code == 200
+    assert response.json()['success']
+    response = request(asgi_app, 'GET', '/api/list-documents', params={'store_name': store_name, 'format': 'ndjson'})
+    assert response.status_code == 200
+    assert 'error' not in response.text
+
+
+def test_split_upload_rejects_bad_concurrency(asgi_app, store_name):
+    response = request(asgi_app, 'POST', '/api/upload-to-store', data={
+        'store_name': store_name, 'piece_size_mb': '0.0001', 'concurrency': '0'},
+        files={'file': ('big.txt', b'line of text\n' * 100, 'text/plain')})
+    assert response.status_code == 400
+    assert 'concurrency must be at least 1' in response.json()['error']
+
+
+def test_split_upload(asgi_app, sync_app, store_name):
+    response = request(asgi_app, 'POST', '/api/upload-to-store', data={
+        'store_name': store_name, 'piece_size_mb': '0.0005', 'concurrency': '2'},
+        files={'file': ('big.txt', b'line of text\n' * 100, 'text/plain')})
+    assert response.status_code == 202, response.json()
+    ingestor = sync_app.batches[response.json()['batch_id']]
+    assert sync_app.drain_batches(10) == 0
+    assert ingestor.status == 'completed'
+    assert all(result['status'] == 'succeeded' for result in ingestor.results)
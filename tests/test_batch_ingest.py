@@ -0,0 +1,34 @@
+import io
+import threading
+
+import pytest
+
+
+def test_shutdown_waits_for_running_batches(sync_app, running_batch):
+    assert sync_app.drain_batches(0.05) == 1
+
+    threading.Timer(0.1, running_batch).start()
+    assert sync_app.drain_batches(10) == 0
+    assert not sync_app.batch_running(list({ingestor.store_name for ingestor in sync_app.batches.values()}))
+
+
+@pytest.mark.parametrize('fields, error', [
+    ({'concurrency': '0'}, 'concurrency must be at least 1'),
+    ({'concurrency': '-3'}, 'concurrency must be at least 1'),
+    ({'concurrency': 'many'}, 'concurrency must be an integer'),
+    ({'custom_metadata': '{not json'}, 'custom_metadata is not valid JSON'),
+    ({'custom_metadata': '[]'}, 'custom_metadata must be a JSON object'),
+])
+def test_batch_upload_rejects_bad_fields(client, store_name, sync_app, fields, error):
+    batches = len(sync_app.batches)
+    response = client.post('/api/batch-upload', data={
+        'store_name': store_name, 'files': [(io.BytesIO(b'text'), 'a.txt')], **fields})
+    assert response.status_code == 400
+    assert error in response.get_json()['error']
+    assert len(sync_app.batches) == batches
+
+
+def test_batch_concurrency_is_capped(sync_app):
+    assert sync_app.batch_concurrency(None) == 4
+    assert sync_app.batch_concurrency('1') == 1
+    assert sync_app.batch_concurrency(10 ** 6) == sync_app.app.config['BATCH_MAX_CONCURRENCY']
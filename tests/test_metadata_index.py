@@ -0,0 +1,68 @@
+import pytest
+
+from metadata_index import matches, parse_filter
+
+
+def test_parse_filter_precedence():
+    tree = parse_filter('genre = "fiction" AND (year >= 1930 OR NOT author: "Graves")')
+    assert tree == ('and', [
+        ('compare', 'genre', '=', 'fiction'),
+        ('or', [('compare', 'year', '>=', '1930'), ('not', ('compare', 'author', ':', 'Graves'))])
+    ])
+
+
+def test_parse_filter_implicit_and_and_key_prefix():
+    assert parse_filter('chunk.custom_metadata.genre = "a" year > 2000') == ('and', [
+        ('compare', 'genre', '=', 'a'), ('compare', 'year', '>', '2000')])
+
+
+@pytest.mark.parametrize('expression', ['genre =', 'genre = "a" OR', '(genre = "a"', 'genre ~ "a"', '= "a"'])
+def test_parse_filter_rejects_unsupported(expression):
+    with pytest.raises(ValueError):
+        parse_filter(expression)
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('genre = "fiction"', True),
+    ('genre != "fiction"', False),
+    ('genre = "fic*"', True),
+    ('year >= 1930', True),
+    ('year > 1934', False),
+    ('year = "abc"', False),
+    ('tags = "war"', True),
+    ('tags != "war"', False),
+    ('missing = "x"', False),
+    ('NOT missing = "x"', True),
+    ('genre = "poetry" OR year < 1935', True),
+    ('genre = "fiction" AND tags = "peace"', False),
+])
+def test_matches(expression, expected):
+    metadata = {'genre': 'fiction', 'year': 1934, 'tags': ['war', 'rome']}
+    assert matches(parse_filter(expression), metadata) is expected
+
+
+def test_filter_matching_no_indexed_document_is_rejected(client, store_name):
+    # The new store is indexed with zero documents
+    response = client.post('/api/query', json={'query': 'rome', 'store_names': [store_name],
+                                               'metadata_filter': 'genre = "fiction"'})
+    assert response.status_code == 400
+
+
+def test_filter_check_skips_stores_with_a_running_batch(client, store_name, sync_app, running_batch):
+    response = client.post('/api/query', json={'query': 'rome', 'store_names': [store_name],
+                                               'metadata_filter': 'genre = "fiction"'})
+    assert response.status_code == 200, response.get_json()
+    assert sync_app.batch_running([store_name])
+    running_batch()
+    assert not sync_app.batch_running([store_name])
+
+
+def test_batch_documents_are_added_as_they_finish(client, store_name, sync_app, running_batch):
+    # The first document is already in the cached listing while the second is held
+    with sync_app.metadata_index._connect() as conn:
+        names = [row[0] for row in conn.execute('SELECT display_name FROM documents WHERE store_name = ?',
+                                                (store_name,))]
+    assert names == ['first.txt']
+    # ...but the listing is not treated as complete until it is fetched again
+    owner = sync_app.api_key_hash(client.environ_base['HTTP_X_API_KEY'])
+    assert sync_app.metadata_index.documents(owner, store_name) is None
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from model_routing import ModelRouter, _generation, classify, parse_routes, parse_tiers, word_count
+
+
+def test_word_count_counts_cjk_pairs():
+    assert word_count('what is the plot') == 4
+    assert word_count('這本書的主角是誰') == 4
+
+
+@pytest.mark.parametrize('query_text, store_names, tier', [
+    ('Who wrote I, Claudius?', (), 'fast'),
+    ('主角是誰', (), 'fast'),
+    ('Why did the author choose Rome?', (), 'balanced'),
+    ('Who is Livia?', ('a', 'b', 'c'), 'balanced'),
+    (' '.join(['word'] * 30), (), 'balanced'),
+    ('Compare the two emperors? Why did they differ? ' + ' '.join(['word'] * 30), (), 'deep'),
+])
+def test_classify(query_text, store_names, tier):
+    assert classify(query_text, store_names)[0] == tier
+
+
+def test_classify_explains_itself():
+    tier, reason = classify('Explain the ending? And why?', ('a', 'b', 'c'))
+    assert tier == 'deep'
+    assert reason == '5 words, analytic wording, several questions, 3 stores'
+
+
+def test_generation_parses_overrides():
+    assert _generation(None) == {}
+    assert _generation({'max_output_tokens': '256', 'temperature': 0.5, 'top_p': 1, 'thinking_budget': None}) == {
+        'max_output_tokens': 256, 'temperature': 0.5, 'top_p': 1.0}
+
+
+@pytest.mark.parametrize('overrides, message', [
+    ([], 'generation must be an object'),
+    ({'seed': 1}, 'Unknown generation settings: seed'),
+    ({'max_output_tokens': 0}, 'max_output_tokens must be positive'),
+    ({'max_output_tokens': 'many'}, 'invalid literal'),
+    ({'temperature': 2.5}, 'temperature must be between 0 and 2'),
+    ({'top_p': 0}, 'top_p must be in (0, 1]'),
+    ({'thinking_budget': -2}, 'thinking_budget must be'),
+    ({'temperature': [1]}, 'float() argument'),
+])
+def test_generation_rejects_bad_overrides(overrides, message):
+    with pytest.raises(ValueError) as excinfo:
+        _generation(overrides)
+    assert message in str(excinfo.value)
+
+
+def test_router_resolves_tiers_and_models():
+    router = ModelRouter()
+    route = router.resolve('query', {}, 'Who wrote it?')
+    assert (route.tier, route.model, route.source) == ('fast', 'gemini-2.5-flash', 'classifier')
+    assert route.generation == {'thinking_budget': 0}
+
+    route = router.resolve('sessions', {}, 'Who wrote it?')
+    assert (route.tier, route.source) == ('balanced', 'default')
+
+    route = router.resolve('query', {'tier': 'deep', 'generation': {'temperature': 0.2}}, 'x')
+    assert (route.model, route.source) == ('gemini-2.5-pro', 'requested')
+    assert route.generation == {'thinking_budget': -1, 'temperature': 0.2}
+
+
+def test_pro_model_keeps_a_thinking_budget():
+    router = ModelRouter()
+    route = router.resolve('query', {'tier': 'fast', 'model': 'gemini-2.5-pro'}, 'x')
+    assert route.generation['thinking_budget'] == 128
+    with pytest.raises(ValueError):
+        router.resolve('query', {'model': 'gemini-2.5-pro', 'generation': {'thinking_budget': 0}}, 'x')
+
+
+@pytest.mark.parametrize('data', [{'tier': 'huge'}, {'model': 'gpt-4'}, {'generation': {'top_k': 3}}])
+def test_router_rejects_bad_hints(data):
+    with pytest.raises(ValueError):
+        ModelRouter().check('query', data)
+
+
+def test_parse_specs():
+    assert parse_tiers('fast=gemini-2.5-flash-lite:0, deep=gemini-2.5-pro') == {
+        'fast': ('gemini-2.5-flash-lite', 0), 'deep': ('gemini-2.5-pro', -1)}
+    assert parse_routes('query=fast,query-batch=auto') == {'query': 'fast', 'query-batch': 'auto'}
+    with pytest.raises(ValueError):
+        parse_routes('upload=fast')
+    with pytest.raises(ValueError):
+        ModelRouter(routes={'query': 'huge'})
+
+
+def test_query_rejects_bad_routing_hints(client, store_name):
+    response = client.post('/api/query', json={'query': 'x', 'store_names': [store_name], 'tier': 'huge'})
+    assert response.status_code == 400
+    assert 'tier must be one of' in response.get_json()['error']
+
+
+def test_query_batch_streams_one_json_object_per_line(client, store_name):
+    response = client.post('/api/query-batch', json={'queries': ['書名', 'author'], 'store_names': [store_name]})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(lines) == 3
+    assert lines[-1]['done'] is True
+    assert '書名' in response.get_data(as_text=True)
@@ -0,0 +1,61 @@
+import os
+import types
+
+import pytest
+from google.genai import types as genai_types
+
+import operation_store
+from jobs import JobManager
+from operation_store import OperationStore, process_token, token_alive
+
+
+@pytest.fixture
+def store(tmp_path):
+    return OperationStore(str(tmp_path / 'operations.sqlite3'))
+
+
+def upload_job(job_id='job-1', owner='owner'):
+    return types.SimpleNamespace(
+        id=job_id, kind='upload_to_store', owner=owner, created_at=1.0,
+        operation=genai_types.UploadToFileSearchStoreOperation(name='fileSearchStores/s/operations/1'),
+        meta={'store_name': 'fileSearchStores/s', 'upload': {'sha256': 'abc'}})
+
+
+def earlier_run(monkeypatch):
+    """Make this process claim operations as if it were an earlier run with the same PID"""
+    monkeypatch.setitem(operation_store._tokens, os.getpid(), f'{os.getpid()}:earlier')
+
+
+def test_token_alive():
+    assert token_alive(process_token())
+    assert not token_alive(f'{os.getpid()}:earlier')
+    assert not token_alive(str(os.getpid()))
+    assert not token_alive('not-a-token')
+
+
+def test_live_claims_are_kept(store):
+    store.record(upload_job())
+    assert store.release_stale() == 0
+    assert store.owners() == set()
+
+
+def test_restart_with_the_same_pid_resumes_operations(store, monkeypatch):
+    with monkeypatch.context() as patch:
+        earlier_run(patch)
+        store.record(upload_job())
+
+    jobs = JobManager(store=store)
+    jobs.reclaim()
+    assert jobs.has_unresumed('owner')
+    entries = store.pending('owner')
+    assert [entry['job_id'] for entry in entries] == ['job-1']
+    assert entries[0]['operation'].name == 'fileSearchStores/s/operations/1'
+    assert store.lookup('job-1', 'owner')['worker'] == process_token()
+
+
+def test_bare_pid_claims_from_older_versions_are_released(store):
+    store.record(upload_job())
+    with store._connect() as conn:
+        conn.execute('UPDATE operations SET worker = ?', (os.getpid(),))
+    assert store.release_stale() == 1
+    assert store.owners() == {'owner'}
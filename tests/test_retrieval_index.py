@@ -0,0 +1,138 @@
+import io
+
+import pytest
+
+from conftest import wait_until
+from retrieval_index import RetrievalIndex, filter_literal, tokenize
+
+
+@pytest.fixture
+def index(tmp_path):
+    return RetrievalIndex(str(tmp_path / 'retrieval.sqlite3'), max_bytes=1024)
+
+
+def add(index, store_name, document_name, text, **metadata):
+    sha256 = f'sha-{document_name}'
+    index._index(sha256, text.encode('utf-8'))
+    index.link(store_name, document_name, sha256)
+    return {'name': document_name, 'custom_metadata': metadata}
+
+
+def test_tokenize():
+    assert tokenize('What is the Q3 revenue of 2024?') == ['q3', 'revenue', '2024']
+    assert tokenize('年度報告') == ['年度', '度報', '報告']
+
+
+def test_filter_literal():
+    assert filter_literal('team', 'sec') == 'team = "sec"'
+    assert filter_literal('year', 2024.0) == 'year = 2024'
+    assert filter_literal('team', 'a"b') is None
+    assert filter_literal('flag', True) is None
+
+
+def test_add_stream_hashes_and_rewinds(index):
+    stream = io.BytesIO(b'hello rome')
+    sha256 = index.add_stream(stream, 'text/plain')
+    assert stream.tell() == 0
+    index._executor.submit(lambda: None).result()
+    assert index.has_text(sha256)
+    assert index.add_stream(io.BytesIO(b'%PDF'), 'application/pdf') is None
+    assert index.add_stream(io.BytesIO(b'x' * 2048), 'text/plain') is None
+
+
+def test_unlisted_or_unlinked_stores_are_uncovered(index):
+    linked = add(index, 'a', 'a/doc', 'rome carthage')
+    decision = index.prefilter('rome', {'a': None}, 'full')
+    assert decision['outcome'] == 'uncovered'
+    decision = index.prefilter('rome', {'a': [linked, {'name': 'a/pdf', 'custom_metadata': {}}]}, 'full')
+    assert decision['outcome'] == 'uncovered'
+    assert decision['uncovered'] == ['a']
+
+
+def test_narrow_drops_covered_stores_without_hits(index):
+    stores = {'a': [add(index, 'a', 'a/doc', 'rome carthage')],
+              'b': [add(index, 'b', 'b/doc', 'quarterly revenue')],
+              'c': None}
+    decision = index.prefilter('rome', stores, 'narrow')
+    assert decision['outcome'] == 'narrowed'
+    assert decision['store_names'] == ['a', 'c']
+    assert decision['dropped'] == ['b']
+    assert decision['uncovered'] == ['c']
+    assert decision['matching_documents'] == 1
+
+
+def test_no_match_only_in_full_mode_and_only_when_everything_is_covered(index):
+    stores = {'a': [add(index, 'a', 'a/doc', 'rome carthage')]}
+    assert index.prefilter('revenue', stores, 'full')['outcome'] == 'no_match'
+    assert index.prefilter('revenue', stores, 'narrow')['outcome'] == 'kept'
+
+    # An uncovered store could still hold the answer
+    decision = index.prefilter('revenue', {**stores, 'b': None}, 'full')
+    assert decision['outcome'] == 'narrowed'
+    assert decision['store_names'] == ['b']
+
+
+def test_no_terms(index):
+    assert index.prefilter('what is it?', {'a': []}, 'full')['outcome'] == 'no_terms'
+
+
+def test_suggested_filter(index):
+    stores = {'a': [add(index, 'a', 'a/1', 'rome rome senate', team='hist', year=2020),
+                    add(index, 'a', 'a/2', 'rome senate', team='hist', year=2021),
+                    add(index, 'a', 'a/3', 'revenue', team='fin', year=2020)]}
+    assert index.prefilter('rome senate', stores)['suggested_filter'] == 'team = "hist"'
+
+
+def upload_text(client, store_name, name, text):
+    response = client.post('/api/upload-to-store', data={
+        'store_name': store_name, 'file': (io.BytesIO(text.encode('utf-8')), name)})
+    assert response.status_code == 202, response.get_json()
+    job_id = response.get_json()['job_id']
+    wait_until(lambda: client.get(f'/api/jobs/{job_id}').get_json()['job']['done'], 'upload job never finished')
+
+
+def query(client, store_names, text, mode):
+    response = client.post('/api/query', json={'query': text, 'store_names': store_names, 'prefilter': mode})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def indexed(sync_app):
+    """Wait for background indexing to catch up"""
+    sync_app.retrieval._executor.submit(lambda: None).result()
+
+
+@pytest.fixture
+def covered_store(client, store_name, sync_app):
+    upload_text(client, store_name, 'revenue.txt', 'quarterly revenue report')
+    indexed(sync_app)
+    assert query(client, [store_name], 'carthage', 'full')['no_match']
+    return store_name
+
+
+def test_prefilter_is_not_settled_while_a_batch_is_running(client, covered_store, sync_app, running_batch):
+    other = client.post('/api/create-store', json={'display_name': 'other'}).get_json()['store_name']
+    upload_text(client, other, 'rome.txt', 'rome and carthage')
+    indexed(sync_app)
+
+    # Even a complete listing fetched mid-batch is out of date a moment later
+    assert client.get('/api/list-documents', query_string={'store_name': covered_store}).status_code == 200
+    owner = sync_app.api_key_hash(client.environ_base['HTTP_X_API_KEY'])
+    assert sync_app.metadata_index.documents(owner, covered_store) is not None
+
+    data = query(client, [covered_store], 'senate', 'full')
+    assert not data.get('no_match')
+    assert data['prefilter']['outcome'] == 'uncovered'
+
+    data = query(client, [covered_store, other], 'carthage', 'narrow')
+    assert data['prefilter']['dropped'] == []
+    assert data['prefilter']['uncovered'] == [covered_store]
+
+
+def test_batch_text_is_indexed_and_linked(client, store_name, sync_app, running_batch):
+    running_batch()
+    indexed(sync_app)
+    with sync_app.retrieval._connect() as conn:
+        linked = conn.execute('SELECT COUNT(*) FROM links JOIN texts ON texts.sha256 = links.sha256 '
+                              'WHERE store_name = ?', (store_name,)).fetchone()[0]
+    assert linked == 2
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_followers_survive_a_cancelled_leader():
+    flights = SingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'stores'
+
+    async def main():
+        leader = asyncio.create_task(flights.do_async('list', 'k', fn))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do_async('list', 'k', fn))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == ('stores', True)
+    assert calls == [1]
+    assert flights.stats()['in_flight'] == 0
+
+
+def test_call_is_cancelled_when_every_caller_leaves():
+    flights = SingleFlight()
+    cancelled = []
+
+    async def fn():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def main():
+        callers = [asyncio.create_task(flights.do_async('list', 'k', fn)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert cancelled == [1]
+    assert flights.stats()['in_flight'] == 0
+
+
+def test_errors_are_shared():
+    flights = SingleFlight()
+
+    async def fn():
+        await asyncio.sleep(0.01)
+        raise ValueError('upstream failed')
+
+    async def main():
+        return await asyncio.gather(*(flights.do_async('list', 'k', fn) for _ in range(3)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flights.stats()['kinds']['list'] == {'upstream_calls': 1, 'saved_calls': 0}
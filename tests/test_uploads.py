@@ -0,0 +1,27 @@
+import io
+
+from conftest import API_KEY
+
+
+def test_split_upload_rejects_bad_concurrency(client, store_name):
+    response = client.post('/api/upload-to-store', data={
+        'store_name': store_name, 'piece_size_mb': '0.0001', 'concurrency': '0',
+        'file': (io.BytesIO(b'line of text\n' * 100), 'big.txt')})
+    assert response.status_code == 400
+    assert 'concurrency must be at least 1' in response.get_json()['error']
+
+
+def test_stream_is_closed_unless_handed_off(sync_app, store_name):
+    upload_info = {'sha256': 'f' * 64, 'size_bytes': 4, 'mime_type': 'text/plain'}
+    with sync_app.app.test_request_context(headers={'X-API-Key': API_KEY}):
+        client = sync_app.get_client()
+
+        stream = io.BytesIO(b'text')
+        body, status = sync_app.start_store_upload(client, store_name, 'a.txt', stream, upload_info,
+                                                   {'concurrency': '-1'})
+        assert status == 400 and stream.closed
+
+        stream = io.BytesIO(b'text')
+        sync_app.upload_manifest.record(store_name, upload_info['sha256'], f'{store_name}/documents/x', 'a.txt', 4)
+        body, status = sync_app.start_store_upload(client, store_name, 'a.txt', stream, upload_info, {})
+        assert body['duplicate'] and stream.closed
@@ -0,0 +1,139 @@
+import asyncio
+import types
+
+import pytest
+
+from upstream_guard import (CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, GuardedClient,
+                            UpstreamGuard, classify)
+
+
+class UpstreamError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def tripped_guard():
+    """A guard whose 'generate' breaker is open and ready for a probe"""
+    guard = UpstreamGuard(failure_threshold=1, reset_seconds=0.0)
+    endpoint_class, _ = guard.admit('owner', 'models.generate_content')
+    guard.record('owner', endpoint_class, UpstreamError(503))
+    return guard
+
+
+def breaker(guard):
+    return guard._state('owner', 'generate')[1]
+
+
+def test_classify():
+    assert classify('aio.models.generate_content') == 'generate'
+    assert classify('caches.create') == 'generate'
+    assert classify('operations.get') == 'operations'
+    assert classify('file_search_stores.list') == 'list'
+    assert classify('file_search_stores.upload_to_file_search_store') == 'upload'
+
+
+def test_breaker_opens_after_threshold_and_recovers_with_one_probe():
+    cb = CircuitBreaker(failure_threshold=2, reset_seconds=0.0)
+    cb.record_failure()
+    assert cb.state == CLOSED
+    cb.record_failure()
+    assert cb.state == OPEN and cb.trips == 1
+
+    assert cb.before_call() is None
+    assert cb.state == HALF_OPEN and cb.probing
+    assert cb.before_call() == 1.0
+
+    cb.record_success()
+    assert cb.state == CLOSED and not cb.probing and cb.failures == 0
+
+
+def test_failed_probe_reopens():
+    cb = CircuitBreaker(failure_threshold=5, reset_seconds=60.0)
+    for _ in range(5):
+        cb.record_failure()
+    cb.opened_at -= 60.0
+    assert cb.before_call() is None
+    cb.record_failure()
+    assert cb.state == OPEN and cb.trips == 2
+    assert cb.before_call() > 0
+
+
+def test_client_errors_do_not_trip():
+    guard = UpstreamGuard(failure_threshold=1)
+    guard.record('owner', 'generate', UpstreamError(400))
+    assert breaker(guard).state == CLOSED
+
+
+def test_abandoned_stream_releases_probe():
+    guard = tripped_guard()
+
+    def generate_content_stream():
+        yield 'a'
+        yield 'b'
+
+    models = types.SimpleNamespace(generate_content_stream=generate_content_stream)
+    client = GuardedClient(types.SimpleNamespace(models=models), guard, 'owner')
+
+    stream = client.models.generate_content_stream()
+    assert next(stream) == 'a'
+    assert breaker(guard).probing
+    stream.close()
+
+    assert not breaker(guard).probing
+    # The next call becomes the probe instead of being rejected
+    assert list(client.models.generate_content_stream()) == ['a', 'b']
+    assert breaker(guard).state == CLOSED
+
+
+def test_cancelled_probe_releases_slot():
+    guard = tripped_guard()
+
+    async def generate_content():
+        await asyncio.sleep(10)
+
+    aio = types.SimpleNamespace(models=types.SimpleNamespace(generate_content=generate_content))
+    client = GuardedClient(types.SimpleNamespace(aio=aio), guard, 'owner')
+
+    async def main():
+        task = asyncio.create_task(client.aio.models.generate_content())
+        await asyncio.sleep(0)
+        assert breaker(guard).probing
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert not breaker(guard).probing
+    assert breaker(guard).state == HALF_OPEN
+
+
+def test_abandoned_async_stream_releases_probe():
+    guard = tripped_guard()
+
+    async def stream():
+        yield 'a'
+        yield 'b'
+
+    async def generate_content_stream():
+        return stream()
+
+    aio = types.SimpleNamespace(models=types.SimpleNamespace(generate_content_stream=generate_content_stream))
+    client = GuardedClient(types.SimpleNamespace(aio=aio), guard, 'owner')
+
+    async def main():
+        chunks = await client.aio.models.generate_content_stream()
+        assert await chunks.__anext__() == 'a'
+        await chunks.aclose()
+
+    asyncio.run(main())
+    assert not breaker(guard).probing
+
+
+def test_probe_blocks_other_calls_until_it_settles():
+    guard = tripped_guard()
+    guard.admit('owner', 'models.generate_content')
+    with pytest.raises(CircuitOpenError):
+        guard.admit('owner', 'models.generate_content')
+    guard.record('owner', 'generate', UpstreamError(503))
+    assert breaker(guard).state == OPEN
@@ -0,0 +1,200 @@
+"""Request trace context and timing spans around every Gemini SDK call
+
+Each request gets a trace (continuing an incoming W3C `traceparent` header
+when present). `span()` records named, nested timings into the current trace;
+the app returns them in a `Server-Timing` header so the browser devtools and
+log lines show where the time went within one request.
+
+`InstrumentedClient` wraps a `genai.Client` so that every SDK method call is
+a span and feeds the `gemini_*` Prometheus metrics. Calls made through
+`client.aio` are instrumented the same way, labelled `aio.<call>`.
+"""
+
+import contextvars
+import inspect
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+_current_span = contextvars.ContextVar('span', default=None)
+
+
+class Trace:
+    """Spans recorded for one request"""
+
+    def __init__(self, trace_id=None, parent_id=None):
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.parent_id = parent_id
+        self.span_id = os.urandom(8).hex()
+        self.started = time.perf_counter()
+        self.spans = []
+
+    @classmethod
+    def from_traceparent(cls, header):
+        match = TRACEPARENT_RE.match((header or '').strip().lower())
+        if match:
+            return cls(match.group(1), match.group(2))
+        return cls()
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def server_timing(self):
+        """Server-Timing header value; repeated span names are summed"""
+        totals = {}
+        for span in self.spans:
+            name = re.sub(r'[^A-Za-z0-9_.-]', '_', span['name'])
+            totals[name] = totals.get(name, 0.0) + span['duration_ms']
+        return ', '.join(f"{name};dur={duration:.1f}" for name, duration in totals.items())
+
+
+def start_trace(traceparent=None):
+    trace = Trace.from_traceparent(traceparent)
+    token = _current_trace.set(trace)
+    return trace, token
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a block and record it in the current trace, if any"""
+    trace = _current_trace.get()
+    parent = _current_span.get()
+    token = _current_span.set(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - started) * 1000
+        _current_span.reset(token)
+        if trace is not None:
+            trace.spans.append({
+                'name': name,
+                'parent': parent,
+                'start_ms': round((started - trace.started) * 1000, 2),
+                'duration_ms': round(duration_ms, 2),
+                **attributes
+            })
+            logger.debug(f"trace={trace.trace_id} span={name} {duration_ms:.1f}ms")
+
+
+# Client attributes that are SDK sub-modules; their methods are instrumented
+NAMESPACES = ('file_search_stores', 'documents', 'files', 'operations', 'models', 'batches', 'caches')
+
+
+class InstrumentedClient:
+    """Proxy that times and counts every SDK method call"""
+
+    def __init__(self, target, path=''):
+        self._target = target
+        self._path = path
+
+    @property
+    def unwrapped(self):
+        return self._target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        path = f"{self._path}.{name}" if self._path else name
+        if name in NAMESPACES or (name == 'aio' and not self._path):
+            return InstrumentedClient(attr, path)
+        if self._path not in ('', 'aio') and callable(attr) and not name.startswith('_'):
+            return _instrument(attr, path)
+        return attr
+
+
+def _instrument(fn, call):
+    if inspect.iscoroutinefunction(fn):
+        return _instrument_async(fn, call)
+
+    def wrapper(*args, **kwargs):
+        if call.endswith('operations.get'):
+            metrics.operation_polls.inc()
+        started = time.perf_counter()
+        metrics.upstream_calls_in_flight.inc(call=call)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            _finish(call, started, e)
+            raise
+        if inspect.isgenerator(result):
+            # Streaming calls are timed until the stream is exhausted
+            return _instrument_stream(result, call, started)
+        _finish(call, started)
+        return result
+    return wrapper
+
+
+def _instrument_async(fn, call):
+    async def wrapper(*args, **kwargs):
+        if call.endswith('operations.get'):
+            metrics.operation_polls.inc()
+        started = time.perf_counter()
+        metrics.upstream_calls_in_flight.inc(call=call)
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            _finish(call, started, e)
+            raise
+        if inspect.isasyncgen(result):
+            return _instrument_async_stream(result, call, started)
+        _finish(call, started)
+        return result
+    return wrapper
+
+
+async def _instrument_async_stream(stream, call, started):
+    error = None
+    try:
+        async for item in stream:
+            yield item
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _finish(call, started, error)
+
+
+def _instrument_stream(stream, call, started):
+    error = None
+    try:
+        yield from stream
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _finish(call, started, error)
+
+
+def _finish(call, started, error=None):
+    duration = time.perf_counter() - started
+    metrics.upstream_calls_in_flight.dec(call=call)
+    metrics.upstream_call_duration.observe(duration, call=call)
+    if error is not None:
+        metrics.upstream_errors.inc(call=call, exception=type(error).__name__)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans.append({
+            'name': f"gemini.{call}",
+            'parent': _current_span.get(),
+            'start_ms': round((started - trace.started) * 1000, 2),
+            'duration_ms': round(duration * 1000, 2),
+            'error': type(error).__name__ if error is not None else None
+        })
@@ -0,0 +1,165 @@
+"""Stream multipart uploads straight to Gemini without staging in `uploads/`
+
+Werkzeug already parses each uploaded file into a spooled buffer while the
+request body streams in. Instead of copying that buffer into `uploads/` with
+`file.save()` and reading it back, the routes hand the buffer itself to the
+SDK. Small files never leave memory; larger ones spill to an anonymous,
+per-request temporary file that the OS removes when it is closed, so parallel
+uploads with the same name can no longer overwrite each other.
+"""
+
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from flask import Request
+
+import metrics
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPOOL_MAX_MEMORY = 8 * 1024 * 1024  # 8MB
+
+
+class HashingSpooledFile(tempfile.SpooledTemporaryFile):
+    """Spooled buffer that hashes bytes as the multipart parser writes them"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return super().write(data)
+
+
+class SpooledRequest(Request):
+    """Request whose uploaded files are spooled in memory up to a threshold"""
+
+    spool_max_memory = DEFAULT_SPOOL_MAX_MEMORY
+    spool_dir = None
+
+    def _load_form_data(self):
+        with metrics.upload_parse_duration.time(), span('upload.parse'):
+            super()._load_form_data()
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        return HashingSpooledFile(
+            max_size=self.spool_max_memory,
+            mode='rb+',
+            dir=self.spool_dir
+        )
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class UploadStats:
+    """Aggregate byte counters for streamed uploads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.bytes = 0
+        self.disk_bytes = 0
+        self.spilled = 0
+
+    def record(self, size, on_disk):
+        with self._lock:
+            self.uploads += 1
+            self.bytes += size
+            if on_disk:
+                self.spilled += 1
+                self.disk_bytes += size
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'uploads': self.uploads,
+                'bytes': self.bytes,
+                'disk_bytes': self.disk_bytes,
+                'spilled_to_disk': self.spilled,
+                'peak_rss_bytes': peak_rss_bytes()
+            }
+
+
+upload_stats = UploadStats()
+
+
+def detach_upload(file):
+    """Take ownership of an uploaded file's buffer so it outlives the request
+
+    Returns `(stream, info)` where `stream` is positioned at the start and
+    `info` describes its size, MIME type, SHA-256 (computed while the body
+    was parsed) and whether it spilled to disk. The caller must close the
+    stream once the SDK has consumed it.
+    """
+    stream = file.stream
+    # Werkzeug closes request files at teardown; give it a dummy to close
+    file.stream = io.BytesIO()
+
+    stream.seek(0, io.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+
+    on_disk = bool(getattr(stream, '_rolled', True))
+    mime_type = (file.mimetype if file.mimetype and file.mimetype != 'application/octet-stream'
+                 else None)
+    mime_type = mime_type or mimetypes.guess_type(file.filename or '')[0] or 'application/octet-stream'
+
+    upload_stats.record(size, on_disk)
+    metrics.upload_bytes.inc(size, staged_on_disk=str(on_disk).lower())
+    digest = getattr(stream, 'sha256', None)
+    info = {
+        'size_bytes': size,
+        'mime_type': mime_type,
+        'staged_on_disk': on_disk,
+        'sha256': digest.hexdigest() if digest is not None else None
+    }
+    logger.info(f"Streaming upload {file.filename}: {size} bytes, "
+                f"{'spilled to disk' if on_disk else 'in memory'}")
+    return stream, info
+
+
+def remove_stale_files(folder, max_age):
+    """Delete regular files in `folder` not modified for `max_age` seconds
+
+    Spooled uploads are anonymous and vanish with the process on most
+    platforms, but a crash (or an older version that saved uploads by name)
+    can leave files behind. Returns (files removed, bytes freed).
+    """
+    cutoff = time.time() - max_age
+    removed = freed = 0
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return 0, 0
+    for entry in entries:
+        try:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            info = entry.stat(follow_symlinks=False)
+            if info.st_mtime >= cutoff:
+                continue
+            os.remove(entry.path)
+        except OSError as e:
+            logger.warning(f"Could not remove stale upload file {entry.path}: {e}")
+            continue
+        removed += 1
+        freed += info.st_size
+    if removed:
+        logger.info(f"Removed {removed} stale file(s) ({freed} bytes) from {folder}")
+    return removed, freed
@@ -0,0 +1,374 @@
+"""Client-side rate limiting and circuit breaking for Gemini calls
+
+When Gemini answers with 429s or slows down, retrying everything at full
+speed only makes the overload worse. Every SDK call therefore goes through an
+`UpstreamGuard` keyed by API key and endpoint class (generate, upload,
+operations, list):
+
+- a token bucket paces calls to a sustainable rate; callers wait briefly for
+  a token and are rejected with a retry-after hint when the wait is too long
+- a circuit breaker opens after consecutive upstream failures (429, 5xx,
+  timeouts) and fails calls fast until a single probe call succeeds again
+
+`GuardedClient` applies the guard to a `genai.Client` (including `client.aio`)
+the same way `tracing.InstrumentedClient` applies instrumentation.
+"""
+
+import asyncio
+import inspect
+import logging
+import threading
+import time
+
+import metrics
+from retry import is_rate_limited, status_code
+from tracing import NAMESPACES
+
+logger = logging.getLogger(__name__)
+
+ENDPOINT_CLASSES = ('generate', 'upload', 'operations', 'list')
+
+# Sustained calls per second and burst size, per API key and endpoint class
+DEFAULT_LIMITS = {
+    'generate': (5.0, 10),
+    'upload': (5.0, 10),
+    'operations': (5.0, 10),
+    'list': (10.0, 20)
+}
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class UpstreamUnavailable(Exception):
+    """A call was not sent upstream; retry after `retry_after` seconds"""
+
+    status = 503
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.code = self.status
+
+
+class RateLimitExceeded(UpstreamUnavailable):
+    status = 429
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    status = 503
+
+
+def classify(call):
+    """Endpoint class of an SDK call path such as `aio.models.generate_content`"""
+    call = call[len('aio.'):] if call.startswith('aio.') else call
+    namespace, _, method = call.rpartition('.')
+    # Context caches are created and dropped alongside generate calls
+    if namespace in ('models', 'caches'):
+        return 'generate'
+    if call in ('operations.get', 'batches.get'):
+        return 'operations'
+    if method in ('list', 'get'):
+        return 'list'
+    return 'upload'
+
+
+def is_upstream_failure(exc):
+    """Errors that say the upstream is unhealthy, as opposed to a bad request"""
+    if isinstance(exc, UpstreamUnavailable):
+        return False
+    code = status_code(exc)
+    if is_rate_limited(exc) or (isinstance(code, int) and code >= 500):
+        return True
+    return isinstance(exc, TimeoutError) or 'Timeout' in type(exc).__name__
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, max_wait):
+        """Take a token; returns (granted, seconds to wait before using it)
+
+        Waiting callers are queued by letting the balance go negative, so
+        tokens are handed out in order without a background thread.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = max(0.0, (1 - self.tokens) / self.rate)
+            if wait > max_wait:
+                return False, wait
+            self.tokens -= 1
+            return True, wait
+
+    def to_dict(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {'rate': self.rate, 'capacity': self.capacity, 'tokens': round(self.tokens, 2)}
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Seconds until calls are allowed again, or None to proceed"""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.reset_seconds - time.monotonic()
+                if remaining > 0:
+                    return remaining
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    # Only one probe at a time while recovering
+                    return 1.0
+                self.probing = True
+            return None
+
+    def release_probe(self):
+        with self._lock:
+            self.probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.trips += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def to_dict(self):
+        with self._lock:
+            retry_after = None
+            if self.state == OPEN:
+                retry_after = round(max(0.0, self.opened_at + self.reset_seconds - time.monotonic()), 1)
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'trips': self.trips,
+                'retry_after': retry_after
+            }
+
+
+class UpstreamGuard:
+    """Token buckets and circuit breakers per (API key, endpoint class)"""
+
+    def __init__(self, limits=None, max_wait=5.0, failure_threshold=5, reset_seconds=30.0):
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.max_wait = max_wait
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _state(self, owner, endpoint_class):
+        key = (owner, endpoint_class)
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                rate, capacity = self.limits[endpoint_class]
+                state = self._states[key] = (
+                    TokenBucket(rate, capacity),
+                    CircuitBreaker(self.failure_threshold, self.reset_seconds)
+                )
+            return state
+
+    def admit(self, owner, call):
+        """Admit one call; returns (endpoint_class, seconds to wait) or raises"""
+        endpoint_class = classify(call)
+        bucket, breaker = self._state(owner, endpoint_class)
+        retry_after = breaker.before_call()
+        if retry_after is not None:
+            metrics.upstream_rejections.inc(endpoint_class=endpoint_class, reason='circuit_open')
+            raise CircuitOpenError(
+                f"Gemini {endpoint_class} calls are failing; retry in {retry_after:.1f}s", retry_after)
+        granted, wait = bucket.reserve(self.max_wait)
+        if not granted:
+            # The breaker may have let this call through as its probe
+            breaker.release_probe()
+            metrics.upstream_rejections.inc(endpoint_class=endpoint_class, reason='rate_limited')
+            raise RateLimitExceeded(
+                f"Too many Gemini {endpoint_class} calls; retry in {wait:.1f}s", wait)
+        if wait:
+            metrics.upstream_throttle_wait.observe(wait, endpoint_class=endpoint_class)
+        return endpoint_class, wait
+
+    def record(self, owner, endpoint_class, error=None):
+        _, breaker = self._state(owner, endpoint_class)
+        if error is not None and is_upstream_failure(error):
+            breaker.record_failure()
+            if breaker.state == OPEN:
+                logger.warning(f"Circuit open for {endpoint_class} calls after: {error}")
+        else:
+            breaker.record_success()
+
+    def release(self, owner, endpoint_class):
+        """A call ended without an outcome (cancelled, stream abandoned)"""
+        _, breaker = self._state(owner, endpoint_class)
+        breaker.release_probe()
+
+    def status(self, owner):
+        """Bucket and breaker state of every endpoint class for one API key"""
+        result = {}
+        for endpoint_class in ENDPOINT_CLASSES:
+            bucket, breaker = self._state(owner, endpoint_class)
+            result[endpoint_class] = {**breaker.to_dict(), **bucket.to_dict()}
+        return result
+
+    def summary(self):
+        """Breaker states across all API keys, for /api/stats"""
+        with self._lock:
+            states = list(self._states.items())
+        counts = {CLOSED: 0, OPEN: 0, HALF_OPEN: 0}
+        for _, (_, breaker) in states:
+            counts[breaker.state] += 1
+        return {'tracked': len(states), 'circuits': counts}
+
+
+def parse_limits(spec):
+    """Parse `generate=5:10,upload=2` (rate per second, optional burst)"""
+    limits = {}
+    for part in filter(None, (spec or '').split(',')):
+        name, _, value = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINT_CLASSES:
+            raise ValueError(f"Unknown endpoint class in rate limits: {name}")
+        rate, _, burst = value.partition(':')
+        rate = float(rate)
+        limits[name] = (rate, int(burst) if burst else max(1, int(rate * 2)))
+    return limits
+
+
+class GuardedClient:
+    """Proxy that routes every SDK method call through an UpstreamGuard"""
+
+    def __init__(self, target, guard, owner, path=''):
+        self._target = target
+        self._guard = guard
+        self._owner = owner
+        self._path = path
+
+    @property
+    def unwrapped(self):
+        return self._target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        path = f"{self._path}.{name}" if self._path else name
+        if name in NAMESPACES or (name == 'aio' and not self._path):
+            return GuardedClient(attr, self._guard, self._owner, path)
+        if self._path not in ('', 'aio') and callable(attr) and not name.startswith('_'):
+            return self._wrap(attr, path)
+        return attr
+
+    def _wrap(self, fn, call):
+        guard, owner = self._guard, self._owner
+
+        # Every admitted call ends in `record` (success or upstream failure); any
+        # other exit (cancellation, a stream closed early) only releases the probe
+        # slot, so a half-open breaker is never left waiting on a call that is gone
+        if inspect.iscoroutinefunction(fn):
+            async def async_wrapper(*args, **kwargs):
+                endpoint_class, wait = guard.admit(owner, call)
+                settled = False
+                try:
+                    if wait:
+                        await asyncio.sleep(wait)
+                    try:
+                        result = await fn(*args, **kwargs)
+                    except Exception as e:
+                        settled = True
+                        guard.record(owner, endpoint_class, e)
+                        raise
+                    settled = True
+                    if inspect.isasyncgen(result):
+                        # The stream records the outcome once it is consumed
+                        return _guard_async_stream(result, guard, owner, endpoint_class)
+                    guard.record(owner, endpoint_class)
+                    return result
+                finally:
+                    if not settled:
+                        guard.release(owner, endpoint_class)
+            return async_wrapper
+
+        def wrapper(*args, **kwargs):
+            endpoint_class, wait = guard.admit(owner, call)
+            settled = False
+            try:
+                if wait:
+                    time.sleep(wait)
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    settled = True
+                    guard.record(owner, endpoint_class, e)
+                    raise
+                settled = True
+                if inspect.isgenerator(result):
+                    return _guard_stream(result, guard, owner, endpoint_class)
+                guard.record(owner, endpoint_class)
+                return result
+            finally:
+                if not settled:
+                    guard.release(owner, endpoint_class)
+        return wrapper
+
+
+def _guard_stream(stream, guard, owner, endpoint_class):
+    settled = False
+    try:
+        try:
+            yield from stream
+        except Exception as e:
+            settled = True
+            guard.record(owner, endpoint_class, e)
+            raise
+        settled = True
+        guard.record(owner, endpoint_class)
+    finally:
+        # Closed before the end (client disconnected): neither success nor failure
+        if not settled:
+            guard.release(owner, endpoint_class)
+
+
+async def _guard_async_stream(stream, guard, owner, endpoint_class):
+    settled = False
+    try:
+        try:
+            async for item in stream:
+                yield item
+        except Exception as e:
+            settled = True
+            guard.record(owner, endpoint_class, e)
+            raise
+        settled = True
+        guard.record(owner, endpoint_class)
+    finally:
+        if not settled:
+            guard.release(owner, endpoint_class)